@@ -0,0 +1,354 @@
+"""An in-process emulation of the jupyter-webrtc frontend, for benchmarking without a browser.
+
+:class:`Frontend` replaces ``comm.create_comm`` (the hook the comm package provides for kernels),
+so every widget created while it is installed talks to an emulated JavaScript model instead of
+a real one. The emulated models answer the way the real ones in js/src/webrtc.js do, e.g. an
+``ImageRecorderModel`` sends an image back when recording is set to True, and all messages
+are counted and measured in both directions.
+"""
+
+import asyncio
+import collections
+import json
+import os
+import time
+import uuid
+
+import comm
+from comm.base_comm import BaseComm
+
+KERNEL_TO_FRONTEND = "kernel_to_frontend"
+FRONTEND_TO_KERNEL = "frontend_to_kernel"
+
+
+def _nbytes(buffers):
+    return sum(memoryview(buffer).nbytes for buffer in buffers or [])
+
+
+def _json_size(data):
+    return len(json.dumps(data, default=repr).encode("utf8"))
+
+
+def _put_buffers(state, buffer_paths, buffers):
+    for path, buffer in zip(buffer_paths, buffers):
+        obj = state
+        for key in path[:-1]:
+            obj = obj[key]
+        obj[path[-1]] = buffer
+
+
+class FrontendComm(BaseComm):
+    """A comm of which the other side is an emulated model in the same process."""
+
+    def __init__(self, frontend, **kwargs):
+        self.frontend = frontend
+        super(FrontendComm, self).__init__(**kwargs)
+
+    def publish_msg(self, msg_type, data=None, metadata=None, buffers=None, **keys):
+        self.frontend.receive(self, msg_type, data or {}, list(buffers or []))
+
+
+class Model(object):
+    """Emulates a widget model in the frontend, subclasses emulate specific models."""
+
+    def __init__(self, frontend, comm, state):
+        self.frontend = frontend
+        self.comm = comm
+        self.state = state
+
+    def opened(self):
+        pass
+
+    def update(self, state):
+        old = dict(self.state)
+        self.state.update(state)
+        self.changed(old)
+
+    def changed(self, old):
+        pass
+
+    def custom(self, content, buffers):
+        pass
+
+    def model(self, reference):
+        # widget references are serialized as "IPY_MODEL_<comm_id>"
+        return self.frontend.models[reference[len("IPY_MODEL_") :]]
+
+    def send_update(self, state, buffers=None):
+        """Send a state update, the buffers replace the values of the keys in state."""
+        buffers = buffers or {}
+        data = {
+            "method": "update",
+            "state": dict(state, **{key: None for key in buffers}),
+            "buffer_paths": [[key] for key in buffers],
+        }
+        self.frontend.send(self.comm, data, list(buffers.values()))
+
+    def send_custom(self, content, buffers=None):
+        self.frontend.send(self.comm, {"method": "custom", "content": content}, buffers or [])
+
+
+class ImageRecorderModel(Model):
+    # the size of the frames of the emulated camera, at which an image is snapshot_size bytes
+    width, height = 640, 480
+
+    def changed(self, old):
+        if self.state.get("recording") and not old.get("recording"):
+            # a snapshot: the image is sent to the image widget, after that recording is reset
+            self.send_image(recording=False)
+        if self.state.get("motion") and not old.get("motion"):
+            # a mostly static scene: one in ten compared frames changed, the scores of the
+            # others are sent once per second (every other frame at the default rate)
+            for index in range(self.frontend.frames):
+                content = {"msg": "motion", "time": time.time() * 1000}
+                if index % 10 == 0:
+                    self.send_image()
+                    self.send_custom(dict(content, score=0.2, changed=True))
+                elif index % 2 == 0:
+                    self.send_custom(dict(content, score=0.001, changed=False))
+
+    def send_image(self, **state):
+        # crop and max_width/max_height apply, the size of the image scales with its pixels
+        x, y, width, height = self.state.get("crop") or [0, 0, 1, 1]
+        width, height = width * self.width, height * self.height
+        scale = 1
+        if self.state.get("max_width"):
+            scale = min(scale, self.state["max_width"] / width)
+        if self.state.get("max_height"):
+            scale = min(scale, self.state["max_height"] / height)
+        width, height = max(1, round(width * scale)), max(1, round(height * scale))
+        snapshot = self.frontend.payload("snapshot_size")
+        size = max(1, len(snapshot) * width * height // (self.width * self.height))
+        image = self.model(self.state["image"])
+        image.send_update({}, buffers={"value": snapshot[:size]})
+        self.send_update(dict(state, _width="%dpx" % width, _height="%dpx" % height))
+
+
+class RecorderModel(Model):
+    media = None
+
+    def changed(self, old):
+        if old.get("recording") and not self.state.get("recording"):
+            chunk = self.frontend.payload("chunk_size")
+            chunks = self.frontend.chunks
+            if self.state.get("timeslice") is not None:
+                for index in range(chunks):
+                    content = {"msg": "chunk", "index": index, "time": time.time() * 1000}
+                    self.send_custom(content, [chunk])
+                self.send_custom({"msg": "chunk_end", "chunks": chunks})
+            else:
+                media = self.model(self.state[self.media])
+                media.send_update({}, buffers={"value": bytes(chunk) * chunks})
+
+    def custom(self, content, buffers):
+        if content.get("msg") == "replay_dump":
+            # the replay window, a few chunks
+            window = bytes(self.frontend.payload("chunk_size")) * 4
+            self.send_custom({"msg": "replay", "id": content["id"]}, [window])
+
+
+class VideoRecorderModel(RecorderModel):
+    media = "video"
+
+
+class AudioRecorderModel(RecorderModel):
+    media = "audio"
+
+
+class RecorderGroupModel(Model):
+    """Starts and stops its recorders together, they all start at the same time."""
+
+    def changed(self, old):
+        recording = self.state.get("recording")
+        if recording == old.get("recording"):
+            return
+        recorders = [self.model(reference) for reference in self.state["recorders"]]
+        now = time.time()
+        if recording:
+            self.send_update({"start_time": now, "offsets": [], "stop_offsets": []})
+            self.state["start_time"] = now
+        for recorder in recorders:
+            recorder.update({"recording": recording})
+            recorder.send_update({"recording": recording})
+        # like in the browser, the stop offsets arrive after the data
+        offset = now - (self.state.get("start_time") or now)
+        self.send_update({"offsets" if recording else "stop_offsets": [offset] * len(recorders)})
+
+
+class StreamModel(Model):
+    """Reads a chunked source (see VideoStream.from_file) like the MediaSource pump does."""
+
+    def opened(self):
+        self.offset = 0
+        self.loaded = asyncio.get_event_loop().create_future()
+        if self.state.get("_source"):
+            self.read()
+
+    def changed(self, old):
+        if self.state.get("_source") and not old.get("_source"):
+            self.read()
+
+    def read(self):
+        source = self.state["_source"]
+        if self.offset >= source["size"]:
+            self.loaded.set_result(self.offset)
+            return
+        self.send_custom({"msg": "read", "offset": self.offset, "length": source["chunk_size"]})
+
+    def custom(self, content, buffers):
+        if content.get("msg") == "source_chunk":
+            self.offset += _nbytes(buffers)
+            self.read()
+
+
+class WebRTCPeerModel(Model):
+    """Connects immediately, data sent over the data channel is looped back to the kernel."""
+
+    def custom(self, content, buffers):
+        if content.get("msg") == "connect":
+            self.send_update({"connected": True, "data_channel_open": True})
+        elif content.get("msg") == "data_send":
+            self.send_custom({"msg": "data_sent", "id": content["id"], "duration": 0.0})
+            self.send_custom({"msg": "data", "header": content["header"]}, [bytes(buffers[0])])
+
+
+class WebRTCRoomKernelModel(Model):
+    """Joins the room, and answers like a peer connection: offer, answer and ICE candidates."""
+
+    candidates = 8
+
+    def opened(self):
+        self.room_id = uuid.uuid4().hex
+        self.send_update({"room_id": self.room_id})
+        self.send_custom({"msg": "signal", "messages": [{"type": "join", "room_id": self.room_id}]})
+
+    def custom(self, content, buffers):
+        if content.get("msg") != "signal":
+            return
+        replies = []
+        for message in content["messages"]:
+            sender = message["room_id"]
+            if message.get("type") == "join":
+                replies.append(self.signal(sender, sdp={"type": "offer", "sdp": "v=0"}))
+            elif message.get("sdp", {}).get("type") == "offer":
+                replies.append(self.signal(sender, sdp={"type": "answer", "sdp": "v=0"}))
+            elif message.get("sdp", {}).get("type") == "answer":
+                self.frontend.connections += 1
+                continue
+            else:
+                continue
+            candidates = [{"candidate": "candidate:%d" % i} for i in range(self.candidates)]
+            replies.append(self.signal(sender, candidates=candidates))
+        if replies:
+            self.send_custom({"msg": "signal", "messages": replies})
+
+    def signal(self, to, **message):
+        return dict(message, room_id=self.room_id, to=to)
+
+
+MODELS = {
+    "ImageRecorderModel": ImageRecorderModel,
+    "VideoRecorderModel": VideoRecorderModel,
+    "AudioRecorderModel": AudioRecorderModel,
+    "RecorderGroupModel": RecorderGroupModel,
+    "VideoStreamModel": StreamModel,
+    "AudioStreamModel": StreamModel,
+    "WebRTCPeerModel": WebRTCPeerModel,
+    "WebRTCRoomKernelModel": WebRTCRoomKernelModel,
+}
+
+
+class Frontend(object):
+    """Emulates the frontend of all widgets created while installed (use it as a context manager).
+
+    :param float latency: Delay in seconds before a message from the frontend reaches the kernel.
+    :param int snapshot_size: Size in bytes of the images sent by an ImageRecorder.
+    :param int chunk_size: Size in bytes of the chunks sent by a Video/AudioRecorder.
+    :param int chunks: Number of chunks in a recording.
+    :param int frames: Number of frames an ImageRecorder compares in motion mode.
+    """
+
+    def __init__(
+        self, latency=0.0, snapshot_size=100_000, chunk_size=1 << 20, chunks=16, frames=50
+    ):
+        self.latency = latency
+        self.sizes = {"snapshot_size": snapshot_size, "chunk_size": chunk_size}
+        self.chunks = chunks
+        self.frames = frames
+        self.models = {}
+        self._payloads = {}
+        self._pending = 0
+        self._idle = None
+        self._previous_create_comm = None
+        self.reset()
+
+    def __enter__(self):
+        self._previous_create_comm = comm.create_comm
+        comm.create_comm = self.create_comm
+        return self
+
+    def __exit__(self, *exc_info):
+        comm.create_comm = self._previous_create_comm
+
+    def create_comm(self, **kwargs):
+        return FrontendComm(self, **kwargs)
+
+    def reset(self):
+        """Reset the message and byte counters."""
+        self.messages = collections.Counter()
+        self.bytes = collections.Counter()
+        self.connections = 0
+
+    def payload(self, name):
+        # random data does not compress, and we create it only once
+        if name not in self._payloads:
+            self._payloads[name] = os.urandom(self.sizes[name])
+        return self._payloads[name]
+
+    def _count(self, direction, data, buffers):
+        self.messages[direction] += 1
+        self.bytes[direction] += _json_size(data) + _nbytes(buffers)
+
+    def receive(self, comm, msg_type, data, buffers):
+        """Handle a message from the kernel."""
+        self._count(KERNEL_TO_FRONTEND, data, buffers)
+        if msg_type == "comm_open":
+            state = data.get("state", {})
+            _put_buffers(state, data.get("buffer_paths", []), buffers)
+            model = MODELS.get(state.get("_model_name"), Model)(self, comm, state)
+            self.models[comm.comm_id] = model
+            model.opened()
+        elif msg_type == "comm_close":
+            self.models.pop(comm.comm_id, None)
+        elif msg_type == "comm_msg":
+            model = self.models.get(comm.comm_id)
+            if model is None:
+                return
+            if data.get("method") in ("update", "echo_update"):
+                state = data.get("state", {})
+                _put_buffers(state, data.get("buffer_paths", []), buffers)
+                model.update(state)
+            elif data.get("method") == "custom":
+                model.custom(data.get("content", {}), buffers)
+
+    def send(self, comm, data, buffers):
+        """Send a message to the kernel, it is handled on the event loop like a real message."""
+        self._count(FRONTEND_TO_KERNEL, data, buffers)
+        msg = {"content": {"comm_id": comm.comm_id, "data": data}, "buffers": buffers}
+        self._pending += 1
+        asyncio.get_event_loop().call_later(self.latency, self._deliver, comm, msg)
+
+    def _deliver(self, comm, msg):
+        try:
+            comm.handle_msg(msg)
+        finally:
+            self._pending -= 1
+            if self._pending == 0 and self._idle is not None:
+                self._idle.set_result(None)
+                self._idle = None
+
+    async def drain(self):
+        """Wait till all messages sent by the frontend are handled by the kernel."""
+        while self._pending:
+            self._idle = asyncio.get_event_loop().create_future()
+            await self._idle
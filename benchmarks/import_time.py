@@ -0,0 +1,129 @@
+"""Benchmark of the time it takes to import ipywebrtc in a new Python process.
+
+``import ipywebrtc`` should be cheap, the widgets (and with them ipywidgets and IPython) are
+only imported on first use. Each module is imported in a fresh interpreter, --repeat times,
+and we report the best wall time, and the number of modules the import added::
+
+    $ python benchmarks/import_time.py --output baseline.json
+    $ git checkout my-branch
+    $ python benchmarks/import_time.py --compare baseline.json
+
+The exit code is 1 when an import got slower (or imports more modules) than the threshold
+allows, or when ``import ipywebrtc`` imports one of the modules that should be lazy.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from util import git_commit  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the modules to import, one per process
+MODULES = ["ipywebrtc", "ipywebrtc.webrtc"]
+# modules that import ipywebrtc should not import (yet)
+LAZY = ["ipywebrtc.webrtc", "ipywidgets", "IPython", "traitlets", "urllib.request"]
+
+CHILD = """
+import json, sys, time
+before = set(sys.modules)
+start = time.perf_counter()
+import {module}
+wall = time.perf_counter() - start
+print(json.dumps({{"wall": wall, "modules": sorted(set(sys.modules) - before)}}))
+"""
+
+
+def measure(module):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.environ.get("PYTHONPATH", "")]))
+    output = subprocess.check_output(
+        [sys.executable, "-c", CHILD.format(module=module)], env=env, cwd=ROOT, text=True
+    )
+    return json.loads(output.splitlines()[-1])
+
+
+def run(module, repeat):
+    # the first run (re)writes the bytecode caches
+    measure(module)
+    results = [measure(module) for _ in range(repeat)]
+    imported = results[0]["modules"]
+    return {
+        "wall": min(result["wall"] for result in results),
+        "modules": len(imported),
+        "lazy_imported": [name for name in LAZY if name in imported],
+    }
+
+
+def compare(baseline, current, threshold):
+    """Print the relative changes, and return the names of the regressed metrics."""
+    regressions = []
+    print("%-20s %-12s %14s %14s %8s" % ("module", "metric", "baseline", "current", "change"))
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        for metric in ("wall", "modules"):
+            old, new = baseline["results"][name][metric], result[metric]
+            change = (new - old) / old if old else 0.0
+            flag = ""
+            if change > threshold:
+                flag = " REGRESSION"
+                regressions.append("%s.%s" % (name, metric))
+            print(
+                "%-20s %-12s %14.6g %14.6g %+7.1f%%%s"
+                % (name, metric, old, new, change * 100, flag)
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "modules", nargs="*", help="Modules to import (default all): %s" % ", ".join(MODULES)
+    )
+    parser.add_argument("--repeat", type=int, default=10, help="Runs per module (default 10)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Compare with the JSON results of an earlier run")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="Allowed relative increase (default 0.2)"
+    )
+    args = parser.parse_args(argv)
+
+    failed = False
+    results = {}
+    for module in args.modules or MODULES:
+        results[module] = result = run(module, args.repeat)
+        print(
+            "%-20s wall %8.2fms  modules %5d" % (module, result["wall"] * 1000, result["modules"])
+        )
+        if module == "ipywebrtc" and result["lazy_imported"]:
+            print("import ipywebrtc imports %s" % ", ".join(result["lazy_imported"]))
+            failed = True
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {"repeat": args.repeat},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.threshold)
+        if regressions:
+            print("regressions: %s" % ", ".join(regressions))
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,377 @@
+"""Benchmarks of the kernel side hot paths, against an emulated frontend (see frontend.py).
+
+Measures, per scenario, the wall and CPU time, the latency of the individual operations,
+the number and (serialized) size of the comm messages in both directions, and the peak
+memory allocated by Python::
+
+    $ python benchmarks/run.py --output baseline.json
+    $ git checkout my-branch
+    $ python benchmarks/run.py --compare baseline.json
+
+With --compare, the results are compared with an earlier run, and the exit code is 1 when a
+scenario got slower or sends more data than the threshold allows. Message counts and sizes
+are deterministic, timings are the best of --repeat runs, so runs on the same machine are
+comparable across commits.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from frontend import FRONTEND_TO_KERNEL, KERNEL_TO_FRONTEND, Frontend  # noqa: E402
+from util import git_commit  # noqa: E402
+
+import ipywebrtc.webrtc as webrtc  # noqa: E402
+
+SCENARIOS = {}
+
+
+def scenario(function):
+    SCENARIOS[function.__name__] = function
+    return function
+
+
+@scenario
+async def snapshot(frontend, args):
+    """Take snapshots of a stream with an ImageRecorder."""
+    stream = webrtc.CameraStream()
+    recorder = webrtc.ImageRecorder(stream=stream)
+    latencies = []
+    for _ in range(args.snapshots):
+        start = time.perf_counter()
+        await recorder.snapshot()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+@scenario
+async def snapshot_small(frontend, args):
+    """Take snapshots scaled down to 224x224 (at most) in the browser, before encoding."""
+    stream = webrtc.CameraStream()
+    recorder = webrtc.ImageRecorder(stream=stream, max_width=224, max_height=224)
+    latencies = []
+    for _ in range(args.snapshots):
+        start = time.perf_counter()
+        await recorder.snapshot()
+        latencies.append(time.perf_counter() - start)
+    assert recorder.image.width == "224px"
+    return latencies
+
+
+@scenario
+async def motion(frontend, args):
+    """Watch a mostly static scene with an ImageRecorder, only changed frames are sent."""
+    recorder = webrtc.ImageRecorder(stream=webrtc.CameraStream())
+    images = []
+    recorder.on_motion(lambda recorder, image, score, time: images.append(image))
+    start = time.perf_counter()
+    recorder.motion = True
+    await frontend.drain()
+    latency = time.perf_counter() - start
+    recorder.motion = False
+    assert len(images) == (args.snapshots + 9) // 10 and recorder.motion_score is not None
+    return [latency]
+
+
+@scenario
+async def record(frontend, args):
+    """Record a clip, sent as a whole when recording stops."""
+    recorder = webrtc.VideoRecorder(stream=webrtc.CameraStream())
+    start = time.perf_counter()
+    await recorder.record(0)
+    return [time.perf_counter() - start]
+
+
+@scenario
+async def record_streamed(frontend, args):
+    """Record a clip, streamed in chunks to a spool file (see Recorder.timeslice)."""
+    recorder = webrtc.VideoRecorder(stream=webrtc.CameraStream(), timeslice=1000)
+    start = time.perf_counter()
+    filename = await recorder.record(0)
+    latency = time.perf_counter() - start
+    os.remove(filename)
+    return [latency]
+
+
+@scenario
+async def record_group(frontend, args):
+    """Record clips with a group of recorders, started and stopped together."""
+    # not webm, the emulated recordings are random data, of which we cannot read frame times
+    recorders = [
+        webrtc.VideoRecorder(stream=webrtc.CameraStream(), format="mp4") for _ in range(args.peers)
+    ]
+    group = webrtc.RecorderGroup(recorders=recorders)
+    start = time.perf_counter()
+    recordings = await group.record(0)
+    latency = time.perf_counter() - start
+    assert len(recordings) == args.peers and all(len(r["data"]) for r in recordings)
+    return [latency]
+
+
+@scenario
+async def replay_dump(frontend, args):
+    """Dump the replay window of a running recording (see Recorder.replay_duration)."""
+    recorder = webrtc.VideoRecorder(stream=webrtc.CameraStream(), replay_duration=30)
+    recorder.recording = True
+    latencies = []
+    for _ in range(args.chunks):
+        start = time.perf_counter()
+        await recorder.dump()
+        latencies.append(time.perf_counter() - start)
+    recorder.recording = False
+    return latencies
+
+
+@scenario
+async def from_file(frontend, args):
+    """Load a video file into a VideoStream, sent as a whole."""
+    start = time.perf_counter()
+    webrtc.VideoStream.from_file(args.filename)
+    await frontend.drain()
+    return [time.perf_counter() - start]
+
+
+@scenario
+async def from_file_chunked(frontend, args):
+    """Load a video file into a VideoStream, read in chunks by the frontend."""
+    start = time.perf_counter()
+    stream = webrtc.VideoStream.from_file(args.filename, chunk_size=1 << 20)
+    await frontend.models[stream.model_id].loaded
+    return [time.perf_counter() - start]
+
+
+@scenario
+async def room_join(frontend, args):
+    """Join peers to a room, each connecting with the local stream."""
+    camera = webrtc.CameraStream()
+    room = webrtc.WebRTCRoomLocal(stream=camera)
+    latencies = []
+    for i in range(args.peers):
+        start = time.perf_counter()
+        peer = webrtc.WebRTCPeer(stream_local=camera, id_local=room.room_id, id_remote=str(i))
+        room.peers = room.peers + [peer]
+        peer.connect()
+        await frontend.drain()
+        assert peer.connected
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+@scenario
+async def room_join_kernel(frontend, args):
+    """Join participants to a room with signaling through the kernel (see WebRTCRoomKernel)."""
+    latencies = []
+    rooms = []
+    for i in range(args.peers):
+        start = time.perf_counter()
+        rooms.append(webrtc.WebRTCRoomKernel(room="benchmark", stream=webrtc.CameraStream()))
+        await frontend.drain()
+        # the new participant connects with all others
+        assert frontend.connections == i * (i + 1) // 2
+        latencies.append(time.perf_counter() - start)
+    for room in rooms:
+        room.close()
+    return latencies
+
+
+@scenario
+async def data_channel(frontend, args):
+    """Send arrays over the data channel of a peer (looped back by the emulated frontend)."""
+    import numpy as np
+
+    peer = webrtc.WebRTCPeer(id_local="a", id_remote="b")
+    peer.connect()
+    received = []
+    peer.on_data(lambda peer, data, metadata: received.append(data))
+    array = np.frombuffer(frontend.payload("chunk_size"), dtype=np.uint8)
+    latencies = []
+    for i in range(args.chunks):
+        start = time.perf_counter()
+        await peer.send_data(array, {"index": i})
+        latencies.append(time.perf_counter() - start)
+    await frontend.drain()
+    assert len(received) == args.chunks and received[-1].shape == array.shape
+    return latencies
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "mean": sum(latencies) / len(latencies),
+        "p50": latencies[len(latencies) // 2],
+        "p90": latencies[min(len(latencies) - 1, int(len(latencies) * 0.9))],
+        "max": latencies[-1],
+    }
+
+
+async def run_once(name, args, trace_memory=False):
+    with Frontend(
+        latency=args.latency,
+        snapshot_size=args.snapshot_size,
+        chunk_size=args.chunk_size,
+        chunks=args.chunks,
+        frames=args.snapshots,
+    ) as frontend:
+        if trace_memory:
+            tracemalloc.start()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        latencies = await SCENARIOS[name](frontend, args)
+        await frontend.drain()
+        result = {
+            "wall": time.perf_counter() - wall,
+            "cpu": time.process_time() - cpu,
+            "latency": summarize(latencies),
+            "messages": dict(frontend.messages),
+            "bytes": dict(frontend.bytes),
+        }
+        if trace_memory:
+            result["peak_memory"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        for model in list(frontend.models.values()):
+            model.comm.close()
+    return result
+
+
+def run(name, args):
+    # timings are the best of a number of runs, tracing memory slows things down, so we do
+    # that in a separate run
+    results = [asyncio.run(run_once(name, args)) for _ in range(args.repeat)]
+    best = min(results, key=lambda result: result["wall"])
+    best["cpu"] = min(result["cpu"] for result in results)
+    best["peak_memory"] = asyncio.run(run_once(name, args, trace_memory=True))["peak_memory"]
+    return best
+
+
+# the metrics compared with --compare, with a function to get them from a result
+COMPARED = {
+    "wall": lambda result: result["wall"],
+    "cpu": lambda result: result["cpu"],
+    "peak_memory": lambda result: result["peak_memory"],
+    "messages": lambda result: sum(result["messages"].values()),
+    "bytes": lambda result: sum(result["bytes"].values()),
+}
+
+
+def compare(baseline, current, threshold):
+    """Print the relative changes, and return the names of the regressed metrics."""
+    regressions = []
+    print("%-20s %-12s %14s %14s %8s" % ("scenario", "metric", "baseline", "current", "change"))
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        for metric, get in COMPARED.items():
+            old, new = get(baseline["results"][name]), get(result)
+            change = (new - old) / old if old else 0.0
+            flag = ""
+            if change > threshold:
+                flag = " REGRESSION"
+                regressions.append("%s.%s" % (name, metric))
+            print(
+                "%-20s %-12s %14.6g %14.6g %+7.1f%%%s"
+                % (name, metric, old, new, change * 100, flag)
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "scenarios", nargs="*", help="Scenarios to run (default all): %s" % ", ".join(SCENARIOS)
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per scenario (default 5)")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Frontend to kernel latency in seconds"
+    )
+    parser.add_argument(
+        "--snapshots",
+        type=int,
+        default=50,
+        help="Snapshots (or frames in motion mode) per run (default 50)",
+    )
+    parser.add_argument("--snapshot-size", type=int, default=100_000, help="Image size in bytes")
+    parser.add_argument(
+        "--chunk-size", type=int, default=1 << 20, help="Recorder chunk size in bytes"
+    )
+    parser.add_argument("--chunks", type=int, default=16, help="Chunks per recording (default 16)")
+    parser.add_argument(
+        "--file-size", type=int, default=16 << 20, help="Size of the file for from_file"
+    )
+    parser.add_argument("--peers", type=int, default=8, help="Peers joining the room (default 8)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Compare with the JSON results of an earlier run")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1, help="Allowed relative increase (default 0.1)"
+    )
+    args = parser.parse_args(argv)
+
+    names = args.scenarios or list(SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error("unknown scenarios: %s" % ", ".join(sorted(unknown)))
+
+    fd, args.filename = tempfile.mkstemp(suffix=".mp4")
+    with os.fdopen(fd, "wb") as f:
+        f.write(os.urandom(args.file_size))
+    try:
+        results = {}
+        for name in names:
+            results[name] = result = run(name, args)
+            # messages and megabytes are kernel to frontend / frontend to kernel
+            print(
+                "%-20s wall %8.4fs  cpu %8.4fs  p50 %8.5fs  messages %5d/%-5d  MB %8.2f/%-8.2f  "
+                "peak %7.2f MB"
+                % (
+                    name,
+                    result["wall"],
+                    result["cpu"],
+                    result["latency"]["p50"],
+                    result["messages"].get(KERNEL_TO_FRONTEND, 0),
+                    result["messages"].get(FRONTEND_TO_KERNEL, 0),
+                    result["bytes"].get(KERNEL_TO_FRONTEND, 0) / 1e6,
+                    result["bytes"].get(FRONTEND_TO_KERNEL, 0) / 1e6,
+                    result["peak_memory"] / 1e6,
+                )
+            )
+    finally:
+        os.remove(args.filename)
+
+    parameters = {
+        key: value
+        for key, value in vars(args).items()
+        if key not in ("output", "compare", "filename")
+    }
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": parameters,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("parameters", {}).get("chunks") != parameters["chunks"]:
+            print("warning: the baseline was run with different parameters")
+        regressions = compare(baseline, report, args.threshold)
+        if regressions:
+            print("regressions: %s" % ", ".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
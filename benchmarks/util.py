@@ -0,0 +1,16 @@
+"""Helpers shared by the benchmarks, which only use the standard library.
+
+import_time.py measures what importing ipywebrtc costs, so it should not import it itself,
+which run.py does.
+"""
+
+import subprocess
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
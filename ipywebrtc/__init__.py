@@ -1,10 +1,58 @@
+import importlib
 import random
-
-import ipywidgets as widgets
-from IPython.display import display
+import sys
 
 from ._version import __version__, version_info  # noqa
-from .webrtc import CameraStream, WebRTCRoomMqtt  # noqa
+
+# The widgets are imported on first use (see __getattr__), since that imports ipywidgets and
+# IPython, which is slow, and not every kernel that imports us uses them.
+_lazy_attributes = {
+    name: "webrtc"
+    for name in [
+        "MediaStream",
+        "WidgetStream",
+        "ImageStream",
+        "VideoStream",
+        "AudioStream",
+        "ArrayStream",
+        "CameraStream",
+        "ENCODING_PROFILES",
+        "Recorder",
+        "MediaRecorder",
+        "ImageRecorder",
+        "VideoRecorder",
+        "AudioRecorder",
+        "RecorderGroup",
+        "VIDEO_LAYERS",
+        "WebRTCPeer",
+        "WebRTCRoom",
+        "WebRTCRoomLocal",
+        "WebRTCRoomMqtt",
+        "WebRTCRoomKernel",
+    ]
+}
+_lazy_submodules = ["webrtc", "cache", "metrics", "processing", "ringbuffer", "webm"]
+__all__ = ["chat"] + list(_lazy_attributes)
+
+
+def __getattr__(name):
+    if name in _lazy_submodules:
+        return importlib.import_module("." + name, __name__)
+    if name in _lazy_attributes:
+        module = importlib.import_module("." + _lazy_attributes[name], __name__)
+        value = globals()[name] = getattr(module, name)
+        return value
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attributes) | set(_lazy_submodules))
+
+
+if sys.version_info < (3, 7):
+    # no module level __getattr__ (PEP 562), so we import everything now
+    for _name in _lazy_attributes:
+        __getattr__(_name)
 
 
 def _prefix():
@@ -51,6 +99,11 @@ def chat(room=None, stream=None, **kwargs):
     :rtype: WebRTCRoom
 
     """
+    import ipywidgets as widgets
+    from IPython.display import display
+
+    from .webrtc import CameraStream, WebRTCRoomMqtt
+
     if room is None:
         room = _random_room()
         print("room =", room)
@@ -0,0 +1,269 @@
+"""A content addressed on-disk cache for media used by the stream constructors.
+
+The cache is disabled by default, enable it with::
+
+    >>> import ipywebrtc.cache
+    >>> ipywebrtc.cache.enable(max_size=2**30)
+
+After that, :meth:`~ipywebrtc.webrtc.VideoStream.from_download` (and the other ``from_download``
+and ``from_file`` constructors) read from the cache when the url (with the same ETag or
+Last-Modified header) or file (with the same modification time and size) was seen before.
+Identical content is stored only once, and the least recently used content is removed when
+the cache grows beyond ``max_size`` bytes.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+DEFAULT_MAX_SIZE = 1 << 30  # 1 GiB
+
+if os.name == "nt":
+    import msvcrt
+
+    def _lock_file(f):
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                pass  # LK_LOCK gives up after 10 seconds, we keep waiting
+
+    def _unlock_file(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+else:
+    import fcntl
+
+    def _lock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _default_directory():
+    return os.environ.get(
+        "IPYWEBRTC_CACHE_DIR",
+        os.path.join(os.path.expanduser("~"), ".cache", "ipywebrtc"),
+    )
+
+
+class MediaCache(object):
+    """A size bounded, content addressed cache, with least recently used eviction.
+
+    Keys (see :meth:`url_key` and :meth:`file_key`) map to the sha256 hash of the content,
+    which is stored in a file named after the hash. The index is only read and updated while
+    holding a lock file, since other kernels may share the cache directory.
+    """
+
+    def __init__(self, directory=None, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory or _default_directory()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._objects = os.path.join(self.directory, "objects")
+        self._index_filename = os.path.join(self.directory, "index.json")
+        self._lock_filename = os.path.join(self.directory, "lock")
+        os.makedirs(self._objects, exist_ok=True)
+
+    def url_key(self, url, timeout=10):
+        """Key for a url, based on its ETag and Last-Modified headers.
+
+        Returns None when the server sends neither, since we cannot know if the content changed,
+        or when the HEAD request fails or takes longer than timeout seconds.
+        """
+        # imported here, since urllib.request (with ssl) is slow to import
+        from urllib.error import URLError
+        from urllib.request import Request, urlopen
+
+        try:
+            with urlopen(Request(url, method="HEAD"), timeout=timeout) as response:
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+        except (URLError, OSError):
+            # e.g. HEAD not allowed, no connection or a timeout, the download will tell
+            return None
+        if etag is None and last_modified is None:
+            return None
+        return "url:%s:%s:%s" % (url, etag or "", last_modified or "")
+
+    def file_key(self, filename):
+        """Key for a local file, based on its path, modification time and size."""
+        st = os.stat(filename)
+        return "file:%s:%d:%d" % (os.path.abspath(filename), st.st_mtime_ns, st.st_size)
+
+    def get(self, key):
+        """Return the filename of the cached content for key, or None.
+
+        Another process sharing the cache can evict the content before it is read, use
+        :meth:`open` to read it safely.
+        """
+        with self._locked():
+            content_hash = self._lookup(key)
+            return None if content_hash is None else self._path(content_hash)
+
+    def open(self, key):
+        """Return the cached content for key as a file opened for reading in binary mode, or None.
+
+        The file is opened while holding the lock, so it stays readable when it is evicted.
+        """
+        with self._locked():
+            content_hash = self._lookup(key)
+            return None if content_hash is None else open(self._path(content_hash), "rb")
+
+    def _lookup(self, key):
+        # only call this while holding the lock
+        index = self._read_index()
+        content_hash = index["keys"].get(key)
+        if content_hash is None or not os.path.exists(self._path(content_hash)):
+            self.misses += 1
+            return None
+        self.hits += 1
+        index["objects"][content_hash]["last_access"] = time.time()
+        self._write_index(index)
+        return content_hash
+
+    def put(self, key, filename, move=False):
+        """Store the content of filename under key, and return the filename of the cached content.
+
+        When move is True, the file is moved into the cache instead of copied.
+        """
+        content_hash = _hash_file(filename)
+        path = os.path.join(self._objects, content_hash)
+        with self._locked():
+            if os.path.exists(path):
+                # we already have this content (under a different key)
+                if move:
+                    os.remove(filename)
+            elif move:
+                shutil.move(filename, path)
+            else:
+                fd, tmp = tempfile.mkstemp(dir=self._objects)
+                os.close(fd)
+                shutil.copyfile(filename, tmp)
+                os.replace(tmp, path)
+            index = self._read_index()
+            index["keys"][key] = content_hash
+            index["objects"][content_hash] = {
+                "size": os.path.getsize(path),
+                "last_access": time.time(),
+            }
+            self._evict(index, keep=content_hash)
+            self._write_index(index)
+        return path
+
+    def stats(self):
+        """Return the hits, misses and evictions (counted in this process), and the number of keys,
+        objects and total size in bytes of the cache, as a dict."""
+        with self._locked():
+            index = self._read_index()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "keys": len(index["keys"]),
+                "objects": len(index["objects"]),
+                "size": sum(entry["size"] for entry in index["objects"].values()),
+            }
+
+    def clear(self):
+        """Remove all cached content."""
+        with self._locked():
+            index = self._read_index()
+            for content_hash in list(index["objects"]):
+                self._remove(index, content_hash)
+            self._write_index(index)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # the thread lock for this process, the lock file for other processes
+        with self._lock, open(self._lock_filename, "a+b") as f:
+            _lock_file(f)
+            try:
+                yield
+            finally:
+                _unlock_file(f)
+
+    def _path(self, content_hash):
+        return os.path.join(self._objects, content_hash)
+
+    def _evict(self, index, keep):
+        objects = index["objects"]
+        total = sum(entry["size"] for entry in objects.values())
+        by_age = sorted(objects, key=lambda content_hash: objects[content_hash]["last_access"])
+        for content_hash in by_age:
+            if total <= self.max_size:
+                break
+            if content_hash == keep:
+                continue
+            total -= objects[content_hash]["size"]
+            self._remove(index, content_hash)
+            self.evictions += 1
+
+    def _remove(self, index, content_hash):
+        del index["objects"][content_hash]
+        for key in [key for key, value in index["keys"].items() if value == content_hash]:
+            del index["keys"][key]
+        try:
+            os.remove(self._path(content_hash))
+        except OSError:
+            # already removed, or (on Windows) still open in a process
+            pass
+
+    def _read_index(self):
+        # we read it each time (with the lock held), since other kernels may share the cache
+        # directory
+        if not os.path.exists(self._index_filename):
+            return {"keys": {}, "objects": {}}
+        with open(self._index_filename) as f:
+            return json.load(f)
+
+    def _write_index(self, index):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp, self._index_filename)
+
+
+def _hash_file(filename, chunk_size=1 << 20):
+    sha256 = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+_cache = None
+
+
+def enable(directory=None, max_size=DEFAULT_MAX_SIZE):
+    """Enable the media cache for the stream constructors, and return it.
+
+    :param str directory: Defaults to $IPYWEBRTC_CACHE_DIR or ~/.cache/ipywebrtc.
+    :param int max_size: Maximum size of the cache in bytes.
+    :rtype: MediaCache
+    """
+    global _cache
+    _cache = MediaCache(directory=directory, max_size=max_size)
+    return _cache
+
+
+def disable():
+    """Disable the media cache (the cached content is kept on disk)."""
+    global _cache
+    _cache = None
+
+
+def get_cache():
+    """Return the enabled :class:`MediaCache`, or None."""
+    return _cache
@@ -0,0 +1,191 @@
+"""Timings and sizes of the capture stages of media streams and recorders.
+
+Instrumentation is opt-in, set ``metrics=True`` on a :class:`~ipywebrtc.webrtc.MediaStream` or
+:class:`~ipywebrtc.webrtc.Recorder`. The frontend then measures the stages (e.g. getUserMedia,
+waiting for the video to play, encoding, converting blobs to bytes) and sends them to the
+kernel in batches, where the time spent handling the data is added::
+
+    >>> recorder = ImageRecorder(stream=camera, metrics=True)
+    >>> recorder.recording = True
+    >>> recorder.stats()["encode"]["duration"]
+    {'count': 1, 'sum': 12.3, 'min': 12.3, 'max': 12.3, 'mean': 12.3, 'p50': 12.8, ...}
+    >>> print(recorder.export_stats())  # Prometheus text format
+    # TYPE ipywebrtc_stage_duration_milliseconds histogram
+    ...
+
+Durations are in milliseconds, capture times in milliseconds since the epoch (as measured by the
+browser). The "transfer" stage compares the browser and kernel clocks, and is only meaningful
+when both run on the same machine.
+"""
+
+import bisect
+import collections
+import threading
+import time
+
+# exponentially growing upper bounds, from 0.1 ms to about 100 s
+DURATION_BUCKETS = tuple(0.1 * 2**i for i in range(21))
+# from 64 bytes to 1 GiB
+BYTE_BUCKETS = tuple(2**i for i in range(6, 31, 2))
+
+
+class Histogram(object):
+    """Counts values in buckets, the quantiles are estimated from the bucket bounds."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last bucket is for values above all bounds
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket that contains the q-th quantile (limited to the maximum)."""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.sum / self.count,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics(object):
+    """Per stage histograms of durations and byte counts, and a history of the last events.
+
+    :param int history: Number of events kept, see :meth:`events`.
+    """
+
+    def __init__(self, history=1000):
+        self._lock = threading.Lock()
+        self._events = collections.deque(maxlen=history)
+        self._durations = collections.OrderedDict()
+        self._bytes = collections.OrderedDict()
+        self._last = {}
+
+    def record(self, stage, duration=None, bytes=None, seq=None, time=None):
+        """Record a single measurement of a stage.
+
+        :param str stage: Name of the stage, e.g. "encode".
+        :param float duration: Time the stage took, in milliseconds.
+        :param int bytes: Size of the data produced by the stage.
+        :param int seq: Sequence number of the frame, chunk or snapshot.
+        :param float time: Capture time, in milliseconds since the epoch.
+        """
+        event = {"stage": stage, "seq": seq, "time": time, "duration": duration, "bytes": bytes}
+        with self._lock:
+            self._events.append(event)
+            if duration is not None:
+                self._histogram(self._durations, stage, DURATION_BUCKETS).observe(duration)
+            if bytes is not None:
+                self._histogram(self._bytes, stage, BYTE_BUCKETS).observe(bytes)
+            self._last[stage] = event
+
+    def record_events(self, events):
+        """Record a list of events (dicts with the arguments of :meth:`record`)."""
+        for event in events:
+            self.record(**event)
+
+    def _histogram(self, histograms, stage, bounds):
+        if stage not in histograms:
+            histograms[stage] = Histogram(bounds)
+        return histograms[stage]
+
+    def events(self):
+        """Return the last events, oldest first, as a list of dicts."""
+        with self._lock:
+            return list(self._events)
+
+    def stats(self):
+        """Return per stage the duration and byte count summaries, and the sequence number and
+        capture time of the last event, as a dict."""
+        with self._lock:
+            stats = {}
+            for stage, last in self._last.items():
+                stats[stage] = {
+                    "duration": self._durations[stage].to_dict()
+                    if stage in self._durations
+                    else {"count": 0},
+                    "bytes": self._bytes[stage].to_dict() if stage in self._bytes else {"count": 0},
+                    "last_seq": last["seq"],
+                    "last_time": last["time"],
+                }
+            return stats
+
+    def export(self, labels=None, prefix="ipywebrtc"):
+        """Return the histograms in the Prometheus text exposition format.
+
+        :param dict labels: Extra labels added to all samples, e.g. {"widget": "camera"}.
+        :param str prefix: Prefix of the metric names.
+        """
+        labels = labels or {}
+        lines = []
+        with self._lock:
+            for name, histograms in [
+                ("%s_stage_duration_milliseconds" % prefix, self._durations),
+                ("%s_stage_bytes" % prefix, self._bytes),
+            ]:
+                if not histograms:
+                    continue
+                lines.append("# TYPE %s histogram" % name)
+                for stage, histogram in histograms.items():
+                    stage_labels = dict(labels, stage=stage)
+                    cumulative = 0
+                    for bound, count in zip(histogram.bounds + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else "%g" % bound
+                        lines.append(
+                            "%s_bucket%s %d"
+                            % (name, _format_labels(dict(stage_labels, le=le)), cumulative)
+                        )
+                    lines.append(
+                        "%s_sum%s %r" % (name, _format_labels(stage_labels), histogram.sum)
+                    )
+                    lines.append(
+                        "%s_count%s %d" % (name, _format_labels(stage_labels), histogram.count)
+                    )
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """Forget all measurements."""
+        with self._lock:
+            self._events.clear()
+            self._durations.clear()
+            self._bytes.clear()
+            self._last.clear()
+
+
+def _format_labels(labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    return "{%s}" % ",".join('%s="%s"' % (key, escape(value)) for key, value in labels.items())
+
+
+def now():
+    """The current time in milliseconds since the epoch, comparable to the browser's Date.now()."""
+    return time.time() * 1000
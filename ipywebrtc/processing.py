@@ -0,0 +1,201 @@
+"""Process frames of an :class:`~ipywebrtc.webrtc.ImageRecorder` in a pool of workers.
+
+A slow observer of :attr:`ImageRecorder.frame <ipywebrtc.webrtc.ImageRecorder.frame>` blocks the
+kernel from handling new messages, and frames pile up. A :class:`FrameProcessor` instead puts
+the frames in a bounded queue, and hands them to a thread or process pool. When the pool cannot
+keep up, frames are dropped.
+
+    >>> recorder = ImageRecorder(stream=camera, raw_frames=True, raw_fps=30)
+    >>> processor = FrameProcessor(recorder, detect_faces, callback=draw_faces, workers=4)
+    >>> processor.stats()
+    {'received': 300, 'processed': 240, 'dropped': 52, 'failed': 0, 'queue_depth': 4, ...}
+"""
+
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+
+logger = logging.getLogger("jupyter-webrtc")
+
+POLICIES = ("drop_oldest", "drop_newest")
+
+
+class FrameProcessor(object):
+    """Calls function(frame) for frames of an ImageRecorder in a pool of workers.
+
+    Frames are submitted in the order they arrive, so with a single worker, the frames are
+    processed, and the callbacks are called, in order.
+
+    :param ImageRecorder recorder: The recorder to take the frames from.
+    :param function: Called with each frame, when using processes it should be picklable.
+    :param callback: Optional, called with (frame, result) from a worker thread when done.
+    :param str source: "frame" to process the raw frames (see ImageRecorder.raw_frames), or "image"
+        to process the encoded images.
+    :param int workers: Number of workers, at most this many frames are processed at the same time.
+    :param executor: "thread", "process", or a concurrent.futures.Executor instance.
+    :param int queue_size: Number of frames that can wait for a worker.
+    :param str policy: When the queue is full, "drop_oldest" drops the frame waiting the longest,
+        and "drop_newest" drops the new frame.
+    :param float window: Time window in seconds over which the throughput is computed.
+    """
+
+    def __init__(
+        self,
+        recorder,
+        function,
+        callback=None,
+        source="frame",
+        workers=4,
+        executor="thread",
+        queue_size=8,
+        policy="drop_oldest",
+        window=5.0,
+    ):
+        if source not in ("frame", "image"):
+            raise ValueError('source should be "frame" or "image", not %r' % source)
+        if policy not in POLICIES:
+            raise ValueError("policy should be one of %r, not %r" % (POLICIES, policy))
+        self.recorder = recorder
+        self.function = function
+        self.callback = callback
+        self.source = source
+        self.workers = workers
+        self.queue_size = queue_size
+        self.policy = policy
+        self.window = window
+        if executor == "thread":
+            self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+            self._owns_executor = True
+        elif executor == "process":
+            self.executor = concurrent.futures.ProcessPoolExecutor(workers)
+            self._owns_executor = True
+        else:
+            self.executor = executor
+            self._owns_executor = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._queue = collections.deque()
+        self._in_flight = 0
+        self._received = 0
+        self._processed = 0
+        self._dropped = 0
+        self._failed = 0
+        self._durations = collections.deque()  # (finish time, duration) within the window
+        if source == "frame":
+            recorder.observe(self._on_frame, "frame")
+        else:
+            recorder.image.observe(self._on_frame, "value")
+
+    def _on_frame(self, change):
+        # this runs while handling the comm message, so we should be quick
+        frame = change.new
+        if frame is None:
+            return
+        with self._lock:
+            self._received += 1
+            submit = self._in_flight < self.workers
+            if submit:
+                self._in_flight += 1
+            elif len(self._queue) < self.queue_size:
+                self._queue.append(frame)
+            elif self.policy == "drop_oldest" and self.queue_size > 0:
+                self._queue.popleft()
+                self._queue.append(frame)
+                self._dropped += 1
+            else:
+                self._dropped += 1
+        if submit:
+            self._submit(frame)
+
+    def _submit(self, frame):
+        # the frame already has a worker slot (see _in_flight). Should be called without the lock
+        # held, since add_done_callback calls _done right away when the frame is already done,
+        # which submits the next frame, we do that in the loop below instead of recursing.
+        local = self._local
+        if getattr(local, "submitting", False):
+            local.pending.append(frame)
+            return
+        local.submitting = True
+        local.pending = collections.deque([frame])
+        try:
+            while local.pending:
+                frame = local.pending.popleft()
+                start = time.perf_counter()
+                try:
+                    future = self.executor.submit(self.function, frame)
+                except RuntimeError:
+                    # the executor is shut down
+                    with self._lock:
+                        self._in_flight -= 1
+                        self._dropped += 1
+                    continue
+                future.add_done_callback(
+                    lambda future, frame=frame, start=start: self._done(future, frame, start)
+                )
+        finally:
+            local.submitting = False
+
+    def _done(self, future, frame, start):
+        now = time.perf_counter()
+        failed = future.cancelled() or future.exception() is not None
+        with self._lock:
+            if failed:
+                self._failed += 1
+            else:
+                self._processed += 1
+                self._durations.append((now, now - start))
+            self._trim(now)
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Error processing frame", exc_info=future.exception())
+        elif not failed and self.callback is not None:
+            try:
+                self.callback(frame, future.result())
+            except Exception:
+                logger.exception("Error in the callback of a processed frame")
+        # the slot goes to the next queued frame, only when there is none it is freed, so new
+        # frames cannot overtake the queued ones
+        with self._lock:
+            if not self._queue:
+                self._in_flight -= 1
+                return
+            frame = self._queue.popleft()
+        self._submit(frame)
+
+    def _trim(self, now):
+        while self._durations and self._durations[0][0] < now - self.window:
+            self._durations.popleft()
+
+    def stats(self):
+        """Return the number of received, processed, dropped and failed frames, the current
+        queue depth and number of frames being processed, and over the last window seconds, the
+        throughput in frames per second and mean processing time in seconds, as a dict."""
+        with self._lock:
+            self._trim(time.perf_counter())
+            durations = [duration for _, duration in self._durations]
+            return {
+                "received": self._received,
+                "processed": self._processed,
+                "dropped": self._dropped,
+                "failed": self._failed,
+                "queue_depth": len(self._queue),
+                "in_flight": self._in_flight,
+                "throughput": len(durations) / self.window,
+                "mean_duration": sum(durations) / len(durations) if durations else None,
+            }
+
+    def close(self, wait=True):
+        """Stop processing new frames, and drop the queued ones.
+
+        :param bool wait: Wait for the frames being processed to finish.
+        """
+        if self.source == "frame":
+            self.recorder.unobserve(self._on_frame, "frame")
+        else:
+            self.recorder.image.unobserve(self._on_frame, "value")
+        with self._lock:
+            self._dropped += len(self._queue)
+            self._queue.clear()
+        if self._owns_executor:
+            self.executor.shutdown(wait=wait)
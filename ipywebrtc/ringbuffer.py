@@ -0,0 +1,142 @@
+"""Fixed size histories of numeric records and of audio samples, backed by arrays."""
+
+import array
+
+NAN = float("nan")
+
+
+class RingBuffer(object):
+    """Keeps the last capacity records, each a dict with (some of) the given fields.
+
+    Every field is stored in a preallocated array of doubles, so memory usage does not grow,
+    missing values (None) are stored as NaN. The columns can be passed to numpy or a plotting
+    library directly:
+
+    >>> history = RingBuffer(["time", "rtt"], capacity=3)
+    >>> for i in range(5):
+    ...     history.append({"time": i, "rtt": 10 * i})
+    >>> history.to_dict()
+    {'time': [2.0, 3.0, 4.0], 'rtt': [20.0, 30.0, 40.0]}
+    """
+
+    def __init__(self, fields, capacity):
+        if capacity <= 0:
+            raise ValueError("capacity should be positive, not %r" % capacity)
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        self._columns = {field: array.array("d", [NAN]) * capacity for field in self.fields}
+        self._start = 0
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def append(self, record):
+        """Add a record (a dict), overwriting the oldest one when full. Unknown keys are ignored."""
+        index = (self._start + self._length) % self.capacity
+        if self._length == self.capacity:
+            self._start = (self._start + 1) % self.capacity
+        else:
+            self._length += 1
+        for field in self.fields:
+            value = record.get(field)
+            self._columns[field][index] = NAN if value is None else value
+
+    def column(self, field):
+        """Return the values of a field, oldest first, as an array.array."""
+        data = self._columns[field]
+        end = self._start + self._length
+        if end <= self.capacity:
+            return data[self._start : end]
+        return data[self._start :] + data[: end - self.capacity]
+
+    def last(self):
+        """Return the newest record as a dict, or None when empty."""
+        if self._length == 0:
+            return None
+        index = (self._start + self._length - 1) % self.capacity
+        return {field: self._columns[field][index] for field in self.fields}
+
+    def to_dict(self):
+        """Return all records as a dict of lists, oldest first."""
+        return {field: self.column(field).tolist() for field in self.fields}
+
+    def clear(self):
+        self._start = 0
+        self._length = 0
+
+    def resized(self, capacity):
+        """Return a RingBuffer with a different capacity, holding the newest records of this one."""
+        other = RingBuffer(self.fields, capacity)
+        columns = {field: self.column(field) for field in self.fields}
+        for i in range(max(0, self._length - capacity), self._length):
+            other.append({field: columns[field][i] for field in self.fields})
+        return other
+
+
+class SampleBuffer(object):
+    """Keeps the last capacity frames of (audio) samples, in a preallocated NumPy array.
+
+    >>> import numpy as np
+    >>> buffer = SampleBuffer(capacity=4, channels=1, dtype="int16", sample_rate=1000)
+    >>> buffer.append(np.arange(6, dtype="int16").reshape(-1, 1), time=0.0)
+    >>> samples, time = buffer.read()
+    >>> samples[:, 0].tolist(), time
+    ([2, 3, 4, 5], 2.0)
+    """
+
+    def __init__(self, capacity, channels=1, dtype="float32", sample_rate=None):
+        import numpy as np
+
+        if capacity <= 0:
+            raise ValueError("capacity should be positive, not %r" % capacity)
+        self.capacity = capacity
+        self.sample_rate = sample_rate
+        self._data = np.zeros((capacity, channels), dtype=dtype)
+        self._total = 0
+        self._end_time = None
+
+    def __len__(self):
+        return min(self._total, self.capacity)
+
+    @property
+    def total(self):
+        """The number of frames appended since creation (or clear)."""
+        return self._total
+
+    def append(self, samples, time=None):
+        """Add frames, an array with shape (frames, channels), overwriting the oldest ones.
+
+        :param float time: Capture time of the first frame, in milliseconds. When None, the
+            frames follow the previously appended ones.
+        """
+        count = len(samples)
+        kept = samples[max(0, count - self.capacity) :]
+        start = (self._total + count - len(kept)) % self.capacity
+        first = min(len(kept), self.capacity - start)
+        self._data[start : start + first] = kept[:first]
+        self._data[: len(kept) - first] = kept[first:]
+        self._total += count
+        if not self.sample_rate:
+            return
+        if time is not None:
+            self._end_time = time + count * 1000.0 / self.sample_rate
+        elif self._end_time is not None:
+            self._end_time += count * 1000.0 / self.sample_rate
+
+    def read(self, frames=None):
+        """Return a copy of the newest frames (all when None), oldest first, and the capture time
+        (in milliseconds) of the first one, or None when unknown."""
+        import numpy as np
+
+        frames = len(self) if frames is None else min(frames, len(self))
+        end = self._total % self.capacity
+        indices = np.arange(end - frames, end) % self.capacity
+        time = None
+        if self._end_time is not None:
+            time = self._end_time - frames * 1000.0 / self.sample_rate
+        return self._data[indices], time
+
+    def clear(self):
+        self._total = 0
+        self._end_time = None
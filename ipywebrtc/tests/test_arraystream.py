@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+
+from ipywebrtc.webrtc import ArrayStream
+
+
+def make_stream(**kwargs):
+    stream = ArrayStream(**kwargs)
+    sent = []
+    stream.send = lambda content, buffers=None: sent.append((content, buffers))
+    return stream, sent
+
+
+def paint(msg, data, canvas):
+    # what the frontend does with a frame message
+    y, x = msg["y"], msg["x"]
+    pixels = np.frombuffer(data, dtype=np.uint8).reshape(msg["height"], msg["width"], -1)
+    canvas[y : y + msg["height"], x : x + msg["width"]] = pixels
+
+
+def test_full_frame():
+    stream, sent = make_stream()
+    frame = np.arange(4 * 6 * 3, dtype=np.uint8).reshape(4, 6, 3)
+    stream.push(frame)
+    ((msg, [data]),) = sent
+    assert msg == {
+        "msg": "frame",
+        "frame_width": 6,
+        "frame_height": 4,
+        "x": 0,
+        "y": 0,
+        "width": 6,
+        "height": 4,
+        "channels": 3,
+    }
+    assert bytes(data) == frame.tobytes()
+
+
+def test_gray():
+    stream, sent = make_stream()
+    stream.push(np.full((4, 6), 7, dtype=np.uint8))
+    msg, [data] = sent[0]
+    assert msg["channels"] == 1
+    assert bytes(data) == b"\x07" * 24
+
+
+def test_delta():
+    stream, sent = make_stream()
+    frame = np.zeros((10, 20, 4), dtype=np.uint8)
+    stream.push(frame)
+    canvas = frame.copy()
+    frame = frame.copy()
+    frame[2:5, 3, 0] = 255
+    frame[4, 7, 3] = 1
+    stream.push(frame)
+    msg, [data] = sent[-1]
+    # only the rectangle with the changed pixels is sent
+    assert (msg["x"], msg["y"], msg["width"], msg["height"]) == (3, 2, 5, 3)
+    assert (msg["frame_width"], msg["frame_height"]) == (20, 10)
+    paint(msg, data, canvas)
+    assert (canvas == frame).all()
+    # the caller may modify the frame in place
+    frame[0, 0, 0] = 1
+    stream.push(frame)
+    msg, _ = sent[-1]
+    assert (msg["x"], msg["y"], msg["width"], msg["height"]) == (0, 0, 1, 1)
+
+
+def test_unchanged_frame_is_not_sent():
+    stream, sent = make_stream()
+    frame = np.ones((4, 4, 3), dtype=np.uint8)
+    stream.push(frame)
+    stream.push(frame.copy())
+    assert len(sent) == 1
+
+
+def test_full_frames():
+    stream, sent = make_stream(full_frame_interval=2)
+    frame = np.zeros((4, 4, 3), dtype=np.uint8)
+    sizes = []
+    for i in range(6):
+        frame = frame.copy()
+        frame[0, 0, 0] = i + 1
+        stream.push(frame)
+        sizes.append(sent[-1][0]["width"])
+    assert sizes == [4, 1, 1, 4, 1, 1]
+    # without delta each frame is sent as a whole
+    stream, sent = make_stream(delta=False)
+    stream.push(frame)
+    stream.push(frame)
+    assert [msg["width"] for msg, _ in sent] == [4, 4]
+    # and a frame with a different shape too
+    stream, sent = make_stream()
+    stream.push(frame)
+    stream.push(np.zeros((2, 2, 3), dtype=np.uint8))
+    assert sent[-1][0]["width"] == 2
+
+
+def test_static_content():
+    # a frontend that missed frames recovers, also when nothing changes
+    stream, sent = make_stream(full_frame_interval=3)
+    frame = np.ones((4, 4, 3), dtype=np.uint8)
+    for _ in range(9):
+        stream.push(frame)
+    # the first, and then after each 3 (unsent) delta frames
+    assert len(sent) == 3
+    assert all(msg["width"] == 4 for msg, _ in sent)
+
+
+def test_request_frame():
+    # e.g. after a page reload, the frontend asks for the current frame
+    stream, sent = make_stream()
+    stream._handle_frontend_msg(stream, {"msg": "request_frame"}, [])
+    assert sent == []
+    frame = np.zeros((10, 20, 3), dtype=np.uint8)
+    stream.push(frame)
+    frame = frame.copy()
+    frame[2, 3] = 255
+    stream.push(frame)
+    stream._handle_frontend_msg(stream, {"msg": "request_frame"}, [])
+    msg, [data] = sent[-1]
+    assert (msg["x"], msg["y"], msg["width"], msg["height"]) == (0, 0, 20, 10)
+    canvas = np.zeros_like(frame)
+    paint(msg, data, canvas)
+    assert (canvas == frame).all()
+
+
+def test_invalid_frames():
+    stream, _ = make_stream()
+    with pytest.raises(ValueError):
+        stream.push(np.zeros((4, 4, 3), dtype=np.float32))
+    with pytest.raises(ValueError):
+        stream.push(np.zeros((4, 4, 2), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        stream.push(np.zeros(4, dtype=np.uint8))
@@ -0,0 +1,52 @@
+import multiprocessing
+import os
+
+from ipywebrtc.cache import MediaCache
+
+
+def put_many(directory, worker, count):
+    cache = MediaCache(directory)
+    for i in range(count):
+        filename = os.path.join(directory, "input-%d-%d" % (worker, i))
+        with open(filename, "wb") as f:
+            f.write(b"%d-%d" % (worker, i))
+        cache.put("key-%d-%d" % (worker, i), filename, move=True)
+        cache.get("key-%d-%d" % (worker, 0))
+
+
+def test_processes_share_the_index(tmp_path):
+    directory = str(tmp_path)
+    processes = [
+        multiprocessing.Process(target=put_many, args=(directory, worker, 25))
+        for worker in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+    # no update of the index got lost
+    assert MediaCache(directory).stats()["keys"] == 100
+
+
+def test_open_survives_eviction(tmp_path):
+    cache = MediaCache(str(tmp_path / "cache"), max_size=10)
+    first = tmp_path / "first"
+    first.write_bytes(b"0123456789")
+    cache.put("first", str(first))
+    f = cache.open("first")
+    second = tmp_path / "second"
+    second.write_bytes(b"abcdefghij")
+    cache.put("second", str(second))
+    assert cache.stats()["evictions"] == 1
+    assert cache.open("first") is None
+    with f:
+        assert f.read() == b"0123456789"
+    with cache.open("second") as f:
+        assert f.read() == b"abcdefghij"
+
+
+def test_url_key_unreachable(tmp_path):
+    cache = MediaCache(str(tmp_path))
+    # nothing listens on port 1
+    assert cache.url_key("http://127.0.0.1:1/video.webm", timeout=5) is None
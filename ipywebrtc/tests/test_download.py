@@ -0,0 +1,46 @@
+import functools
+import http.server
+import threading
+
+import pytest
+
+from ipywebrtc.webrtc import VideoStream
+
+
+@pytest.fixture
+def server(tmp_path):
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(tmp_path))
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:%d" % httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def download(url):
+    # waits for the download to finish, like a user observing download_progress would
+    done = threading.Event()
+    stream = VideoStream.from_download(url, background=True)
+    stream.observe(lambda change: change.new in (1.0, None) and done.set(), "download_progress")
+    if stream.download_progress in (1.0, None):
+        done.set()
+    assert done.wait(30)
+    return stream
+
+
+def test_download(server, tmp_path):
+    data = bytes(range(256)) * 1000
+    (tmp_path / "video.webm").write_bytes(data)
+    stream = download(server + "/video.webm")
+    assert stream.download_progress == 1.0
+    assert stream.download_error is None
+    assert bytes(stream.video.value) == data
+    assert stream.video.format == "webm"
+
+
+def test_download_not_found(server):
+    stream = download(server + "/missing.webm")
+    assert stream.download_progress is None
+    assert "404" in stream.download_error
+    assert bytes(stream.video.value) == b""
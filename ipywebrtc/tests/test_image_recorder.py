@@ -0,0 +1,129 @@
+import asyncio
+
+import numpy as np
+import pytest
+from ipywidgets import Image
+from traitlets import TraitError
+
+from ipywebrtc.webrtc import ImageRecorder, ImageStream
+
+
+def test_motion():
+    recorder = ImageRecorder()
+    calls = []
+
+    def callback(recorder, image, score, time):
+        calls.append((image, score, time))
+
+    recorder.on_motion(callback)
+    # the frontend updates the image before it sends the score of a changed frame
+    recorder.image.value = b"changed"
+    recorder._handle_frontend_msg(
+        recorder, {"msg": "motion", "score": 0.25, "time": 1000, "changed": True}, []
+    )
+    assert recorder.motion_score == 0.25
+    assert calls == [(b"changed", 0.25, 1000)]
+    # below the threshold only the score is reported
+    recorder._handle_frontend_msg(
+        recorder, {"msg": "motion", "score": 0.001, "time": 2000, "changed": False}, []
+    )
+    assert recorder.motion_score == 0.001
+    assert len(calls) == 1
+    recorder.on_motion(callback, remove=True)
+    recorder._handle_frontend_msg(
+        recorder, {"msg": "motion", "score": 0.5, "time": 3000, "changed": True}, []
+    )
+    assert len(calls) == 1
+
+
+def test_motion_settings():
+    recorder = ImageRecorder(motion_threshold=0, motion_roi=[0.5, 0, 0.5, 1])
+    with pytest.raises(TraitError):
+        recorder.motion_threshold = 1
+    with pytest.raises(TraitError):
+        recorder.motion_threshold = -0.1
+    with pytest.raises(TraitError):
+        recorder.motion_fps = 0
+    with pytest.raises(TraitError):
+        recorder.motion_roi = [0.5, 0, 1]
+    with pytest.raises(TraitError):
+        recorder.motion_roi = [0.5, 0, 0.6, 1]
+    with pytest.raises(TraitError):
+        recorder.motion_roi = [0, 0, 0, 1]
+    assert recorder.motion_roi == [0.5, 0, 0.5, 1]
+    recorder.motion_roi = None
+    with pytest.raises(TraitError):
+        recorder.motion_score = 1
+
+
+def test_output_settings():
+    recorder = ImageRecorder(
+        format="jpeg", crop=[0.25, 0.25, 0.5, 0.5], max_width=224, grayscale=True, quality=0.8
+    )
+    for name, value in [
+        ("max_width", 0),
+        ("max_height", -1),
+        ("quality", 1.5),
+        ("crop", [0.25, 0.25, 0.5]),
+        ("crop", [-0.1, 0, 0.5, 0.5]),
+        ("crop", [0.75, 0, 0.5, 0.5]),
+    ]:
+        with pytest.raises(TraitError):
+            setattr(recorder, name, value)
+    assert (recorder.crop, recorder.max_width, recorder.quality) == (
+        [0.25, 0.25, 0.5, 0.5],
+        224,
+        0.8,
+    )
+    recorder.crop = recorder.max_width = recorder.quality = None
+    recorder.crop = [0, 0, 1, 1]
+
+
+def burst(reply, **kwargs):
+    # runs burst(), with the frontend replying to the burst message
+    recorder = ImageRecorder(stream=ImageStream(image=Image()))
+
+    def send(content, buffers=None):
+        content, buffers = reply(content)
+        loop.call_soon(recorder._handle_frontend_msg, recorder, content, buffers)
+
+    recorder.send = send
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(recorder.burst(timeout=5, **kwargs))
+    finally:
+        assert recorder._burst_futures == {}
+        loop.close()
+
+
+def test_burst_raw():
+    frames = np.arange(3 * 2 * 4 * 1, dtype=np.uint8).reshape(3, 2, 4, 1)
+
+    def reply(msg):
+        content = {"msg": "burst", "id": msg["id"], "count": msg["count"], "raw": True}
+        content.update(times=[0, 100, 200], height=2, width=4, channels=1)
+        return content, [frames.tobytes()]
+
+    result, times = burst(reply, count=3, raw=True)
+    assert (result == frames).all()
+    assert times == [0, 100, 200]
+
+    def reply_wrong_size(msg):
+        content, buffers = reply(msg)
+        return content, [buffers[0][:-1]]
+
+    with pytest.raises(ValueError):
+        burst(reply_wrong_size, count=3, raw=True)
+
+
+def test_burst_encoded():
+    def reply(msg):
+        content = {"msg": "burst", "id": msg["id"], "count": 2, "raw": False}
+        content.update(times=[0, 100], sizes=[3, 2])
+        return content, [b"abcde"]
+
+    assert burst(reply, count=2) == ([b"abc", b"de"], [0, 100])
+    with pytest.raises(ValueError):
+        burst(lambda msg: (dict(reply(msg)[0], sizes=[3, 3]), [b"abcde"]), count=2)
+    with pytest.raises(RuntimeError):
+        burst(lambda msg: ({"msg": "burst", "id": msg["id"], "error": "no video"}, []), count=2)
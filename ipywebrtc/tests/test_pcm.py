@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+from ipywebrtc.ringbuffer import SampleBuffer
+from ipywebrtc.webrtc import AudioRecorder
+
+
+def pcm_msg(samples, time, offset, sample_rate=16000, dtype="int16"):
+    # what the frontend sends: interleaved little endian samples
+    samples = np.asarray(samples)
+    content = {
+        "msg": "pcm",
+        "time": time,
+        "offset": offset,
+        "sample_rate": sample_rate,
+        "channels": samples.shape[1],
+        "dtype": dtype,
+    }
+    return content, [samples.astype({"int16": "<i2", "float32": "<f4"}[dtype]).tobytes()]
+
+
+def test_receive_pcm_stereo():
+    recorder = AudioRecorder(pcm=True, pcm_channels=2, pcm_dtype="int16", pcm_buffer_duration=1)
+    received = []
+    recorder.observe(lambda change: received.append(change.new.copy()), "samples")
+    left_right = np.array([[1, -1], [2, -2], [3, -3]])
+    content, buffers = pcm_msg(left_right, time=1000.0, offset=0)
+    recorder._handle_frontend_msg(recorder, content, buffers)
+    assert recorder.samples.dtype == np.int16
+    assert recorder.samples.tolist() == left_right.tolist()
+    assert (recorder.samples_time, recorder.samples_offset) == (1000.0, 0)
+    content, buffers = pcm_msg([[4, -4]], time=1000.1875, offset=3)
+    recorder._handle_frontend_msg(recorder, content, buffers)
+    assert recorder.samples_offset == 3
+    assert len(received) == 2
+    samples, time = recorder.pcm_buffer.read()
+    assert samples.tolist() == [[1, -1], [2, -2], [3, -3], [4, -4]]
+    assert time == 1000.0
+
+
+def test_receive_pcm_float32():
+    recorder = AudioRecorder(pcm=True, pcm_dtype="float32", pcm_buffer_duration=1)
+    content, buffers = pcm_msg([[0.5], [-0.25]], time=0.0, offset=0, dtype="float32")
+    recorder._handle_frontend_msg(recorder, content, buffers)
+    assert recorder.samples.dtype == np.float32
+    assert recorder.samples[:, 0].tolist() == [0.5, -0.25]
+
+
+def test_receive_pcm_other_settings():
+    # chunks captured before the settings changed are not put in the buffer
+    recorder = AudioRecorder(pcm=True, pcm_sample_rate=16000, pcm_buffer_duration=1)
+    content, buffers = pcm_msg([[1], [2]], time=0.0, offset=0, sample_rate=48000)
+    recorder._handle_frontend_msg(recorder, content, buffers)
+    assert recorder.samples[:, 0].tolist() == [1, 2]
+    assert len(recorder.pcm_buffer) == 0
+    recorder.pcm_buffer_duration = None
+    assert recorder.pcm_buffer is None
+
+
+def test_sample_buffer_wraps():
+    buffer = SampleBuffer(capacity=5, channels=2, dtype="int16", sample_rate=1000)
+    assert buffer.read()[0].shape == (0, 2)
+    for start in range(0, 12, 3):
+        frames = np.arange(start, start + 3, dtype="int16")
+        buffer.append(np.stack([frames, -frames], axis=1), time=float(start))
+    assert buffer.total == 12
+    assert len(buffer) == 5
+    samples, time = buffer.read()
+    assert samples[:, 0].tolist() == [7, 8, 9, 10, 11]
+    assert samples[:, 1].tolist() == [-7, -8, -9, -10, -11]
+    # at 1000 samples per second, one sample per millisecond
+    assert time == 7.0
+    samples, time = buffer.read(2)
+    assert samples[:, 0].tolist() == [10, 11]
+    assert time == 10.0
+    # a chunk larger than the buffer keeps its end
+    frames = np.arange(100, 108, dtype="int16")
+    buffer.append(np.stack([frames, frames], axis=1))
+    assert buffer.total == 20
+    assert buffer.read()[0][:, 0].tolist() == [103, 104, 105, 106, 107]
+    buffer.clear()
+    assert len(buffer) == 0
+    assert buffer.read()[1] is None
+
+
+def test_sample_buffer_untimed():
+    # frames appended without a time follow the previous ones
+    buffer = SampleBuffer(capacity=8, channels=1, dtype="int16", sample_rate=1000)
+    buffer.append(np.zeros((4, 1), dtype="int16"), time=0.0)
+    buffer.append(np.zeros((4, 1), dtype="int16"))
+    assert buffer.read()[1] == 0.0
+    assert buffer.read(2)[1] == 6.0
+    buffer.append(np.zeros((2, 1), dtype="int16"))
+    assert buffer.read()[1] == 2.0
+    # a time resets it
+    buffer.append(np.zeros((2, 1), dtype="int16"), time=100.0)
+    assert buffer.read(2)[1] == 100.0
+    # without any time it stays unknown
+    buffer = SampleBuffer(capacity=8, sample_rate=1000)
+    buffer.append(np.zeros((4, 1)))
+    assert buffer.read()[1] is None
+
+
+def test_sample_buffer_capacity():
+    with pytest.raises(ValueError):
+        SampleBuffer(capacity=0)
@@ -0,0 +1,67 @@
+import asyncio
+import concurrent.futures
+import threading
+
+import numpy as np
+import pytest
+
+from ipywebrtc.webrtc import WebRTCPeer, WebRTCRoomKernel
+
+
+def make_peer(**kwargs):
+    peer = WebRTCPeer(**kwargs)
+    sent = []
+    peer.send = lambda content, buffers=None: sent.append((content, buffers))
+    return peer, sent
+
+
+def test_send_data_without_event_loop():
+    peer, sent = make_peer()
+    future = peer.send_data(b"abc", {"index": 1})
+    assert isinstance(future, concurrent.futures.Future)
+    ((content, [buffer]),) = sent
+    assert content == {"msg": "data_send", "id": 1, "header": {"metadata": {"index": 1}}}
+    assert bytes(buffer) == b"abc"
+    peer._handle_frontend_msg(peer, {"msg": "data_sent", "id": 1}, [])
+    assert future.result(0) == 3
+    assert peer.data_stats()["bytes_sent"] == 3
+
+
+def test_send_data_from_thread():
+    # e.g. from a FrameProcessor callback
+    peer, sent = make_peer()
+    futures = []
+    thread = threading.Thread(
+        target=lambda: futures.append(peer.send_data(np.zeros((2, 3), dtype=np.float32)))
+    )
+    thread.start()
+    thread.join()
+    assert sent[0][0]["header"]["shape"] == [2, 3]
+    peer._handle_frontend_msg(peer, {"msg": "data_sent", "id": 1, "error": "closed"}, [])
+    with pytest.raises(RuntimeError):
+        futures[0].result(0)
+
+
+def test_send_data_in_event_loop():
+    peer, sent = make_peer()
+
+    async def send():
+        future = peer.send_data(b"abcd")
+        asyncio.get_running_loop().call_soon(
+            peer._handle_frontend_msg, peer, {"msg": "data_sent", "id": 1}, []
+        )
+        return await future
+
+    assert asyncio.run(send()) == 4
+
+
+def test_room_send_data():
+    a, _ = make_peer(id_remote="a")
+    b, _ = make_peer(id_remote="b")
+    room = WebRTCRoomKernel(room="send_data", peers=[a, b])
+    futures = room.send_data(b"x")
+    assert len(futures) == 2
+    b._handle_frontend_msg(b, {"msg": "data_sent", "id": 1}, [])
+    assert futures[1].result(0) == 1
+    assert not futures[0].done()
+    room.close()
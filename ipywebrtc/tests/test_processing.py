@@ -0,0 +1,118 @@
+import threading
+import time
+
+import traitlets
+
+from ipywebrtc.processing import FrameProcessor
+
+
+class Source(traitlets.HasTraits):
+    # stands in for an ImageRecorder, FrameProcessor only observes the frame trait
+    frame = traitlets.Any(None)
+
+
+def push(source, frames):
+    for frame in frames:
+        # a new object each time, so each assignment is a change
+        source.frame = [frame]
+
+
+def run_with_timeout(target, timeout=30):
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "deadlock"
+
+
+def test_many_trivial_frames_one_worker():
+    # frames that are done before add_done_callback is called used to deadlock
+    source = Source()
+    processor = FrameProcessor(source, lambda frame: frame, workers=1, queue_size=8)
+
+    def work():
+        push(source, range(20000))
+        processor.close(wait=True)
+
+    run_with_timeout(work)
+    stats = processor.stats()
+    assert stats["received"] == 20000
+    assert stats["processed"] + stats["dropped"] + stats["failed"] == 20000
+    assert stats["in_flight"] == 0
+
+
+def test_order_one_worker():
+    source = Source()
+    results = []
+    processor = FrameProcessor(
+        source,
+        lambda frame: frame[0] * 2,
+        callback=lambda frame, result: results.append(result),
+        workers=1,
+        queue_size=1000,
+    )
+    run_with_timeout(lambda: push(source, range(500)))
+    # close drops the queued frames, so let them all be processed first
+    wait_idle(processor)
+    processor.close(wait=True)
+    assert processor.stats()["dropped"] == 0
+    assert results == [i * 2 for i in range(500)]
+
+
+def wait_idle(processor, timeout=10):
+    deadline = time.time() + timeout
+    while processor.stats()["in_flight"] and time.time() < deadline:
+        time.sleep(0.01)
+    assert processor.stats()["in_flight"] == 0
+
+
+def blocked_processor(policy, queue_size=2):
+    source = Source()
+    release = threading.Event()
+    processed = []
+    processor = FrameProcessor(
+        source,
+        lambda frame: release.wait(10) and frame[0],
+        callback=lambda frame, result: processed.append(result),
+        workers=1,
+        queue_size=queue_size,
+        policy=policy,
+    )
+    return source, release, processed, processor
+
+
+def test_drop_oldest():
+    source, release, processed, processor = blocked_processor("drop_oldest")
+    # frame 0 is being processed, 1 and 2 are queued, each next frame drops the oldest
+    push(source, range(6))
+    stats = processor.stats()
+    assert stats["in_flight"] == 1
+    assert stats["queue_depth"] == 2
+    assert stats["dropped"] == 3
+    release.set()
+    wait_idle(processor)
+    processor.close()
+    assert processed == [0, 4, 5]
+
+
+def test_drop_newest():
+    source, release, processed, processor = blocked_processor("drop_newest")
+    push(source, range(6))
+    assert processor.stats()["dropped"] == 3
+    release.set()
+    wait_idle(processor)
+    processor.close()
+    assert processed == [0, 1, 2]
+
+
+def test_failures_are_counted():
+    source = Source()
+
+    def fail(frame):
+        raise ValueError("bad frame")
+
+    processor = FrameProcessor(source, fail, workers=2)
+    push(source, range(10))
+    processor.close(wait=True)
+    stats = processor.stats()
+    assert stats["failed"] + stats["dropped"] == 10
+    assert stats["processed"] == 0
@@ -0,0 +1,147 @@
+import asyncio
+import os
+
+import pytest
+from ipywidgets import Image
+
+from ipywebrtc.webrtc import AudioRecorder, ImageRecorder, ImageStream, VideoRecorder
+
+
+def make_recorder(**kwargs):
+    recorder = VideoRecorder(format="mp4", **kwargs)
+    sent = []
+    recorder.send = lambda content, buffers=None: sent.append((content, buffers))
+    return recorder, sent
+
+
+def stream(recorder, *chunks):
+    # what the frontend sends for a recording with a timeslice
+    for index, chunk in enumerate(chunks):
+        recorder._handle_frontend_msg(recorder, {"msg": "chunk", "index": index}, [chunk])
+    recorder._handle_frontend_msg(recorder, {"msg": "chunk_end", "count": len(chunks)}, [])
+
+
+def test_chunks_are_spooled(tmp_path):
+    recorder, sent = make_recorder(timeslice=100)
+    stream(recorder, b"abc", memoryview(b"def"))
+    first = recorder._recorded()
+    with open(first, "rb") as f:
+        assert f.read() == b"abcdef"
+    recorder.save(str(tmp_path / "first"))
+    assert (tmp_path / "first.mp4").read_bytes() == b"abcdef"
+    # the next recording does not overwrite the first
+    stream(recorder, b"ghi")
+    second = recorder._recorded()
+    assert second != first
+    with open(first, "rb") as f:
+        assert f.read() == b"abcdef"
+    recorder.save(str(tmp_path / "second.mp4"))
+    assert (tmp_path / "second.mp4").read_bytes() == b"ghi"
+    assert sent == []
+    recorder.close()
+    assert not os.path.exists(first)
+    assert not os.path.exists(second)
+
+
+def test_spool_filename(tmp_path):
+    spool = str(tmp_path / "spool.mp4")
+    recorder, sent = make_recorder(timeslice=100, spool_filename=spool, adaptive=True)
+    stream(recorder, b"abc", b"de")
+    assert recorder._recorded() == spool
+    # in adaptive mode the chunks are acknowledged
+    assert [content for content, _ in sent] == [
+        {"msg": "chunk_ack", "index": 0, "size": 3},
+        {"msg": "chunk_ack", "index": 1, "size": 2},
+    ]
+    recorder.close()
+    # the file is not ours
+    with open(spool, "rb") as f:
+        assert f.read() == b"abcde"
+
+
+def test_chunk_without_start():
+    recorder, _ = make_recorder(timeslice=100)
+    recorder._handle_frontend_msg(recorder, {"msg": "chunk", "index": 3}, [b"abc"])
+    recorder._handle_frontend_msg(recorder, {"msg": "chunk_end", "count": 4}, [])
+    assert recorder._recorded() == b""
+
+
+def test_autosave_from_spool(tmp_path):
+    recorder = AudioRecorder(
+        format="ogg", timeslice=100, autosave=True, filename=str(tmp_path / "audio")
+    )
+
+    async def record():
+        task = asyncio.ensure_future(recorder.record(0.01, timeout=5))
+        await asyncio.sleep(0.05)
+        stream(recorder, b"abc")
+        return await task
+
+    spool = asyncio.run(record())
+    assert (tmp_path / "audio.ogg").read_bytes() == b"abc"
+    with open(spool, "rb") as f:
+        assert f.read() == b"abc"
+    recorder.close()
+
+
+def test_snapshot():
+    recorder = ImageRecorder(stream=ImageStream(image=Image()))
+
+    async def snapshot():
+        task = asyncio.ensure_future(recorder.snapshot(timeout=5))
+        await asyncio.sleep(0)
+        assert recorder.recording
+        # what the frontend does: set the image, and then stop recording
+        recorder.image.value = b"png"
+        recorder.recording = False
+        return await task
+
+    assert asyncio.run(snapshot()) == b"png"
+    assert recorder._data_futures == []
+
+
+def test_snapshot_timeout():
+    recorder = ImageRecorder(stream=ImageStream(image=Image()))
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(recorder.snapshot(timeout=0.01))
+    assert recorder._data_futures == []
+
+
+def test_record():
+    recorder = VideoRecorder()
+
+    async def record():
+        task = asyncio.ensure_future(recorder.record(0.01, timeout=5))
+        await asyncio.sleep(0.05)
+        # the recording stopped, and the frontend sends the video
+        assert not recorder.recording
+        recorder.video.value = b"webm"
+        return await task
+
+    assert asyncio.run(record()) == b"webm"
+    assert recorder._data_futures == []
+
+
+def test_record_timeout():
+    recorder = VideoRecorder()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(recorder.record(0.01, timeout=0.01))
+    assert not recorder.recording
+    assert recorder._data_futures == []
+
+
+def test_record_cancelled():
+    recorder = VideoRecorder()
+
+    async def record():
+        task = asyncio.ensure_future(recorder.record(10))
+        await asyncio.sleep(0.01)
+        assert recorder.recording
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(record())
+    # a cancelled recording stops, and leaves no pending future
+    assert not recorder.recording
+    assert recorder._data_futures == []
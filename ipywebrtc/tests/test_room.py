@@ -0,0 +1,76 @@
+import pytest
+from traitlets import TraitError
+
+from ipywebrtc.webrtc import VIDEO_LAYERS, WebRTCPeer, WebRTCRoomKernel
+
+
+def make_room(room, sent):
+    widget = WebRTCRoomKernel(room=room)
+    widget.send = lambda content, buffers=None: sent.append((widget, content))
+    return widget
+
+
+def signal(widget, *messages):
+    widget._handle_frontend_msg(widget, {"msg": "signal", "messages": list(messages)}, [])
+
+
+def test_several_room_ids_per_widget():
+    sent = []
+    a = make_room("several", sent)
+    b = make_room("several", sent)
+    # a is shown in two frontends, joining with their own room_id
+    signal(a, {"type": "join", "room_id": "a1"})
+    signal(a, {"type": "join", "room_id": "a2"})
+    signal(b, {"type": "join", "room_id": "b1"})
+    assert sorted(WebRTCRoomKernel._rooms["several"]) == ["a1", "a2", "b1"]
+    sent.clear()
+    signal(b, {"type": "sdp", "room_id": "b1", "to": "a1"})
+    assert [widget for widget, _ in sent] == [a]
+    # one frontend leaving does not evict the other
+    signal(a, {"type": "leave", "room_id": "a1"})
+    assert sorted(WebRTCRoomKernel._rooms["several"]) == ["a2", "b1"]
+    a.close()
+    b.close()
+    assert "several" not in WebRTCRoomKernel._rooms
+
+
+def test_room_change():
+    sent = []
+    a = make_room("old", sent)
+    b = make_room("old", sent)
+    signal(a, {"type": "join", "room_id": "a1"})
+    signal(b, {"type": "join", "room_id": "b1"})
+    sent.clear()
+    b.room = "new"
+    assert list(WebRTCRoomKernel._rooms["old"]) == ["a1"]
+    assert list(WebRTCRoomKernel._rooms["new"]) == ["b1"]
+    # the old room is told b left
+    assert sent == [(a, {"msg": "signal", "messages": [{"type": "leave", "room_id": "b1"}]})]
+    a.close()
+    b.close()
+    assert WebRTCRoomKernel._rooms == {}
+
+
+def test_layers():
+    peer = WebRTCPeer(layer="half")
+    assert peer.layers == VIDEO_LAYERS
+    with pytest.raises(TraitError):
+        peer.layer = "tiny"
+    # the layers of a peer can be changed without changing the defaults
+    peer.layers["tiny"] = {"scale_resolution_down_by": 8}
+    peer.layer = "tiny"
+    assert "tiny" not in VIDEO_LAYERS
+    assert "tiny" not in WebRTCPeer().layers
+    with pytest.raises(TraitError):
+        WebRTCRoomKernel(room="layers", default_layer="tiny")
+
+    a = WebRTCPeer(id_remote="a")
+    b = WebRTCPeer(id_remote="b")
+    room = WebRTCRoomKernel(room="layers", default_layer="half", peers=[a, b])
+    room.set_layer("quarter", "b")
+    assert (a.layer, b.layer) == (None, "quarter")
+    room.set_layer("off")
+    assert (a.layer, b.layer) == ("off", "off")
+    with pytest.raises(ValueError):
+        room.set_layer("full", "c")
+    room.close()
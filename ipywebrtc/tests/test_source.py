@@ -0,0 +1,79 @@
+import struct
+
+import pytest
+
+from ipywebrtc.webrtc import AudioStream, VideoStream, _streamable
+
+
+def box(box_type, payload=b""):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def test_streamable():
+    plain = box(b"ftyp", b"isom") + box(b"moov", box(b"mvhd")) + box(b"mdat", b"x" * 100)
+    fragmented = (
+        box(b"ftyp", b"isom")
+        + box(b"moov", box(b"mvex"))
+        + box(b"moof", box(b"mfhd"))
+        + box(b"mdat", b"x" * 100)
+    )
+    assert _streamable("video/webm", b"")
+    assert _streamable('video/webm; codecs="vp8"', b"")
+    assert not _streamable("video/mp4", plain)
+    assert _streamable("video/mp4", fragmented)
+    assert _streamable('audio/mp4; codecs="mp4a.40.2"', fragmented)
+    assert not _streamable("video/ogg", fragmented)
+    # a truncated or invalid file is not streamable
+    assert not _streamable("video/mp4", plain[:12])
+    assert not _streamable("video/mp4", struct.pack(">I4s", 4, b"moov") + b"moof")
+
+
+def test_chunked_source(tmp_path):
+    filename = tmp_path / "video.webm"
+    data = bytes(range(256)) * 10
+    filename.write_bytes(data)
+    stream = VideoStream.from_file(str(filename), chunk_size=1000)
+    assert stream._source["size"] == len(data)
+    assert stream._source["streamable"]
+    sent = []
+    stream.send = lambda content, buffers=None: sent.append((content, buffers))
+    source = stream._memory_mapped_source
+
+    def read(offset):
+        source._handle_custom_msg(stream, {"msg": "read", "offset": offset, "length": 1000}, [])
+        return sent[-1]
+
+    received = b"".join(bytes(read(offset)[1][0]) for offset in range(0, len(data), 1000))
+    assert received == data
+    # unmapped after the last chunk, and mapped again when read again
+    assert source.mmap is None
+    assert bytes(read(0)[1][0]) == data[:1000]
+    assert source.mmap is not None
+    stream.close()
+    assert source.mmap is None
+
+
+def test_chunked_source_empty(tmp_path):
+    filename = tmp_path / "empty.webm"
+    filename.write_bytes(b"")
+    with pytest.raises(ValueError, match="empty"):
+        VideoStream.from_file(str(filename), chunk_size=1000)
+    with pytest.raises(ValueError, match="empty"):
+        AudioStream.from_file(str(filename), chunk_size=1000)
+
+
+def test_chunked_source_emptied(tmp_path):
+    # the file is truncated after it was unmapped, the frontend gets an error
+    filename = tmp_path / "video.webm"
+    filename.write_bytes(b"x" * 10)
+    stream = VideoStream.from_file(str(filename), chunk_size=1000)
+    sent = []
+    stream.send = lambda content, buffers=None: sent.append(content)
+    source = stream._memory_mapped_source
+    source._handle_custom_msg(stream, {"msg": "read", "offset": 0, "length": 1000}, [])
+    assert source.mmap is None
+    filename.write_bytes(b"")
+    source._handle_custom_msg(stream, {"msg": "read", "offset": 0, "length": 1000}, [])
+    assert sent[-1]["msg"] == "source_error"
+    assert "empty" in sent[-1]["error"]
+    stream.close()
@@ -0,0 +1,201 @@
+import io
+import struct
+
+import pytest
+
+from ipywebrtc import webm
+from ipywebrtc.webm import _children, _element, _uint, _uint_element
+from ipywebrtc.webrtc import RecorderGroup, VideoRecorder
+
+UNKNOWN_SIZE = b"\x01\xff\xff\xff\xff\xff\xff\xff"
+AUDIO, VIDEO = 1, 2
+
+
+def block(track, timecode, keyframe):
+    header = bytes([0x80 | track]) + struct.pack(">hB", timecode, 0x80 if keyframe else 0)
+    return _element(webm.SIMPLE_BLOCK, header + b"x" * 50)
+
+
+def recording(clusters=3, frames=30):
+    """A WebM file like MediaRecorder writes it: unknown sizes, no duration and no cues."""
+    segment = _element(webm.INFO, _uint_element(webm.TIMECODE_SCALE, 1000000))
+    tracks = _element(
+        webm.TRACK_ENTRY,
+        _uint_element(webm.TRACK_NUMBER, AUDIO) + _uint_element(webm.TRACK_TYPE, 2),
+    ) + _element(
+        webm.TRACK_ENTRY,
+        _uint_element(webm.TRACK_NUMBER, VIDEO) + _uint_element(webm.TRACK_TYPE, 1),
+    )
+    segment += _element(webm.TRACKS, tracks)
+    for cluster in range(clusters):
+        body = _uint_element(webm.TIMECODE, cluster * 1000)
+        for i in range(frames):
+            body += block(AUDIO, i * 33, True)
+            body += block(VIDEO, i * 33 + 5, i == 0)
+        segment += webm.CLUSTER.to_bytes(4, "big") + UNKNOWN_SIZE + body
+    return _element(webm.EBML, b"") + webm.SEGMENT.to_bytes(4, "big") + UNKNOWN_SIZE + segment
+
+
+def parse(data):
+    """Return the segment children of a seekable file, as (id, payload, offset) tuples."""
+    (ebml_id, _, ebml), (segment_id, segment, _) = list(_children(data))
+    assert ebml_id == webm.EBML
+    assert segment_id == webm.SEGMENT
+    # the segment size is known and covers the rest of the file
+    assert len(ebml) + 12 + len(segment) == len(data)
+    elements = []
+    offset = 0
+    for element_id, payload, raw in _children(segment):
+        elements.append((element_id, payload, offset))
+        offset += len(raw)
+    return segment, elements
+
+
+def test_make_seekable(tmp_path):
+    filename = str(tmp_path / "record.webm")
+    with open(filename, "wb") as f:
+        f.write(recording())
+    info = webm.make_seekable(filename)
+    # the last video frame is at 2000 + 29 * 33 + 5 ms, and lasts one interval of 33 ms
+    assert info == {"duration": 2.995, "clusters": 3, "cues": 3}
+    with open(filename, "rb") as f:
+        segment, elements = parse(f.read())
+    ids = [element_id for element_id, _, _ in elements]
+    assert ids == [webm.SEEK_HEAD, webm.INFO, webm.TRACKS] + [webm.CLUSTER] * 3 + [webm.CUES]
+    positions = {element_id: offset for element_id, _, offset in elements}
+    payloads = {element_id: payload for element_id, payload, _ in elements}
+
+    # the seek head points to the info, tracks and cues
+    seeks = {}
+    for _, seek, _ in _children(payloads[webm.SEEK_HEAD]):
+        fields = {child_id: child for child_id, child, _ in _children(seek)}
+        seeks[_uint(fields[webm.SEEK_ID])] = _uint(fields[webm.SEEK_POSITION])
+    assert seeks == {element_id: positions[element_id] for element_id in seeks}
+    assert set(seeks) == {webm.INFO, webm.TRACKS, webm.CUES}
+
+    info_fields = {child_id: child for child_id, child, _ in _children(payloads[webm.INFO])}
+    assert struct.unpack(">d", info_fields[webm.DURATION]) == (2995.0,)
+
+    # a cue per cluster, on the first video keyframe
+    clusters = [offset for element_id, _, offset in elements if element_id == webm.CLUSTER]
+    cues = []
+    for _, cue_point, _ in _children(payloads[webm.CUES]):
+        fields = {child_id: child for child_id, child, _ in _children(cue_point)}
+        positions = {
+            child_id: _uint(child)
+            for child_id, child, _ in _children(fields[webm.CUE_TRACK_POSITIONS])
+        }
+        cues.append(
+            (
+                _uint(fields[webm.CUE_TIME]),
+                positions[webm.CUE_TRACK],
+                positions[webm.CUE_CLUSTER_POSITION],
+            )
+        )
+        # the relative position is that of the keyframe in the cluster
+        cluster_payload = next(
+            payload
+            for _, payload, offset in elements
+            if offset == positions[webm.CUE_CLUSTER_POSITION]
+        )
+        ((element_id, payload, _),) = _children(
+            cluster_payload[positions[webm.CUE_RELATIVE_POSITION] :][: 4 + 50 + 2]
+        )
+        assert element_id == webm.SIMPLE_BLOCK
+        assert webm._block_header(payload) == (VIDEO, 5, 0x80)
+    assert cues == [(5, VIDEO, clusters[0]), (1005, VIDEO, clusters[1]), (2005, VIDEO, clusters[2])]
+
+
+def test_make_seekable_twice(tmp_path):
+    # a seekable file stays the same
+    filename = str(tmp_path / "record.webm")
+    with open(filename, "wb") as f:
+        f.write(recording())
+    webm.make_seekable(filename)
+    with open(filename, "rb") as f:
+        once = f.read()
+    assert webm.make_seekable(filename, str(tmp_path / "twice.webm"))["cues"] == 3
+    with open(str(tmp_path / "twice.webm"), "rb") as f:
+        assert f.read() == once
+
+
+def test_truncated(tmp_path):
+    # cut off in the middle of a block of the last cluster
+    data = recording()
+    target = str(tmp_path / "truncated.webm")
+    info = webm.make_seekable(io.BytesIO(data[: len(data) - 100]), target)
+    assert info["clusters"] == 3
+    with open(target, "rb") as f:
+        _, elements = parse(f.read())
+    assert [element_id for element_id, _, _ in elements][-1] == webm.CUES
+
+
+def test_invalid(tmp_path):
+    target = tmp_path / "target.webm"
+    target.write_bytes(b"untouched")
+    with pytest.raises(ValueError):
+        webm.make_seekable(io.BytesIO(b"not a webm file"), str(target))
+    with pytest.raises(ValueError):
+        webm.make_seekable(io.BytesIO(b""), str(target))
+    assert target.read_bytes() == b"untouched"
+    # no temporary files are left behind
+    assert [path.name for path in tmp_path.iterdir()] == ["target.webm"]
+
+
+def test_truncated_header(tmp_path):
+    # a recording stopped right after it started
+    data = recording()
+    for size in [1, 4, 20, 40]:
+        with pytest.raises(ValueError):
+            webm.make_seekable(io.BytesIO(data[:size]), str(tmp_path / "target.webm"))
+        with pytest.raises(ValueError):
+            webm.frame_times(io.BytesIO(data[:size]))
+
+
+def test_corrupt(tmp_path):
+    data = bytearray(recording())
+    # the size of the info element, larger than the file
+    data[data.index(webm.INFO.to_bytes(4, "big")) + 4] = 0x01
+    with pytest.raises(ValueError):
+        webm.make_seekable(io.BytesIO(bytes(data)), str(tmp_path / "target.webm"))
+    # a block header that does not fit in its block group
+    data = bytearray(recording())
+    group = _element(webm.BLOCK_GROUP, b"\xa1\x85\x82")
+    cluster = data.index(webm.CLUSTER.to_bytes(4, "big"))
+    data[cluster + 12 : cluster + 12] = group
+    with pytest.raises(ValueError):
+        webm.frame_times(io.BytesIO(bytes(data)))
+    # garbage after the EBML header
+    data = _element(webm.EBML, b"") + bytes(range(256)) * 4
+    with pytest.raises(ValueError):
+        webm.frame_times(io.BytesIO(data))
+
+
+def test_save_corrupt(tmp_path):
+    # a recording that cannot be made seekable is saved as recorded
+    recorder = VideoRecorder(seekable=True)
+    data = recording()[:30]
+    recorder.video.value = data
+    recorder.save(str(tmp_path / "video"))
+    assert (tmp_path / "video.webm").read_bytes() == data
+
+
+def test_frame_times():
+    data = recording(clusters=2, frames=3)
+    assert webm.frame_times(io.BytesIO(data)) == [0.005, 0.038, 0.071, 1.005, 1.038, 1.071]
+    assert webm.frame_times(io.BytesIO(data), track=AUDIO) == [0, 0.033, 0.066, 1.0, 1.033, 1.066]
+
+
+def test_group_recordings_corrupt():
+    # a corrupt member recording has no frame times, and does not affect the others
+    recorders = [VideoRecorder(), VideoRecorder(), VideoRecorder()]
+    group = RecorderGroup(recorders=recorders)
+    group.set_trait("offsets", [0.5, 0.25, 0.0])
+    data = recording(clusters=1, frames=2)
+    recorders[0].video.value = data
+    recorders[1].video.value = data[:40]
+    corrupt = bytearray(data)
+    corrupt[corrupt.index(webm.INFO.to_bytes(4, "big")) + 4] = 0x01
+    recorders[2].video.value = bytes(corrupt)
+    recordings = group.recordings()
+    assert [recording["frame_times"] for recording in recordings] == [[0.505, 0.538], None, None]
@@ -0,0 +1,450 @@
+"""Make WebM files (as written by the browser's MediaRecorder) seekable.
+
+MediaRecorder writes WebM as it goes: the segment and clusters have an unknown size, and there
+is no duration and no index of the clusters (cues). Players then show an unknown length, and
+seeking means scanning the file. :func:`make_seekable` rewrites such a file in a single pass::
+
+    >>> import ipywebrtc.webm
+    >>> ipywebrtc.webm.make_seekable("record.webm")
+    {'duration': 12.345, 'clusters': 4, 'cues': 4}
+
+The output has known element sizes, a duration, a seek head and cues (at the end, like most
+muxers write them). The input is read sequentially, and at most one block is held in memory,
+so it works for files of any size. A truncated input, e.g. from a recording that was cut off,
+is rewritten up to the last complete block.
+
+Recorders apply this when saving a WebM recording, see :attr:`~ipywebrtc.webrtc.Recorder.seekable`.
+
+:func:`frame_times` parses a file the same way, and returns when the frames of a track were
+recorded, e.g. to align the recordings of a :class:`~ipywebrtc.webrtc.RecorderGroup`.
+"""
+
+import os
+import struct
+import tempfile
+
+EBML = 0x1A45DFA3
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+INFO = 0x1549A966
+TIMECODE_SCALE = 0x2AD7B1
+DURATION = 0x4489
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_TYPE = 0x83
+CLUSTER = 0x1F43B675
+TIMECODE = 0xE7
+SIMPLE_BLOCK = 0xA3
+BLOCK_GROUP = 0xA0
+BLOCK = 0xA1
+BLOCK_DURATION = 0x9B
+REFERENCE_BLOCK = 0xFB
+CUES = 0x1C53BB6B
+CUE_POINT = 0xBB
+CUE_TIME = 0xB3
+CUE_TRACK_POSITIONS = 0xB7
+CUE_TRACK = 0xF7
+CUE_CLUSTER_POSITION = 0xF1
+CUE_RELATIVE_POSITION = 0xF0
+VOID = 0xEC
+
+# the children of a segment, an element of unknown size (a cluster) ends at one of these
+LEVEL1 = {SEEK_HEAD, INFO, TRACKS, CLUSTER, CUES, VOID, 0x1254C367, 0x1043A770, 0x1941A469}
+TRACK_TYPE_VIDEO = 1
+DEFAULT_TIMECODE_SCALE = 1000000  # nanoseconds
+
+# a size of 8 bytes, so we can write the real size later
+SIZE_PLACEHOLDER = b"\x01" + b"\x00" * 7
+
+
+# larger elements are read in parts of this size
+_READ_SIZE = 1 << 24
+
+
+class _EndOfData(Exception):
+    pass
+
+
+class _Reader(object):
+    def __init__(self, f):
+        self.f = f
+        self.position = 0
+
+    def read(self, size):
+        if size <= _READ_SIZE:
+            data = self.f.read(size)
+        else:
+            # a corrupt size can be huge, so we do not allocate it at once, but stop at the
+            # end of the file
+            parts = []
+            remaining = size
+            while remaining > 0:
+                part = self.f.read(min(remaining, _READ_SIZE))
+                if not part:
+                    break
+                parts.append(part)
+                remaining -= len(part)
+            data = b"".join(parts)
+        self.position += len(data)
+        if len(data) < size:
+            raise _EndOfData()
+        return data
+
+    def _vint(self):
+        first = self.read(1)
+        length = 9 - first[0].bit_length()
+        if length > 8:
+            raise ValueError("invalid EBML variable size integer at %d" % (self.position - 1))
+        return first + self.read(length - 1) if length > 1 else first
+
+    def header(self):
+        """Read an element header, returns the id, the size (None when unknown) and the bytes."""
+        id_bytes = self._vint()
+        size_bytes = self._vint()
+        size = _vint_value(size_bytes)
+        if size == (1 << (7 * len(size_bytes))) - 1:
+            size = None
+        return int.from_bytes(id_bytes, "big"), size, id_bytes + size_bytes
+
+
+def _vint_value(data):
+    return int.from_bytes(data, "big") & ((1 << (7 * len(data))) - 1)
+
+
+def _children(payload):
+    """Yield the id, payload and bytes of the elements in a payload (all of known size)."""
+    offset = 0
+    while offset < len(payload):
+        start = offset
+        values = []
+        for _ in range(2):
+            if offset >= len(payload):
+                raise ValueError("element header does not fit in its parent")
+            length = 9 - payload[offset].bit_length()
+            if length > 8:
+                raise ValueError("invalid EBML variable size integer")
+            values.append(payload[offset : offset + length])
+            offset += length
+        element_id = int.from_bytes(values[0], "big")
+        size = _vint_value(values[1])
+        if offset + size > len(payload):
+            raise ValueError("element 0x%X does not fit in its parent" % element_id)
+        yield element_id, payload[offset : offset + size], payload[start : offset + size]
+        offset += size
+
+
+def _uint(payload):
+    return int.from_bytes(payload, "big")
+
+
+def _encode_size(size):
+    length = 1
+    while size >= (1 << (7 * length)) - 1:
+        length += 1
+    return ((1 << (7 * length)) | size).to_bytes(length, "big")
+
+
+def _element(element_id, payload):
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+    return id_bytes + _encode_size(len(payload)) + payload
+
+
+def _uint_element(element_id, value):
+    return _element(element_id, value.to_bytes(max(1, (value.bit_length() + 7) // 8), "big"))
+
+
+def _block_header(payload):
+    """The track number, relative timecode and flags of a (simple) block."""
+    length = 9 - payload[0].bit_length()
+    track = _vint_value(payload[:length])
+    timecode, flags = struct.unpack(">hB", payload[length : length + 3])
+    return track, timecode, flags
+
+
+class _Remuxer(object):
+    def __init__(self, reader, out):
+        self.reader = reader
+        self.out = out
+        self.segment_start = None
+        self.timecode_scale = DEFAULT_TIMECODE_SCALE
+        self.video_tracks = set()
+        self.cue_track = None
+        self.cues = []
+        self.clusters = 0
+        self.end = 0  # in timecode units
+        self.last = {}  # track number to (timecode, interval)
+        self.positions = {}  # level 1 id to position relative to the segment data
+        self.duration_offset = None
+        self.times = None  # track number to block timecodes, when collected
+
+    def run(self):
+        """Remux the file, raises a ValueError when it is not valid WebM, or cut off before the
+        first cluster."""
+        try:
+            return self._run()
+        except _EndOfData:
+            raise ValueError("truncated WebM file, it ends before the first cluster") from None
+        except (IndexError, OverflowError, struct.error) as e:
+            # corrupt sizes and payloads, e.g. an element that does not fit in its parent
+            raise ValueError("corrupt WebM file at %d: %s" % (self.reader.position, e)) from e
+
+    def _run(self):
+        reader, out = self.reader, self.out
+        try:
+            element_id, size, header = reader.header()
+        except _EndOfData:
+            if reader.position == 0:
+                raise ValueError("empty file") from None
+            raise
+        if element_id != EBML or size is None:
+            raise ValueError("not a WebM file, no EBML header")
+        out.write(header + reader.read(size))
+        element_id, size, header = reader.header()
+        if element_id != SEGMENT:
+            raise ValueError("no segment after the EBML header")
+        segment_end = None if size is None else reader.position + size
+
+        out.write(SEGMENT.to_bytes(4, "big") + SIZE_PLACEHOLDER)
+        self.segment_start = out.tell()
+        # the seek head points to the info, tracks and cues, its positions are filled in later
+        seek_head_offset = out.tell()
+        entry = _element(
+            SEEK,
+            _element(SEEK_ID, b"\x00" * 4) + _element(SEEK_POSITION, b"\x00" * 8),
+        )
+        out.write(_element(SEEK_HEAD, entry * 3))
+
+        pending = None
+        while pending or segment_end is None or reader.position < segment_end:
+            try:
+                element_id, size, header = pending or reader.header()
+            except _EndOfData:
+                break
+            pending = None
+            if element_id == CLUSTER:
+                pending = self._cluster(header, size)
+                continue
+            if size is None:
+                raise ValueError("element 0x%X of unknown size" % element_id)
+            try:
+                payload = reader.read(size)
+            except _EndOfData:
+                break
+            if element_id in (SEEK_HEAD, CUES, VOID):
+                # we write our own
+                continue
+            if element_id == INFO:
+                self._info(payload)
+            else:
+                if element_id == TRACKS:
+                    self._tracks(payload)
+                    self.positions[TRACKS] = out.tell() - self.segment_start
+                out.write(header + payload)
+
+        if self.clusters == 0:
+            raise _EndOfData()
+        if self.cues:
+            self.positions[CUES] = out.tell() - self.segment_start
+            out.write(_element(CUES, b"".join(self.cues)))
+        end = out.tell()
+
+        out.seek(self.segment_start - 8)
+        out.write((0x01 << 56 | (end - self.segment_start)).to_bytes(8, "big"))
+        if self.duration_offset is not None:
+            out.seek(self.duration_offset)
+            out.write(struct.pack(">d", float(self.end)))
+        # the entries are 21 bytes, after the 5 bytes of the seek head header
+        for index, element_id in enumerate((INFO, TRACKS, CUES)):
+            out.seek(seek_head_offset + 5 + index * len(entry))
+            if element_id in self.positions:
+                out.write(
+                    _element(
+                        SEEK,
+                        _element(SEEK_ID, element_id.to_bytes(4, "big"))
+                        + _element(SEEK_POSITION, self.positions[element_id].to_bytes(8, "big")),
+                    )
+                )
+            else:
+                out.write(_element(VOID, b"\x00" * (len(entry) - 2)))
+        out.seek(end)
+        out.truncate()
+        return {
+            "duration": self.end * self.timecode_scale / 1e9,
+            "clusters": self.clusters,
+            "cues": len(self.cues),
+        }
+
+    def _info(self, payload):
+        children = []
+        for element_id, child, data in _children(payload):
+            if element_id == TIMECODE_SCALE:
+                self.timecode_scale = _uint(child)
+            if element_id not in (DURATION, VOID):
+                children.append(data)
+        duration = _element(DURATION, b"\x00" * 8)
+        info = _element(INFO, b"".join(children) + duration)
+        self.positions[INFO] = self.out.tell() - self.segment_start
+        self.duration_offset = self.out.tell() + len(info) - 8
+        self.out.write(info)
+
+    def _tracks(self, payload):
+        for element_id, entry, _ in _children(payload):
+            if element_id != TRACK_ENTRY:
+                continue
+            fields = {child_id: child for child_id, child, _ in _children(entry)}
+            if TRACK_NUMBER in fields and _uint(fields.get(TRACK_TYPE, b"")) == TRACK_TYPE_VIDEO:
+                self.video_tracks.add(_uint(fields[TRACK_NUMBER]))
+
+    def _cluster(self, header, size):
+        """Copy a cluster with a known size, returns the header of the next element when the
+        cluster had an unknown size, and ended at it."""
+        reader, out = self.reader, self.out
+        cluster_offset = out.tell()
+        out.write(CLUSTER.to_bytes(4, "big") + SIZE_PLACEHOLDER)
+        data_start = out.tell()
+        end = None if size is None else reader.position + size
+        timecode = 0
+        cued = False
+        pending = None
+        while end is None or reader.position < end:
+            try:
+                element_id, size, header = reader.header()
+                if end is None and element_id in LEVEL1:
+                    pending = element_id, size, header
+                    break
+                if size is None:
+                    raise ValueError("element 0x%X of unknown size in a cluster" % element_id)
+                payload = reader.read(size)
+            except _EndOfData:
+                break
+            block = keyframe = duration = None
+            if element_id == TIMECODE:
+                timecode = _uint(payload)
+            elif element_id == SIMPLE_BLOCK:
+                block = payload
+                keyframe = bool(_block_header(payload)[2] & 0x80)
+            elif element_id == BLOCK_GROUP:
+                fields = {child_id: child for child_id, child, _ in _children(payload)}
+                block = fields.get(BLOCK)
+                keyframe = REFERENCE_BLOCK not in fields
+                if BLOCK_DURATION in fields:
+                    duration = _uint(fields[BLOCK_DURATION])
+            if block is not None:
+                track, relative, _ = _block_header(block)
+                time = timecode + relative
+                self._timing(track, time, duration)
+                if self.times is not None:
+                    self.times.setdefault(track, []).append(time)
+                if self.cue_track is None and (not self.video_tracks or track in self.video_tracks):
+                    self.cue_track = track
+                if keyframe and not cued and track == self.cue_track:
+                    cued = True
+                    self._cue(time, track, cluster_offset, out.tell() - data_start)
+            out.write(header + payload)
+        cluster_end = out.tell()
+        out.seek(data_start - 8)
+        out.write((0x01 << 56 | (cluster_end - data_start)).to_bytes(8, "big"))
+        out.seek(cluster_end)
+        self.clusters += 1
+        return pending
+
+    def _timing(self, track, time, duration):
+        # a block lasts till the next block of the same track, for the last block we assume
+        # the same interval as the previous one (unless the block has a duration)
+        previous, interval = self.last.get(track, (None, 0))
+        if previous is not None and time > previous:
+            interval = time - previous
+        self.last[track] = time, interval
+        self.end = max(self.end, time + (duration if duration is not None else interval))
+
+    def _cue(self, time, track, cluster_offset, relative_position):
+        positions = (
+            _uint_element(CUE_TRACK, track)
+            + _uint_element(CUE_CLUSTER_POSITION, cluster_offset - self.segment_start)
+            + _uint_element(CUE_RELATIVE_POSITION, relative_position)
+        )
+        self.cues.append(
+            _element(
+                CUE_POINT,
+                _uint_element(CUE_TIME, time) + _element(CUE_TRACK_POSITIONS, positions),
+            )
+        )
+
+
+def make_seekable(source, target=None, buffer_size=1 << 20):
+    """Rewrite a WebM file with a duration, known element sizes and cues, so it can be seeked.
+
+    :param source: A filename or a binary file object (read from the current position).
+    :param str target: The filename to write to, when None the source file is replaced (source
+        should be a filename then).
+    :param int buffer_size: The size of the read and write buffers.
+    :return: A dict with the duration (in seconds), and the number of clusters and cues.
+    :raises ValueError: When the source is not a WebM file, is corrupt, or ends before the
+        first cluster, the target is left untouched then.
+    """
+    if target is None:
+        if not isinstance(source, str):
+            raise ValueError("a target is needed when the source is not a filename")
+        target = source
+    # we write to a temporary file, so an invalid source does not leave a partial target, and
+    # the source can be replaced
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(target)), suffix=".webm")
+    try:
+        with os.fdopen(fd, "wb", buffering=buffer_size) as out:
+            if isinstance(source, str):
+                with open(source, "rb", buffering=buffer_size) as f:
+                    info = _Remuxer(_Reader(f), out).run()
+            else:
+                info = _Remuxer(_Reader(source), out).run()
+        os.replace(temporary, target)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return info
+
+
+class _NullWriter(object):
+    """Counts what is written, for when we only parse."""
+
+    def __init__(self):
+        self.position = 0
+        self.size = 0
+
+    def write(self, data):
+        self.position += len(data)
+        self.size = max(self.size, self.position)
+
+    def tell(self):
+        return self.position
+
+    def seek(self, position):
+        self.position = position
+
+    def truncate(self):
+        self.size = self.position
+
+
+def frame_times(source, track=None, buffer_size=1 << 20):
+    """Return the times of the frames (blocks) of a track, in seconds from the start of the file.
+
+    :param source: A filename or a binary file object (read from the current position).
+    :param int track: The track number, by default the first video track, or the first track
+        for audio only files.
+    :param int buffer_size: The size of the read buffer.
+    :return: A list of times, in the order of the file.
+    :raises ValueError: When the source is not a WebM file, is corrupt, or ends before the
+        first cluster.
+    """
+    if isinstance(source, str):
+        with open(source, "rb", buffering=buffer_size) as f:
+            return frame_times(f, track)
+    remuxer = _Remuxer(_Reader(source), _NullWriter())
+    remuxer.times = {}
+    remuxer.run()
+    if track is None:
+        track = remuxer.cue_track
+    return [time * remuxer.timecode_scale / 1e9 for time in remuxer.times.get(track, [])]
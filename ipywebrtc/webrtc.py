@@ -1,31 +1,88 @@
 from __future__ import absolute_import
 
+import asyncio
+import collections
+import concurrent.futures
+import io
 import logging
+import mimetypes
+import mmap
 import os
-from urllib.request import urlopen
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import weakref
 
 import traitlets
-from ipywidgets import Audio, DOMWidget, Image, Video, register, widget_serialization
+from ipywidgets import (
+    Audio,
+    CallbackDispatcher,
+    DOMWidget,
+    Image,
+    Video,
+    register,
+    widget_serialization,
+)
 from traitlets import (
+    Any,
     Bool,
     Dict,
+    Enum,
+    Float,
     Instance,
     Int,
     List,
     TraitError,
     Unicode,
+    Union,
     observe,
     validate,
 )
 
 import ipywebrtc._version
+import ipywebrtc.cache
+import ipywebrtc.metrics
+import ipywebrtc.ringbuffer
+import ipywebrtc.webm
 
 logger = logging.getLogger("jupyter-webrtc")
 semver_range_frontend = "~" + ipywebrtc._version.__version_js__
 
 
+class _HasMetrics(traitlets.HasTraits):
+    """The metrics of a widget, measured by its frontend (see ipywebrtc.metrics)."""
+
+    metrics = Bool(
+        False,
+        help="(boolean) When True, the timings and sizes of the capture stages are measured, see stats().",
+    ).tag(sync=True)
+
+    def __init__(self, **kwargs):
+        super(_HasMetrics, self).__init__(**kwargs)
+        self._metrics = ipywebrtc.metrics.Metrics()
+        self.on_msg(self._handle_metrics_msg)
+
+    def _handle_metrics_msg(self, widget, content, buffers):
+        if content.get("msg") == "metrics":
+            self._metrics.record_events(content["events"])
+
+    def stats(self):
+        """Return the duration (in milliseconds) and size summaries per capture stage, see metrics.
+
+        :rtype: dict
+        """
+        return self._metrics.stats()
+
+    def export_stats(self):
+        """Return the measurements of the capture stages in the Prometheus text format."""
+        labels = {"widget": self.__class__.__name__, "model_id": self.model_id}
+        return self._metrics.export(labels=labels)
+
+
 @register
-class MediaStream(DOMWidget):
+class MediaStream(_HasMetrics, DOMWidget):
     """Represents a media source.
 
     See https://developer.mozilla.org/nl/docs/Web/API/MediaStream for details
@@ -38,6 +95,7 @@ class MediaStream(DOMWidget):
        * :class:`CameraStream`: Webcam/camera as media stream.
        * :class:`ImageStream`: An image as a static stream.
        * :class:`WidgetStream`: Arbitrary DOMWidget as stream.
+       * :class:`ArrayStream`: Frames (NumPy arrays) pushed from the kernel as stream.
 
     A MediaStream can be used with:
        * :class:`VideoRecorder`: To record a movie
@@ -58,9 +116,195 @@ class MediaStream(DOMWidget):
 HasStream = MediaStream
 
 
+class _MemoryMappedSource(object):
+    """Sends ranges of a memory-mapped file to the frontend of a stream widget, on request.
+
+    The file is unmapped after the last chunk is sent, and mapped again when a frontend reads it
+    again (e.g. when it falls back from a MediaSource to reading the whole file).
+    """
+
+    def __init__(self, widget, filename, mime_type, chunk_size):
+        self.filename = filename
+        self.mmap = None
+        self._map()
+        widget._source = {
+            "size": len(self.mmap),
+            "mime_type": mime_type,
+            "chunk_size": chunk_size,
+            "streamable": _streamable(mime_type, self.mmap),
+        }
+        widget.on_msg(self._handle_custom_msg)
+
+    def _map(self):
+        with open(self.filename, "rb") as f:
+            # mmap cannot map an empty file, and there is nothing to play
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ValueError("cannot stream %s, the file is empty" % self.filename)
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _handle_custom_msg(self, widget, content, buffers):
+        if content.get("msg") == "read":
+            offset = content["offset"]
+            try:
+                if self.mmap is None:
+                    self._map()
+                # slicing only copies the requested range into memory
+                chunk = self.mmap[offset : offset + content["length"]]
+            except (OSError, ValueError) as e:
+                logger.exception("Error reading %s", self.filename)
+                widget.send({"msg": "source_error", "offset": offset, "error": str(e)})
+                return
+            widget.send({"msg": "source_chunk", "offset": offset}, [chunk])
+            if offset + len(chunk) >= len(self.mmap):
+                self.close()
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+
+
+def _streamable(mime_type, data):
+    """Return True when a MediaSource can play the file while it is transferred: webm, or mp4
+    when it is fragmented. A plain mp4 cannot be appended to a SourceBuffer."""
+    container = mime_type.split(";")[0].split("/")[-1]
+    if container == "webm":
+        return True
+    if container != "mp4":
+        return False
+    # a fragmented mp4 has moof boxes at the top level
+    offset = 0
+    while offset + 8 <= len(data):
+        size, box_type = struct.unpack(">I4s", data[offset : offset + 8])
+        if box_type == b"moof":
+            return True
+        if size == 1:  # the size follows as 64 bit integer
+            if offset + 16 > len(data):
+                break
+            size = struct.unpack(">Q", data[offset + 8 : offset + 16])[0]
+        elif size == 0:  # the box extends to the end of the file
+            break
+        if size < 8:
+            break  # not a valid box
+        offset += size
+    return False
+
+
+def _remove_files(filenames):
+    for filename in filenames:
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+
+def _download(url, filename, progress=None, chunk_size=1 << 16):
+    # imported here, since urllib.request (with ssl) is slow to import
+    from urllib.request import urlopen
+
+    # stream the response to a file, so we never hold it in memory as a whole
+    with urlopen(url) as response, open(filename, "wb") as f:
+        total = response.headers.get("Content-Length")
+        total = int(total) if total else None
+        downloaded = 0
+        while True:
+            chunk = response.read(chunk_size)
+            if not chunk:
+                break
+            f.write(chunk)
+            downloaded += len(chunk)
+            if progress:
+                progress(downloaded, total)
+
+
+def _download_bytes(url, progress=None):
+    """Download url and return its content, using the media cache when enabled."""
+    cache = ipywebrtc.cache.get_cache()
+    key = cache.url_key(url) if cache is not None else None
+    if key is not None:
+        cached = cache.open(key)
+        if cached is not None:
+            with cached:
+                return cached.read()
+    elif progress is None:
+        from urllib.request import urlopen
+
+        return urlopen(url).read()
+    fd, filename = tempfile.mkstemp(suffix=os.path.splitext(url)[1])
+    os.close(fd)
+    try:
+        _download(url, filename, progress)
+        with open(filename, "rb") as f:
+            data = f.read()
+        if key is not None:
+            cache.put(key, filename, move=True)
+    finally:
+        if os.path.exists(filename):
+            os.remove(filename)
+    return data
+
+
+def _media_from_file(media_class, kind, filename, **kwargs):
+    """Like media_class.from_file, but using the media cache when enabled."""
+    cache = ipywebrtc.cache.get_cache()
+    if cache is None:
+        return media_class.from_file(filename, **kwargs)
+    key = cache.file_key(filename)
+    cached = cache.open(key)
+    if cached is None:
+        # the file has the same content as what we put in the cache
+        cache.put(key, filename)
+        return media_class.from_file(filename, **kwargs)
+    with cached:
+        value = cached.read()
+    # the cached file has no extension, so we guess the format like ipywidgets does
+    mime_type = mimetypes.guess_type(filename)[0]
+    if "format" not in kwargs and mime_type and mime_type.startswith(kind + "/"):
+        kwargs["format"] = mime_type[len(kind) + 1 :]
+    return media_class(value=value, **kwargs)
+
+
+def _download_in_background(stream, media, url):
+    """Download url in a thread, and assign it to the value of the media widget when done."""
+
+    def progress(downloaded, total):
+        # 1 means the value is assigned, which happens after the last chunk
+        if total and downloaded < total:
+            stream.download_progress = downloaded / total
+
+    def run():
+        try:
+            media.value = _download_bytes(url, progress)
+        except Exception as e:
+            logger.exception("Error downloading %s", url)
+            # the error first, so observers of download_progress can check it
+            stream.download_error = "%s: %s" % (type(e).__name__, e)
+            stream.download_progress = None
+        else:
+            stream.download_progress = 1.0
+
+    stream.download_error = None
+    stream.download_progress = 0.0
+    stream._download_thread = threading.Thread(target=run, name="ipywebrtc-download", daemon=True)
+    stream._download_thread.start()
+    return stream
+
+
+def _source_mime_type(kind, filename, codecs):
+    mime_type = kind + "/" + os.path.splitext(filename)[1][1:].lower()
+    if codecs:
+        mime_type += '; codecs="%s"' % codecs
+    return mime_type
+
+
 @register
 class WidgetStream(MediaStream):
-    """Represents a widget media source."""
+    """Represents a widget media source.
+
+    When the widget has no canvas or video element, it is rendered using html2canvas. With
+    max_fps=None this only happens after the widget (or its DOM) changed, and a frame is only
+    added to the stream when it differs from the previous one.
+    """
 
     _model_name = Unicode("WidgetStreamModel").tag(sync=True)
     _view_name = Unicode("WidgetStreamView").tag(sync=True)
@@ -75,6 +319,18 @@ class WidgetStream(MediaStream):
         allow_none=True,
         help="(int, default None) The maximum amount of frames per second to capture, or only on new data when the valeus is None.",
     ).tag(sync=True)
+    capture_fps = Float(
+        None,
+        allow_none=True,
+        read_only=True,
+        help="The number of (distinct) frames per second captured over the last second, when the widget is rendered using html2canvas. This is 0 while nothing changes.",
+    ).tag(sync=True)
+    render_time = Float(
+        None,
+        allow_none=True,
+        read_only=True,
+        help="The mean time in milliseconds html2canvas takes to render a frame.",
+    ).tag(sync=True)
     _html2canvas_start_streaming = Bool(False).tag(sync=True)
 
     @validate("max_fps")
@@ -94,6 +350,16 @@ class ImageStream(MediaStream):
         Image,
         help="An ipywidgets.Image instance that will be the source of the media stream.",
     ).tag(sync=True, **widget_serialization)
+    download_progress = Float(
+        None,
+        allow_none=True,
+        help="Progress (between 0 and 1) of a background download, see from_download. It is 1 when the download completed, and None again when it failed, see download_error.",
+    )
+    download_error = Unicode(
+        None,
+        allow_none=True,
+        help="The error of a failed background download, see from_download.",
+    )
 
     @classmethod
     def from_file(cls, filename, **kwargs):
@@ -106,7 +372,7 @@ class ImageStream(MediaStream):
         **kwargs
             Extra keyword arguments for `ImageStream`
         """
-        return cls(image=Image.from_file(filename), **kwargs)
+        return cls(image=_media_from_file(Image, "image", filename), **kwargs)
 
     @classmethod
     def from_url(cls, url, **kwargs):
@@ -124,7 +390,7 @@ class ImageStream(MediaStream):
         return cls(image=Image.from_url(url), **kwargs)
 
     @classmethod
-    def from_download(cls, url, **kwargs):
+    def from_download(cls, url, background=False, **kwargs):
         """Create a `ImageStream` from a url by downloading
 
         Parameters
@@ -132,13 +398,20 @@ class ImageStream(MediaStream):
         url: str
             The url of the file that will be downloadeded and its bytes
             assigned to the value trait of the video trait.
+        background: bool
+            Download in a background thread, and return the `ImageStream` directly. The
+            value is assigned once the download completes, see download_progress and
+            download_error.
         **kwargs
             Extra keyword arguments for `ImageStream`
         """
         ext = os.path.splitext(url)[1]
         if ext:
             format = ext[1:]
-        image = Image(value=urlopen(url).read(), format=format)
+        if background:
+            image = Image(format=format)
+            return _download_in_background(cls(image=image, **kwargs), image, url)
+        image = Image(value=_download_bytes(url), format=format)
         return cls(image=image, **kwargs)
 
 
@@ -154,19 +427,55 @@ class VideoStream(MediaStream):
         help="An ipywidgets.Video instance that will be the source of the media stream.",
     ).tag(sync=True, **widget_serialization)
     playing = Bool(True, help="Plays the videostream or pauses it.").tag(sync=True)
+    download_progress = Float(
+        None,
+        allow_none=True,
+        help="Progress (between 0 and 1) of a background download, see from_download. It is 1 when the download completed, and None again when it failed, see download_error.",
+    )
+    download_error = Unicode(
+        None,
+        allow_none=True,
+        help="The error of a failed background download, see from_download.",
+    )
+    _source = Dict(None, allow_none=True).tag(sync=True)
+    _memory_mapped_source = None
 
     @classmethod
-    def from_file(cls, filename, **kwargs):
+    def from_file(cls, filename, chunk_size=None, codecs=None, **kwargs):
         """Create a `VideoStream` from a local file.
 
+        By default the file is read into the value of a `Video` widget. When chunk_size is given,
+        the file is memory-mapped instead, and the frontend requests chunks of it while playing,
+        so playback can start before the whole file is transferred, and large files do not
+        need to fit in memory. The frontend then uses a MediaSource when it supports the format
+        (webm, or fragmented mp4), otherwise it collects all chunks before playing.
+
         Parameters
         ----------
         filename: str
             The location of a file to read into the value from disk.
+        chunk_size: int
+            Transfer the file in chunks of this many bytes.
+        codecs: str
+            Optional codecs of the file, e.g. "vp8, vorbis", used with chunk_size.
         **kwargs
             Extra keyword arguments for `VideoStream`
         """
-        video = Video.from_file(filename, autoplay=False, controls=False)
+        if chunk_size is not None:
+            # the (empty) video widget is not used for playing, it only holds the format
+            format = os.path.splitext(filename)[1][1:].lower()
+            video = Video(format=format, autoplay=False, controls=False)
+            stream = cls(video=video, **kwargs)
+            mime_type = _source_mime_type("video", filename, codecs)
+            try:
+                stream._memory_mapped_source = _MemoryMappedSource(
+                    stream, filename, mime_type, chunk_size
+                )
+            except (OSError, ValueError):
+                stream.close()
+                raise
+            return stream
+        video = _media_from_file(Video, "video", filename, autoplay=False, controls=False)
         return cls(video=video, **kwargs)
 
     @classmethod
@@ -186,7 +495,7 @@ class VideoStream(MediaStream):
         return cls(video=video, **kwargs)
 
     @classmethod
-    def from_download(cls, url, **kwargs):
+    def from_download(cls, url, background=False, **kwargs):
         """Create a `VideoStream` from a url by downloading
 
         Parameters
@@ -194,6 +503,10 @@ class VideoStream(MediaStream):
         url: str
             The url of the file that will be downloadeded and its bytes
             assigned to the value trait of the video trait.
+        background: bool
+            Download in a background thread, and return the `VideoStream` directly. The
+            value is assigned once the download completes, see download_progress and
+            download_error.
         **kwargs
             Extra keyword arguments for `VideoStream`
 
@@ -201,9 +514,17 @@ class VideoStream(MediaStream):
         ext = os.path.splitext(url)[1]
         if ext:
             format = ext[1:]
-        video = Video(value=urlopen(url).read(), format=format, autoplay=False, controls=False)
+        if background:
+            video = Video(format=format, autoplay=False, controls=False)
+            return _download_in_background(cls(video=video, **kwargs), video, url)
+        video = Video(value=_download_bytes(url), format=format, autoplay=False, controls=False)
         return cls(video=video, **kwargs)
 
+    def close(self):
+        if self._memory_mapped_source is not None:
+            self._memory_mapped_source.close()
+        super(VideoStream, self).close()
+
 
 @register
 class AudioStream(MediaStream):
@@ -217,19 +538,55 @@ class AudioStream(MediaStream):
         help="An ipywidgets.Audio instance that will be the source of the media stream.",
     ).tag(sync=True, **widget_serialization)
     playing = Bool(True, help="Plays the audiostream or pauses it.").tag(sync=True)
+    download_progress = Float(
+        None,
+        allow_none=True,
+        help="Progress (between 0 and 1) of a background download, see from_download. It is 1 when the download completed, and None again when it failed, see download_error.",
+    )
+    download_error = Unicode(
+        None,
+        allow_none=True,
+        help="The error of a failed background download, see from_download.",
+    )
+    _source = Dict(None, allow_none=True).tag(sync=True)
+    _memory_mapped_source = None
 
     @classmethod
-    def from_file(cls, filename, **kwargs):
+    def from_file(cls, filename, chunk_size=None, codecs=None, **kwargs):
         """Create a `AudioStream` from a local file.
 
+        By default the file is read into the value of a `Audio` widget. When chunk_size is given,
+        the file is memory-mapped instead, and the frontend requests chunks of it while playing,
+        so playback can start before the whole file is transferred, and large files do not
+        need to fit in memory. The frontend then uses a MediaSource when it supports the format
+        (webm, or fragmented mp4), otherwise it collects all chunks before playing.
+
         Parameters
         ----------
         filename: str
             The location of a file to read into the audio value from disk.
+        chunk_size: int
+            Transfer the file in chunks of this many bytes.
+        codecs: str
+            Optional codecs of the file, e.g. "vp8, vorbis", used with chunk_size.
         **kwargs
             Extra keyword arguments for `AudioStream`
         """
-        audio = Audio.from_file(filename, autoplay=False, controls=False)
+        if chunk_size is not None:
+            # the (empty) audio widget is not used for playing, it only holds the format
+            format = os.path.splitext(filename)[1][1:].lower()
+            audio = Audio(format=format, autoplay=False, controls=False)
+            stream = cls(audio=audio, **kwargs)
+            mime_type = _source_mime_type("audio", filename, codecs)
+            try:
+                stream._memory_mapped_source = _MemoryMappedSource(
+                    stream, filename, mime_type, chunk_size
+                )
+            except (OSError, ValueError):
+                stream.close()
+                raise
+            return stream
+        audio = _media_from_file(Audio, "audio", filename, autoplay=False, controls=False)
         return cls(audio=audio, **kwargs)
 
     @classmethod
@@ -249,7 +606,7 @@ class AudioStream(MediaStream):
         return cls(audio=audio, **kwargs)
 
     @classmethod
-    def from_download(cls, url, **kwargs):
+    def from_download(cls, url, background=False, **kwargs):
         """Create a `AudioStream` from a url by downloading
 
         Parameters
@@ -257,15 +614,137 @@ class AudioStream(MediaStream):
         url: str
             The url of the file that will be downloadeded and its bytes
             assigned to the value trait of the video trait.
+        background: bool
+            Download in a background thread, and return the `AudioStream` directly. The
+            value is assigned once the download completes, see download_progress and
+            download_error.
         **kwargs
             Extra keyword arguments for `AudioStream`
         """
         ext = os.path.splitext(url)[1]
         if ext:
             format = ext[1:]
-        audio = Audio(value=urlopen(url).read(), format=format, autoplay=False, controls=False)
+        if background:
+            audio = Audio(format=format, autoplay=False, controls=False)
+            return _download_in_background(cls(audio=audio, **kwargs), audio, url)
+        audio = Audio(value=_download_bytes(url), format=format, autoplay=False, controls=False)
         return cls(audio=audio, **kwargs)
 
+    def close(self):
+        if self._memory_mapped_source is not None:
+            self._memory_mapped_source.close()
+        super(AudioStream, self).close()
+
+
+@register
+class ArrayStream(MediaStream):
+    """Represents a media stream of frames pushed from the kernel as NumPy arrays.
+
+    The frames are painted on a canvas in the frontend, so the stream can be recorded or
+    shared like any other stream.
+
+    >>> stream = ArrayStream()
+    >>> stream.push(np.zeros((720, 1280, 3), dtype=np.uint8))
+
+    Only the rectangle that contains changed pixels is sent (see delta), and a frame
+    without changes is not sent at all. A frontend that attaches later (e.g. after a page
+    reload) asks for the last frame as a whole.
+    """
+
+    _model_name = Unicode("ArrayStreamModel").tag(sync=True)
+
+    delta = Bool(
+        True,
+        help="(boolean) Only send the rectangle of pixels that changed compared to the previous frame.",
+    )
+    full_frame_interval = Int(
+        60,
+        help="(int, default 60) With delta, still send a full frame every this many pushed frames (also unchanged ones), so frontends that missed a frame recover.",
+    )
+
+    def __init__(self, **kwargs):
+        super(ArrayStream, self).__init__(**kwargs)
+        self._last_frame = None
+        self._frames_since_full = 0
+        self.on_msg(self._handle_frontend_msg)
+
+    def _handle_frontend_msg(self, widget, content, buffers):
+        if content.get("msg") == "request_frame":
+            # a new frontend has a blank canvas, so we send the last frame as a whole
+            last = self._last_frame
+            if last is not None:
+                self._frames_since_full = 0
+                self._send_frame(last, 0, 0, last.shape[1], last.shape[0])
+
+    def push(self, frame):
+        """Send a new frame to the frontend.
+
+        Parameters
+        ----------
+        frame: numpy.ndarray
+            A uint8 array of shape (height, width) for grayscale, or (height, width, channels)
+            with 3 (RGB) or 4 (RGBA) channels.
+        """
+        import numpy as np
+
+        start = time.perf_counter()
+        frame = np.asarray(frame)
+        if frame.dtype != np.uint8:
+            raise ValueError("Expected a uint8 array, not %s" % frame.dtype)
+        if frame.ndim == 2:
+            frame = frame[..., np.newaxis]
+        if frame.ndim != 3 or frame.shape[2] not in (1, 3, 4):
+            raise ValueError("Expected a (height, width[, 1|3|4]) array, not %r" % (frame.shape,))
+        height, width = frame.shape[:2]
+        x0, y0, x1, y1 = 0, 0, width, height
+        last = self._last_frame
+        full = (
+            not self.delta
+            or last is None
+            or last.shape != frame.shape
+            or self._frames_since_full >= self.full_frame_interval
+        )
+        if not full:
+            # also unchanged frames count, so static content still gets full frames
+            self._frames_since_full += 1
+            changed = np.any(frame != last, axis=2)
+            rows = np.flatnonzero(changed.any(axis=1))
+            if len(rows) == 0:
+                return
+            columns = np.flatnonzero(changed.any(axis=0))
+            x0, y0, x1, y1 = columns[0], rows[0], columns[-1] + 1, rows[-1] + 1
+        else:
+            self._frames_since_full = 0
+        # we keep a copy, since the caller may modify the array in place
+        self._last_frame = frame.copy()
+        size = self._send_frame(frame, x0, y0, x1, y1)
+        if self.metrics:
+            self._metrics.record(
+                "kernel_push",
+                duration=(time.perf_counter() - start) * 1000,
+                bytes=size,
+                time=ipywebrtc.metrics.now(),
+            )
+
+    def _send_frame(self, frame, x0, y0, x1, y1):
+        # sends the rectangle (x0, y0) - (x1, y1) of frame, returns its size in bytes
+        import numpy as np
+
+        height, width = frame.shape[:2]
+        msg = {
+            "msg": "frame",
+            "frame_width": int(width),
+            "frame_height": int(height),
+            "x": int(x0),
+            "y": int(y0),
+            "width": int(x1 - x0),
+            "height": int(y1 - y0),
+            "channels": int(frame.shape[2]),
+        }
+        data = np.ascontiguousarray(frame[y0:y1, x0:x1])
+        self.send(msg, [data])
+        return data.nbytes
+
 
 @register
 class CameraStream(MediaStream):
@@ -330,7 +809,53 @@ class CameraStream(MediaStream):
         return CameraStream(constraints=constraints, **kwargs)
 
 
-class Recorder(DOMWidget):
+# Settings for recording video and audio, the sizes and frame rate are upper limits, None means
+# no limit. The keyframe interval (in milliseconds) is only supported by some browsers.
+ENCODING_PROFILES = {
+    "default": {
+        "video_bitrate": 2500000,
+        "audio_bitrate": 128000,
+        "keyframe_interval": None,
+        "max_width": None,
+        "max_height": None,
+        "max_fps": None,
+    },
+    "low": {
+        "video_bitrate": 500000,
+        "audio_bitrate": 64000,
+        "keyframe_interval": 5000,
+        "max_width": 640,
+        "max_height": 360,
+        "max_fps": 15,
+    },
+    "medium": {
+        "video_bitrate": 1500000,
+        "audio_bitrate": 96000,
+        "keyframe_interval": 3000,
+        "max_width": 1280,
+        "max_height": 720,
+        "max_fps": 24,
+    },
+    "high": {
+        "video_bitrate": 5000000,
+        "audio_bitrate": 192000,
+        "keyframe_interval": 2000,
+        "max_width": 1920,
+        "max_height": 1080,
+        "max_fps": 30,
+    },
+    "screen": {
+        "video_bitrate": 1000000,
+        "audio_bitrate": 64000,
+        "keyframe_interval": 10000,
+        "max_width": 1920,
+        "max_height": 1080,
+        "max_fps": 10,
+    },
+}
+
+
+class Recorder(_HasMetrics, DOMWidget):
     _model_module = Unicode("jupyter-webrtc").tag(sync=True)
     _view_module = Unicode("jupyter-webrtc").tag(sync=True)
     _view_module_version = Unicode(semver_range_frontend).tag(sync=True)
@@ -355,20 +880,401 @@ class Recorder(DOMWidget):
     ).tag(sync=True)
     _data_src = Unicode("").tag(sync=True)
 
+    def __init__(self, **kwargs):
+        super(Recorder, self).__init__(**kwargs)
+        self._data_futures = []
+        self.on_msg(self._receive_custom_msg)
+
+    def _receive_custom_msg(self, widget, content, buffers):
+        if not self.metrics or not buffers:
+            self._handle_frontend_msg(widget, content, buffers)
+            return
+        # measure the time the kernel spends on (and the size of) the data
+        arrival = ipywebrtc.metrics.now()
+        start = time.perf_counter()
+        self._handle_frontend_msg(widget, content, buffers)
+        duration = (time.perf_counter() - start) * 1000
+        seq = content.get("index")
+        capture_time = content.get("time")
+        size = sum(memoryview(buffer).nbytes for buffer in buffers)
+        self._metrics.record(
+            "kernel_" + content.get("msg", "unknown"),
+            duration=duration,
+            bytes=size,
+            seq=seq,
+            time=capture_time,
+        )
+        if capture_time is not None:
+            self._metrics.record(
+                "transfer", duration=arrival - capture_time, bytes=size, seq=seq, time=capture_time
+            )
+
+    # not named _handle_custom_msg, since that would override Widget._handle_custom_msg
+    def _handle_frontend_msg(self, widget, content, buffers):
+        # the subclasses handle their messages, the metrics are handled by _handle_metrics_msg
+        pass
+
+    def _data_future(self):
+        # a future that resolves when the frontend delivered the data, should be
+        # created before we trigger the frontend
+        future = asyncio.get_running_loop().create_future()
+        self._data_futures.append(future)
+        return future
+
+    async def _wait_for_data(self, future, timeout):
+        try:
+            await asyncio.wait_for(future, timeout)
+        finally:
+            if future in self._data_futures:
+                self._data_futures.remove(future)
+
+    def _data_received(self):
+        futures, self._data_futures = self._data_futures, []
+        for future in futures:
+            if not future.done():
+                future.set_result(None)
+
     def download(self):
         """Download the recording (usually a popup appears in the browser)"""
         self.send({"msg": "download"})
 
 
+class MediaRecorder(Recorder):
+    """Base class of the recorders that encode using the MediaRecorder of the browser,
+    :class:`VideoRecorder` and :class:`AudioRecorder`.
+
+    Besides sending the recording when it stops, the recording can be streamed to the kernel
+    (see timeslice), or only the last part of it kept (see replay_duration and :meth:`dump`).
+    """
+
+    timeslice = Int(
+        None,
+        allow_none=True,
+        help="(int, default None) When set, the recording is streamed to the kernel in chunks of (about) this many milliseconds, which are appended to the spool file, instead of being sent as a whole when recording stops.",
+    ).tag(sync=True)
+    replay_duration = Float(
+        None,
+        allow_none=True,
+        help="(float, default None) When set, a recording only keeps the last (at least) this many seconds in the browser, starting at a keyframe, so memory use does not grow with the length of the recording. See dump(), when the recording stops, this window is the recording. The timeslice attribute is ignored.",
+    ).tag(sync=True)
+    spool_filename = Unicode(
+        None,
+        allow_none=True,
+        help="The file streamed chunks are written to (see timeslice), overwritten by each recording. When None, each recording gets its own temporary file, these are removed when the recorder is closed.",
+    )
+    seekable = Bool(
+        True,
+        help="(boolean) When True, WebM recordings are saved with a duration and an index of the clusters (see ipywebrtc.webm), so players can seek in them.",
+    )
+    profile = Union(
+        [Unicode(), Dict()],
+        default_value="default",
+        help="The encoding profile for video and audio recordings, a name from ENCODING_PROFILES, or a dict with (some of) the same keys, the rest is taken from the default profile.",
+    )
+    adaptive = Bool(
+        False,
+        help="(boolean) When True, and the recording is streamed (see timeslice), the frame rate and resolution are lowered when the chunks arrive slower than they are produced, and the next recording uses a bitrate that fits the measured throughput.",
+    ).tag(sync=True)
+    bitrate = Int(
+        None,
+        allow_none=True,
+        read_only=True,
+        help="The video bitrate (bits per second) of the current or last recording.",
+    ).tag(sync=True)
+    throughput = Float(
+        None,
+        allow_none=True,
+        read_only=True,
+        help="The measured rate (bytes per second) at which streamed chunks arrive in the kernel, only in adaptive mode.",
+    ).tag(sync=True)
+    _encoding = Dict().tag(sync=True)
+
+    def __init__(self, **kwargs):
+        super(MediaRecorder, self).__init__(**kwargs)
+        self._spool = None
+        self._spool_path = None  # the file of the current or last streamed recording
+        self._spooled = False
+        # the temporary spool files we created, removed on close, or at exit
+        self._temporary_spools = []
+        self._remove_spools = weakref.finalize(self, _remove_files, self._temporary_spools)
+        self._dump_futures = {}
+        self._dump_counter = 0
+
+    def close(self):
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        self._spooled = False
+        self._remove_spools()
+        super(MediaRecorder, self).close()
+
+    @validate("timeslice")
+    def _valid_timeslice(self, proposal):
+        if proposal["value"] is not None and proposal["value"] <= 0:
+            raise TraitError("timeslice attribute must be a positive integer")
+        return proposal["value"]
+
+    @validate("replay_duration")
+    def _valid_replay_duration(self, proposal):
+        if proposal["value"] is not None and proposal["value"] <= 0:
+            raise TraitError("replay_duration attribute must be positive")
+        return proposal["value"]
+
+    @validate("profile")
+    def _valid_profile(self, proposal):
+        profile = proposal["value"]
+        if isinstance(profile, str):
+            if profile not in ENCODING_PROFILES:
+                raise TraitError(
+                    "profile should be one of %r, not %r" % (sorted(ENCODING_PROFILES), profile)
+                )
+        else:
+            unknown = set(profile) - set(ENCODING_PROFILES["default"])
+            if unknown:
+                raise TraitError("unknown profile settings: %r" % sorted(unknown))
+        return profile
+
+    @traitlets.default("_encoding")
+    def _default_encoding(self):
+        return self._resolve_profile(self.profile)
+
+    @observe("profile")
+    def _update_encoding(self, change):
+        self._encoding = self._resolve_profile(change.new)
+
+    def _resolve_profile(self, profile):
+        if isinstance(profile, str):
+            profile = ENCODING_PROFILES[profile]
+        return dict(ENCODING_PROFILES["default"], **profile)
+
+    def _handle_frontend_msg(self, widget, content, buffers):
+        msg = content.get("msg")
+        if msg == "chunk":
+            self._spool_chunk(content, buffers)
+        elif msg == "chunk_end":
+            self._spool_end(content)
+        elif msg == "replay":
+            self._receive_dump(content, buffers)
+        else:
+            super(MediaRecorder, self)._handle_frontend_msg(widget, content, buffers)
+
+    def _spool_chunk(self, content, buffers):
+        if content["index"] == 0:
+            if self._spool is not None:
+                self._spool.close()
+            if self.spool_filename is None:
+                # a new file per recording, so what record() returned earlier stays valid
+                fd, self._spool_path = tempfile.mkstemp(
+                    prefix=os.path.basename(self.filename) + "-", suffix="." + self.format
+                )
+                os.close(fd)
+                self._temporary_spools.append(self._spool_path)
+            else:
+                self._spool_path = self.spool_filename
+            self._spool = open(self._spool_path, "wb")
+            self._spooled = False
+        if self._spool is None:
+            logger.error("received chunk %d without the start of a recording", content["index"])
+            return
+        size = 0
+        for buffer in buffers:
+            self._spool.write(buffer)
+            size += memoryview(buffer).nbytes
+        if self.adaptive:
+            # the frontend measures the throughput from the acknowledgements
+            self.send({"msg": "chunk_ack", "index": content["index"], "size": size})
+
+    def _spool_end(self, content):
+        if self._spool is None:
+            return
+        self._spool.close()
+        self._spool = None
+        self._spooled = True
+        try:
+            if self.autosave:
+                self.save()
+        finally:
+            # record() should not wait forever when saving failed
+            self._data_received()
+
+    def _save_spool(self, filename):
+        # returns True when the last recording was streamed, and is saved from the spool file
+        if not self._spooled:
+            return False
+        self._save_media(filename, self._spool_path)
+        return True
+
+    def _save_media(self, filename, source):
+        # source is the name of the spool file, or the bytes of the recording
+        if self.seekable and self.format == "webm":
+            try:
+                ipywebrtc.webm.make_seekable(
+                    source if isinstance(source, str) else io.BytesIO(source), filename
+                )
+                return
+            except ValueError as e:
+                logger.warning("could not make %s seekable, saving it as recorded: %s", filename, e)
+        if not isinstance(source, str):
+            with open(filename, "wb") as f:
+                f.write(source)
+        elif os.path.abspath(filename) != os.path.abspath(source):
+            shutil.copyfile(source, filename)
+
+    async def _record(self, duration, timeout):
+        future = self._data_future()
+        try:
+            self.recording = True
+            try:
+                await asyncio.sleep(duration)
+            finally:
+                # also stop when we get cancelled
+                self.recording = False
+        except BaseException:
+            self._data_futures.remove(future)
+            raise
+        await self._wait_for_data(future, timeout)
+
+    def _receive_dump(self, content, buffers):
+        future = self._dump_futures.pop(content["id"], None)
+        if future is None or future.done():
+            return
+        if "error" in content:
+            future.set_exception(RuntimeError(content["error"]))
+        else:
+            future.set_result(bytes(buffers[0]))
+
+    async def dump(self, filename=None, timeout=None):
+        """Return the last replay_duration seconds of the running recording, as a playable file.
+
+        The recording continues, so this can be called again later (e.g. each time something
+        interesting happens):
+
+        >>> recorder = VideoRecorder(stream=camera, replay_duration=30)
+        >>> recorder.recording = True
+        >>> ...
+        >>> await recorder.dump("incident")  # saves the last 30 seconds to incident.webm
+
+        Note that the frontend cannot send us data while a cell is executing, so
+        instead of awaiting this in the notebook cell itself, run it as a task,
+        e.g. using ``asyncio.ensure_future``.
+
+        Parameters
+        ----------
+        filename: str
+            When given, the data is saved to this file (with the format as extension when it
+            has none), like :meth:`save`, and the filename is returned instead of the data.
+        timeout: float
+            Raise an ``asyncio.TimeoutError`` when no data is received within this many seconds.
+        """
+        if self.replay_duration is None:
+            raise ValueError("dump() needs replay_duration to be set before recording")
+        if not self.recording:
+            raise ValueError("Not recording")
+        self._dump_counter += 1
+        dump_id = self._dump_counter
+        future = asyncio.get_running_loop().create_future()
+        self._dump_futures[dump_id] = future
+        self.send({"msg": "replay_dump", "id": dump_id})
+        try:
+            data = await asyncio.wait_for(future, timeout)
+        finally:
+            self._dump_futures.pop(dump_id, None)
+        if filename is None:
+            return data
+        if "." not in filename:
+            filename += "." + self.format
+        self._save_media(filename, data)
+        return filename
+
+
 @register
 class ImageRecorder(Recorder):
-    """Creates a recorder which allows to grab an Image from a MediaStream widget."""
+    """Creates a recorder which allows to grab an Image from a MediaStream widget.
+
+    The images can be cropped, scaled down, converted to gray and compressed in the browser,
+    before they are encoded and sent to the kernel:
+
+    >>> recorder = ImageRecorder(stream=camera, format="jpeg", quality=0.8, max_width=224, max_height=224)
+    """
 
     _model_name = Unicode("ImageRecorderModel").tag(sync=True)
     _view_name = Unicode("ImageRecorderView").tag(sync=True)
 
     image = Instance(Image).tag(sync=True, **widget_serialization)
     format = Unicode("png", help="The format of the image.").tag(sync=True)
+    max_width = Int(
+        None,
+        allow_none=True,
+        help="(int, default None) When set, images are scaled down (keeping the aspect ratio) to at most this width before they are encoded.",
+    ).tag(sync=True)
+    max_height = Int(
+        None,
+        allow_none=True,
+        help="(int, default None) When set, images are scaled down (keeping the aspect ratio) to at most this height before they are encoded.",
+    ).tag(sync=True)
+    crop = List(
+        Float(),
+        None,
+        allow_none=True,
+        help="(list, default None) The region [x, y, width, height] of the frame that is encoded, as fractions of the frame width and height, e.g. [0.25, 0.25, 0.5, 0.5] for the center, None for the whole frame.",
+    ).tag(sync=True)
+    grayscale = Bool(
+        False,
+        help="(boolean) When True, images are converted to gray before they are encoded.",
+    ).tag(sync=True)
+    quality = Float(
+        None,
+        allow_none=True,
+        help="(float, default None) The quality, between 0 and 1, of jpeg and webp images, None for the default of the browser. Not used for png.",
+    ).tag(sync=True)
+    raw_frames = Bool(
+        False,
+        help="(boolean) When True, raw (unencoded) frames are continuously captured at raw_fps, and put in the frame trait.",
+    ).tag(sync=True)
+    raw_fps = Float(
+        10.0, help="(float, default 10) The frame rate at which raw frames are captured."
+    ).tag(sync=True)
+    raw_format = Enum(
+        ["rgba", "gray"],
+        "rgba",
+        help='The pixel format of the raw frames, "rgba" (4 channels) or "gray" (1 channel).',
+    ).tag(sync=True)
+    raw_scale = Float(
+        1.0,
+        help="(float, default 1) Scaling of the raw frames relative to the stream size, e.g. 0.5 for half the width and height.",
+    ).tag(sync=True)
+    frame = Any(
+        None,
+        help="The last raw frame, as a read-only uint8 NumPy array with shape (height, width, channels), see raw_frames.",
+    )
+    frame_time = Float(
+        None,
+        allow_none=True,
+        help="Capture time of the frame trait, in milliseconds since the epoch.",
+    )
+    motion = Bool(
+        False,
+        help="(boolean) When True, frames are captured at motion_fps, and compared (downsampled, in gray) with the last frame that was sent. Only when they differ more than motion_threshold, the frame is encoded (with crop, max_width, max_height, grayscale and quality) and put in the image, see on_motion.",
+    ).tag(sync=True)
+    motion_fps = Float(
+        2.0, help="(float, default 2) The frame rate at which frames are compared."
+    ).tag(sync=True)
+    motion_threshold = Float(
+        0.01,
+        help="(float, default 0.01) The fraction of the pixels that must have changed for a frame to be sent, see motion_score.",
+    ).tag(sync=True)
+    motion_roi = List(
+        Float(),
+        None,
+        allow_none=True,
+        help="(list, default None) The region of interest [x, y, width, height] that is compared, as fractions of the frame width and height, e.g. [0.5, 0, 0.5, 1] for the right half, None for the whole frame.",
+    ).tag(sync=True)
+    motion_score = Float(
+        None,
+        allow_none=True,
+        read_only=True,
+        help="The last change score, the fraction of the pixels (in the region of interest) that changed, compared with the last frame that was sent. Updated with each sent frame, and without changes at most once per second.",
+    )
     _width = Unicode().tag(sync=True)
     _height = Unicode().tag(sync=True)
 
@@ -387,6 +1293,9 @@ class ImageRecorder(Recorder):
             autosave=autosave,
             **kwargs,
         )
+        self._burst_futures = {}
+        self._burst_counter = 0
+        self._motion_callbacks = CallbackDispatcher()
         if "image" not in kwargs:
             # Set up initial observer on child:
             self.image.observe(self._check_autosave, "value")
@@ -395,6 +1304,175 @@ class ImageRecorder(Recorder):
     def _default_image(self):
         return Image(width=self._width, height=self._height, format=self.format)
 
+    @validate("raw_fps", "raw_scale", "motion_fps")
+    def _valid_positive(self, proposal):
+        if proposal["value"] <= 0:
+            raise TraitError("%s attribute must be positive" % proposal["trait"].name)
+        return proposal["value"]
+
+    @validate("max_width", "max_height")
+    def _valid_max_size(self, proposal):
+        if proposal["value"] is not None and proposal["value"] <= 0:
+            raise TraitError("%s attribute must be a positive integer" % proposal["trait"].name)
+        return proposal["value"]
+
+    @validate("quality")
+    def _valid_quality(self, proposal):
+        if proposal["value"] is not None and not 0 <= proposal["value"] <= 1:
+            raise TraitError("quality attribute must be between 0 and 1")
+        return proposal["value"]
+
+    @validate("motion_threshold")
+    def _valid_motion_threshold(self, proposal):
+        if not 0 <= proposal["value"] < 1:
+            raise TraitError("motion_threshold attribute must be between 0 and 1")
+        return proposal["value"]
+
+    @validate("crop", "motion_roi")
+    def _valid_region(self, proposal):
+        region = proposal["value"]
+        name = proposal["trait"].name
+        if region is None:
+            return region
+        if len(region) != 4:
+            raise TraitError("%s attribute must be a list [x, y, width, height]" % name)
+        x, y, width, height = region
+        if min(x, y) < 0 or min(width, height) <= 0 or x + width > 1 or y + height > 1:
+            raise TraitError("%s attribute must be a region within [0, 0, 1, 1]" % name)
+        return region
+
+    def _handle_frontend_msg(self, widget, content, buffers):
+        if content.get("msg") == "frame":
+            self._receive_frame(content, buffers)
+        elif content.get("msg") == "burst":
+            self._receive_burst(content, buffers)
+        elif content.get("msg") == "motion":
+            self._receive_motion(content)
+        else:
+            super(ImageRecorder, self)._handle_frontend_msg(widget, content, buffers)
+
+    def _receive_motion(self, content):
+        self.set_trait("motion_score", content["score"])
+        if content["changed"]:
+            # the frontend updated the image before it sent this message
+            self._motion_callbacks(self, self.image.value, content["score"], content["time"])
+
+    def on_motion(self, callback, remove=False):
+        """Register a callback for frames sent because they changed, see motion.
+
+        The callback is called with the recorder, the image (encoded in format), the change
+        score (see motion_score) and the capture time in milliseconds since the epoch.
+
+        >>> recorder = ImageRecorder(stream=camera, motion_roi=[0.5, 0, 0.5, 1])
+        >>> recorder.on_motion(lambda recorder, image, score, time: recorder.save("motion-%d" % time))
+        >>> recorder.motion = True
+
+        :param callback: The callable to register.
+        :param bool remove: Unregister the callback instead.
+        """
+        self._motion_callbacks.register_callback(callback, remove=remove)
+
+    def _receive_frame(self, content, buffers):
+        import numpy as np
+
+        # frombuffer does not copy, the array is a view on the message buffer
+        shape = (content["height"], content["width"], content["channels"])
+        frame = np.frombuffer(buffers[0], dtype=np.uint8).reshape(shape)
+        with self.hold_trait_notifications():
+            self.frame_time = content["time"]
+            self.frame = frame
+
+    def _receive_burst(self, content, buffers):
+        future = self._burst_futures.pop(content["id"], None)
+        if future is None or future.done():
+            return
+        if "error" in content:
+            future.set_exception(RuntimeError(content["error"]))
+        elif content["raw"]:
+            import numpy as np
+
+            shape = (content["count"], content["height"], content["width"], content["channels"])
+            size = memoryview(buffers[0]).nbytes
+            if size != np.prod(shape):
+                # we should not raise here, that would leave burst() waiting
+                future.set_exception(
+                    ValueError("received %d bytes for a burst of shape %r" % (size, shape))
+                )
+                return
+            frames = np.frombuffer(buffers[0], dtype=np.uint8).reshape(shape)
+            future.set_result((frames, content["times"]))
+        else:
+            data = memoryview(buffers[0]).cast("B")
+            if data.nbytes != sum(content["sizes"]):
+                future.set_exception(
+                    ValueError(
+                        "received %d bytes for images of %d bytes"
+                        % (data.nbytes, sum(content["sizes"]))
+                    )
+                )
+                return
+            frames = []
+            offset = 0
+            for size in content["sizes"]:
+                frames.append(bytes(data[offset : offset + size]))
+                offset += size
+            future.set_result((frames, content["times"]))
+
+    async def burst(self, count, interval=0.1, raw=False, timeout=None):
+        """Capture a burst of frames, and return them once all are received from the frontend.
+
+        The frames are captured in the browser, and sent together in one message, which is much
+        faster than taking separate snapshots.
+
+        >>> recorder = ImageRecorder(stream=camera)
+        >>> frames, times = await recorder.burst(20, interval=0.05, raw=True)
+        >>> frames.shape
+        (20, 480, 640, 4)
+
+        Note that the frontend cannot send us data while a cell is executing, so
+        instead of awaiting this in the notebook cell itself, run it as a task,
+        e.g. using ``asyncio.ensure_future``.
+
+        Parameters
+        ----------
+        count: int
+            Number of frames to capture.
+        interval: float
+            Time between the frames in seconds.
+        raw: bool
+            If True, return the frames as a uint8 NumPy array of shape (count, height, width,
+            channels), using raw_format and raw_scale. Otherwise return a list of images
+            encoded in the format of the recorder (with crop, max_width, max_height, grayscale
+            and quality).
+        timeout: float
+            Raise an ``asyncio.TimeoutError`` when no data is received within this many seconds.
+
+        Returns
+        -------
+        A tuple (frames, times), with times the capture times in milliseconds since the epoch.
+        """
+        if count < 1:
+            raise ValueError("count must be at least 1, not %r" % count)
+        if self.stream is None:
+            raise ValueError("No stream specified")
+        self._burst_counter += 1
+        burst_id = self._burst_counter
+        future = asyncio.get_running_loop().create_future()
+        self._burst_futures[burst_id] = future
+        self.send(
+            {
+                "msg": "burst",
+                "id": burst_id,
+                "count": count,
+                "interval": interval * 1000,
+                "raw": raw,
+            }
+        )
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._burst_futures.pop(burst_id, None)
+
     @observe("_width")
     def _update_image_width(self, change):
         self.image.width = self._width
@@ -413,10 +1491,38 @@ class ImageRecorder(Recorder):
             change.old.unobserve(self._check_autosave, "value")
         change.new.observe(self._check_autosave, "value")
 
+    @observe("recording")
+    def _check_snapshot(self, change):
+        # the frontend puts recording to False after it has set the image value
+        if change.old and not change.new:
+            self._data_received()
+
     def _check_autosave(self, change):
         if len(self.image.value) and self.autosave:
             self.save()
 
+    async def snapshot(self, timeout=None):
+        """Take a snapshot, and return the image data once it is received from the frontend.
+
+        If a snapshot is already being taken, this waits for that one.
+
+        >>> recorder = ImageRecorder(stream=camera)
+        >>> data = await recorder.snapshot(timeout=5)
+
+        Note that the frontend cannot send us data while a cell is executing, so
+        instead of awaiting this in the notebook cell itself, run it as a task,
+        e.g. using ``asyncio.ensure_future``.
+
+        Parameters
+        ----------
+        timeout: float
+            Raise an ``asyncio.TimeoutError`` when no data is received within this many seconds.
+        """
+        future = self._data_future()
+        self.recording = True
+        await self._wait_for_data(future, timeout)
+        return self.image.value
+
     def save(self, filename=None):
         """Save the image to a file, if no filename is given it is based on the filename trait and the format.
 
@@ -437,7 +1543,7 @@ class ImageRecorder(Recorder):
 
 
 @register
-class VideoRecorder(Recorder):
+class VideoRecorder(MediaRecorder):
     """Creates a recorder which allows to record a MediaStream widget, play the
     record in the Notebook, and download it or turn it into a Video widget.
 
@@ -487,8 +1593,39 @@ class VideoRecorder(Recorder):
         change.new.observe(self._check_autosave, "value")
 
     def _check_autosave(self, change):
-        if len(self.video.value) and self.autosave:
-            self.save()
+        if len(self.video.value):
+            self._spooled = False
+            if self.autosave:
+                self.save()
+            self._data_received()
+
+    async def record(self, duration, timeout=None):
+        """Record for a number of seconds, and return the video data once it is received from the frontend.
+
+        When the recording is streamed (see timeslice), the name of the spool file is returned instead,
+        a temporary file (see spool_filename) is removed when the recorder is closed.
+
+        >>> recorder = VideoRecorder(stream=camera)
+        >>> data = await recorder.record(10, timeout=5)
+
+        Note that the frontend cannot send us data while a cell is executing, so
+        instead of awaiting this in the notebook cell itself, run it as a task,
+        e.g. using ``asyncio.ensure_future``.
+
+        Parameters
+        ----------
+        duration: float
+            The duration of the recording in seconds.
+        timeout: float
+            Raise an ``asyncio.TimeoutError`` when no data is received within this many seconds after
+            the recording stopped.
+        """
+        await self._record(duration, timeout)
+        return self._recorded()
+
+    def _recorded(self):
+        # the last recording, the spool file when it was streamed
+        return self._spool_path if self._spooled else self.video.value
 
     def save(self, filename=None):
         """Save the video to a file, if no filename is given it is based on the filename trait and the format.
@@ -503,19 +1640,27 @@ class VideoRecorder(Recorder):
         filename = filename or self.filename
         if "." not in filename:
             filename += "." + self.format
+        if self._save_spool(filename):
+            return
         if len(self.video.value) == 0:
             raise ValueError("No data, did you record anything?")
-        with open(filename, "wb") as f:
-            f.write(self.video.value)
+        self._save_media(filename, self.video.value)
 
 
 @register
-class AudioRecorder(Recorder):
+class AudioRecorder(MediaRecorder):
     """Creates a recorder which allows to record the Audio of a MediaStream widget, play the
     record in the Notebook, and download it or turn it into an Audio widget.
 
     For help on supported values for the "codecs" attribute, see
     https://stackoverflow.com/questions/41739837/all-mime-types-supported-by-mediarecorder-in-firefox-and-chrome
+
+    Besides encoded recordings, raw PCM samples can be streamed while capturing (see pcm), e.g.
+    for speech recognition, without waiting for a recording to finish and decoding it:
+
+    >>> recorder = AudioRecorder(stream=camera, pcm=True, pcm_sample_rate=16000, pcm_buffer_duration=30)
+    >>> recorder.observe(lambda change: asr.feed(change.new), "samples")
+    >>> samples, time = recorder.pcm_buffer.read()  # the last 30 seconds
     """
 
     _model_name = Unicode("AudioRecorderModel").tag(sync=True)
@@ -523,6 +1668,45 @@ class AudioRecorder(Recorder):
 
     audio = Instance(Audio).tag(sync=True, **widget_serialization)
     codecs = Unicode("", help='Optional codecs for the recording, e.g. "opus".').tag(sync=True)
+    pcm = Bool(
+        False,
+        help="(boolean) When True, raw PCM samples are continuously captured, and streamed to the kernel in chunks, see samples.",
+    ).tag(sync=True)
+    pcm_sample_rate = Int(
+        16000,
+        help="(int, default 16000) The sample rate of the PCM samples, the audio is low-pass filtered and resampled in the browser.",
+    ).tag(sync=True)
+    pcm_dtype = Enum(
+        ["float32", "int16"],
+        "float32",
+        help='The sample format, "float32" (between -1 and 1) or "int16".',
+    ).tag(sync=True)
+    pcm_channels = Int(
+        1, help="(int, default 1) 1 mixes all channels to mono, 2 keeps (or makes) stereo."
+    ).tag(sync=True)
+    pcm_chunk_duration = Float(
+        0.1,
+        help="(float, default 0.1) Seconds of audio per chunk, shorter chunks lower the latency, but mean more messages.",
+    ).tag(sync=True)
+    pcm_buffer_duration = Float(
+        None,
+        allow_none=True,
+        help="(float, default None) When set, the last this many seconds of samples are kept in pcm_buffer (a SampleBuffer).",
+    )
+    samples = Any(
+        None,
+        help="The last chunk of PCM samples, as a read-only NumPy array with shape (frames, pcm_channels), see pcm.",
+    )
+    samples_time = Float(
+        None,
+        allow_none=True,
+        help="Capture time of the first sample in samples, in milliseconds since the epoch.",
+    )
+    samples_offset = Int(
+        None,
+        allow_none=True,
+        help="Index of the first sample in samples, counted from the start of the capture.",
+    )
 
     def __init__(
         self,
@@ -542,11 +1726,65 @@ class AudioRecorder(Recorder):
         if "audio" not in kwargs:
             # Set up initial observer on child:
             self.audio.observe(self._check_autosave, "value")
+        self.pcm_buffer = None
+        self._update_pcm_buffer()
 
     @traitlets.default("audio")
     def _default_audio(self):
         return Audio(format=self.format, controls=True)
 
+    @validate("pcm_sample_rate", "pcm_chunk_duration")
+    def _valid_positive(self, proposal):
+        if proposal["value"] <= 0:
+            raise TraitError("%s attribute must be positive" % proposal["trait"].name)
+        return proposal["value"]
+
+    @validate("pcm_channels")
+    def _valid_pcm_channels(self, proposal):
+        if proposal["value"] not in (1, 2):
+            raise TraitError("pcm_channels attribute must be 1 or 2")
+        return proposal["value"]
+
+    @observe("pcm_buffer_duration", "pcm_sample_rate", "pcm_channels", "pcm_dtype")
+    def _update_pcm_buffer(self, change=None):
+        # during construction the buffer does not exist yet
+        if not hasattr(self, "pcm_buffer"):
+            return
+        if self.pcm_buffer_duration is None:
+            self.pcm_buffer = None
+        else:
+            self.pcm_buffer = ipywebrtc.ringbuffer.SampleBuffer(
+                max(1, int(self.pcm_buffer_duration * self.pcm_sample_rate)),
+                channels=self.pcm_channels,
+                dtype=self.pcm_dtype,
+                sample_rate=self.pcm_sample_rate,
+            )
+
+    def _handle_frontend_msg(self, widget, content, buffers):
+        if content.get("msg") == "pcm":
+            self._receive_pcm(content, buffers)
+        else:
+            super(AudioRecorder, self)._handle_frontend_msg(widget, content, buffers)
+
+    def _receive_pcm(self, content, buffers):
+        import numpy as np
+
+        # the browser sends little endian samples, frombuffer does not copy
+        dtype = {"float32": "<f4", "int16": "<i2"}[content["dtype"]]
+        samples = np.frombuffer(buffers[0], dtype=dtype).reshape(-1, content["channels"])
+        # chunks sent before the settings changed do not fit in the buffer
+        settings = (content["sample_rate"], content["channels"], content["dtype"])
+        if self.pcm_buffer is not None and settings == (
+            self.pcm_sample_rate,
+            self.pcm_channels,
+            self.pcm_dtype,
+        ):
+            self.pcm_buffer.append(samples, content["time"])
+        with self.hold_trait_notifications():
+            self.samples_time = content["time"]
+            self.samples_offset = content["offset"]
+            self.samples = samples
+
     @observe("format")
     def _update_audio_format(self, change):
         self.audio.format = self.format
@@ -558,8 +1796,39 @@ class AudioRecorder(Recorder):
         change.new.observe(self._check_autosave, "value")
 
     def _check_autosave(self, change):
-        if len(self.audio.value) and self.autosave:
-            self.save()
+        if len(self.audio.value):
+            self._spooled = False
+            if self.autosave:
+                self.save()
+            self._data_received()
+
+    async def record(self, duration, timeout=None):
+        """Record for a number of seconds, and return the audio data once it is received from the frontend.
+
+        When the recording is streamed (see timeslice), the name of the spool file is returned instead,
+        a temporary file (see spool_filename) is removed when the recorder is closed.
+
+        >>> recorder = AudioRecorder(stream=camera)
+        >>> data = await recorder.record(10, timeout=5)
+
+        Note that the frontend cannot send us data while a cell is executing, so
+        instead of awaiting this in the notebook cell itself, run it as a task,
+        e.g. using ``asyncio.ensure_future``.
+
+        Parameters
+        ----------
+        duration: float
+            The duration of the recording in seconds.
+        timeout: float
+            Raise an ``asyncio.TimeoutError`` when no data is received within this many seconds after
+            the recording stopped.
+        """
+        await self._record(duration, timeout)
+        return self._recorded()
+
+    def _recorded(self):
+        # the last recording, the spool file when it was streamed
+        return self._spool_path if self._spooled else self.audio.value
 
     def save(self, filename=None):
         """Save the audio to a file, if no filename is given it is based on the filename trait and the format.
@@ -574,15 +1843,209 @@ class AudioRecorder(Recorder):
         filename = filename or self.filename
         if "." not in filename:
             filename += "." + self.format
+        if self._save_spool(filename):
+            return
         if len(self.audio.value) == 0:
             raise ValueError("No data, did you record anything?")
-        with open(filename, "wb") as f:
-            f.write(self.audio.value)
+        self._save_media(filename, self.audio.value)
+
+
+@register
+class RecorderGroup(DOMWidget):
+    """Starts and stops a number of recorders together, so their recordings can be aligned.
+
+    The frontend starts (and stops) all recorders at once, on a single message, and measures on
+    one clock when each of them actually started:
+
+    >>> group = RecorderGroup(recorders=[VideoRecorder(stream=camera1), VideoRecorder(stream=camera2)])
+    >>> recordings = await group.record(10)
+    >>> recordings[1]["offset"]  # the second recording started this many seconds after the group
+    >>> recordings[1]["frame_times"]  # when its frames were recorded, in seconds after the group started
+    """
+
+    _model_module = Unicode("jupyter-webrtc").tag(sync=True)
+    _view_module = Unicode("jupyter-webrtc").tag(sync=True)
+    _model_name = Unicode("RecorderGroupModel").tag(sync=True)
+    _view_module_version = Unicode(semver_range_frontend).tag(sync=True)
+    _model_module_version = Unicode(semver_range_frontend).tag(sync=True)
+
+    recorders = List(
+        Instance(Recorder),
+        [],
+        allow_none=False,
+        help="The recorders that are started and stopped together.",
+    ).tag(sync=True, **widget_serialization)
+    recording = Bool(
+        False,
+        help="(boolean) Indicator and controller of the group state, i.e. putting the value to True will start all recorders.",
+    ).tag(sync=True)
+    start_time = Float(
+        None,
+        allow_none=True,
+        read_only=True,
+        help="The time the group started recording, in seconds since the epoch, on the clock of the browser.",
+    ).tag(sync=True)
+    offsets = List(
+        read_only=True,
+        help="Per recorder, the seconds between start_time and the start of its recording, None when it did not start.",
+    ).tag(sync=True)
+    stop_offsets = List(
+        read_only=True,
+        help="Per recorder, the seconds between start_time and the end of its recording, None when it did not stop.",
+    ).tag(sync=True)
+
+    @validate("recorders")
+    def _valid_recorders(self, proposal):
+        for recorder in proposal["value"]:
+            if not isinstance(recorder, MediaRecorder):
+                raise TraitError("recorders attribute must be a list of video or audio recorders")
+        return proposal["value"]
+
+    def _offsets_future(self, name):
+        # resolves when the frontend measured the (stop) offsets of all recorders
+        future = asyncio.get_running_loop().create_future()
+        count = len(self.recorders)
+
+        def check(change):
+            if len(change.new) == count and not future.done():
+                future.set_result(change.new)
+
+        self.observe(check, name)
+        future.add_done_callback(lambda future: self.unobserve(check, name))
+        return future
+
+    async def record(self, duration, timeout=None):
+        """Record with all recorders for a number of seconds, and return the recordings once all are received.
+
+        Note that the frontend cannot send us data while a cell is executing, so
+        instead of awaiting this in the notebook cell itself, run it as a task,
+        e.g. using ``asyncio.ensure_future``.
+
+        Parameters
+        ----------
+        duration: float
+            The duration of the recording in seconds.
+        timeout: float
+            Raise an ``asyncio.TimeoutError`` when not all data and offsets are received within
+            this many seconds after the recording stopped.
+
+        :return: A list with the recording of each recorder, see :meth:`recordings`.
+        """
+        recorders = list(self.recorders)
+        futures = [recorder._data_future() for recorder in recorders]
+        started = self._offsets_future("offsets")
+        stopped = self._offsets_future("stop_offsets")
+        try:
+            self.recording = True
+            try:
+                await asyncio.sleep(duration)
+            finally:
+                # also stop when we get cancelled
+                self.recording = False
+            await asyncio.wait_for(
+                asyncio.gather(
+                    started,
+                    stopped,
+                    *(
+                        recorder._wait_for_data(future, None)
+                        for recorder, future in zip(recorders, futures)
+                    ),
+                ),
+                timeout,
+            )
+        finally:
+            started.cancel()
+            stopped.cancel()
+            for recorder, future in zip(recorders, futures):
+                if future in recorder._data_futures:
+                    recorder._data_futures.remove(future)
+        return self.recordings()
+
+    def recordings(self):
+        """Return the last recording of each recorder, with its timing relative to start_time.
+
+        Each recording is a dict with:
+
+        * recorder: the recorder.
+        * data: what :meth:`VideoRecorder.record` returns, the data, or the spool file when the
+          recording was streamed.
+        * offset, stop_offset: see :attr:`offsets` and :attr:`stop_offsets`.
+        * frame_times: the times of the video frames (or audio blocks for audio only
+          recordings), in seconds after start_time, or None when not known (only WebM
+          recordings are parsed).
+
+        :rtype: list
+        """
+        recordings = []
+        for index, recorder in enumerate(self.recorders):
+            offset = self.offsets[index] if index < len(self.offsets) else None
+            stop_offset = self.stop_offsets[index] if index < len(self.stop_offsets) else None
+            data = recorder._recorded()
+            frame_times = None
+            if offset is not None and recorder.format == "webm" and len(data):
+                try:
+                    times = ipywebrtc.webm.frame_times(
+                        data if isinstance(data, str) else io.BytesIO(data)
+                    )
+                    frame_times = [offset + time for time in times]
+                except ValueError as e:
+                    logger.warning("could not read the frame times of %s: %s", recorder.filename, e)
+            recordings.append(
+                {
+                    "recorder": recorder,
+                    "data": data,
+                    "offset": offset,
+                    "stop_offset": stop_offset,
+                    "frame_times": frame_times,
+                }
+            )
+        return recordings
+
+    def save(self, filename=None):
+        """Save all recordings, to the filename of each recorder, or to filename with the index
+        of the recorder appended, returns the filenames.
+
+        >>> group.save('take1')  # saves to take1-0.webm, take1-1.webm, ...
+        """
+        filenames = []
+        for index, recorder in enumerate(self.recorders):
+            name = recorder.filename if filename is None else "%s-%d" % (filename, index)
+            if "." not in name:
+                name += "." + recorder.format
+            recorder.save(name)
+            filenames.append(name)
+        return filenames
+
+
+# The video layers a peer can send, see WebRTCPeer.layer. The resolution is divided by
+# scale_resolution_down_by, max_bitrate (bits per second) and max_framerate are upper limits,
+# None means no limit, and a layer with active False sends no video at all.
+VIDEO_LAYERS = {
+    "full": {"scale_resolution_down_by": 1, "max_bitrate": None, "max_framerate": None},
+    "half": {"scale_resolution_down_by": 2, "max_bitrate": 600000, "max_framerate": None},
+    "quarter": {"scale_resolution_down_by": 4, "max_bitrate": 150000, "max_framerate": 15},
+    "off": {"active": False},
+}
 
 
 @register
 class WebRTCPeer(DOMWidget):
-    """A peer-to-peer webrtc connection"""
+    """A peer-to-peer webrtc connection
+
+    Besides the media tracks, the connection carries a data channel, over which bytes and NumPy
+    arrays can be sent to the other peer:
+
+    >>> peer.on_data(lambda peer, data, metadata: print(len(data), metadata))
+    >>> peer.send_data(array, {"frame": 42})
+
+    Large payloads are split into chunks (see DATA_CHUNK_SIZE) that fit in a single SCTP
+    message, and the frontend stops sending when the channel buffers too much data, so a large
+    transfer does not exhaust the browser's memory.
+
+    Every connection encodes the local video separately, so the quality can be chosen per
+    receiver, e.g. ``peer.layer = "quarter"`` for a peer on a slow link, without degrading the
+    video sent to other peers (see VIDEO_LAYERS).
+    """
 
     _model_module = Unicode("jupyter-webrtc").tag(sync=True)
     _view_module = Unicode("jupyter-webrtc").tag(sync=True)
@@ -597,10 +2060,200 @@ class WebRTCPeer(DOMWidget):
     id_remote = Unicode("").tag(sync=True)
     connected = Bool(False, read_only=True).tag(sync=True)
     failed = Bool(False, read_only=True).tag(sync=True)
+    stats_interval = Float(
+        None,
+        allow_none=True,
+        help="(float, default None) Seconds between polling the connection statistics (at least 0.5), None disables polling.",
+    ).tag(sync=True)
+    stats_history_size = Int(
+        600, help="(int, default 600) Number of statistics summaries kept in stats_history."
+    )
+    stats = Dict(
+        None,
+        allow_none=True,
+        read_only=True,
+        help="The last summary of the connection statistics (see STATS_FIELDS), updated every stats_interval seconds.",
+    )
+    data_channel_open = Bool(
+        False, read_only=True, help="(boolean) The data channel is open, see send_data."
+    ).tag(sync=True)
+    layers = Dict(
+        help="The video layers this peer can send, a dict of name to settings, see VIDEO_LAYERS."
+    ).tag(sync=True)
+    layer = Unicode(
+        None,
+        allow_none=True,
+        help="(str, default None) The layer (one of layers) sent to the other peer, None sends the video as captured, without limits.",
+    ).tag(sync=True)
+
+    # chunks sent over the data channel are at most this large (in bytes), which all browsers
+    # can send and receive, the chunking itself is done by the frontend
+    DATA_CHUNK_SIZE = 16 * 1024
+    # the window (in seconds) over which the throughput of the data channel is measured
+    DATA_THROUGHPUT_WINDOW = 5.0
+
+    # the fields of the stats summaries, besides codec (a string), rates are per second over the
+    # last interval, times are in milliseconds
+    STATS_FIELDS = (
+        "time",
+        "rtt",
+        "jitter",
+        "packets_lost",
+        "packet_loss",
+        "bitrate_in",
+        "bitrate_out",
+        "frames_decoded",
+        "frames_dropped",
+        "frames_per_second",
+    )
+
+    def __init__(self, **kwargs):
+        super(WebRTCPeer, self).__init__(**kwargs)
+        self.stats_history = ipywebrtc.ringbuffer.RingBuffer(
+            self.STATS_FIELDS, self.stats_history_size
+        )
+        self._data_callbacks = CallbackDispatcher()
+        self._data_sends = {}  # id to (future, size)
+        self._data_send_id = 0
+        self._data_totals = collections.Counter()
+        # (time, bytes) per message, for the throughput over the last DATA_THROUGHPUT_WINDOW
+        self._data_sent = collections.deque()
+        self._data_received = collections.deque()
+        self.on_msg(self._handle_frontend_msg)
+
+    @traitlets.default("layers")
+    def _default_layers(self):
+        return {name: dict(settings) for name, settings in VIDEO_LAYERS.items()}
+
+    @validate("layer")
+    def _valid_layer(self, proposal):
+        layer = proposal["value"]
+        if layer is not None and layer not in self.layers:
+            raise TraitError("layer should be one of %r, not %r" % (sorted(self.layers), layer))
+        return layer
+
+    @validate("stats_interval")
+    def _valid_stats_interval(self, proposal):
+        if proposal["value"] is not None and proposal["value"] < 0.5:
+            raise TraitError("stats_interval attribute must be at least 0.5 seconds")
+        return proposal["value"]
+
+    @observe("stats_history_size")
+    def _resize_stats_history(self, change):
+        # during construction the history does not exist yet
+        if hasattr(self, "stats_history"):
+            self.stats_history = self.stats_history.resized(change.new)
+
+    def _handle_frontend_msg(self, widget, content, buffers):
+        if content.get("msg") == "stats":
+            summary = content["stats"]
+            self.stats_history.append(summary)
+            self.set_trait("stats", summary)
+        elif content.get("msg") == "data":
+            self._receive_data(content, buffers[0] if buffers else b"")
+        elif content.get("msg") == "data_sent":
+            self._data_send_done(content)
 
     def connect(self):
         self.send({"msg": "connect"})
 
+    def send_data(self, data, metadata=None):
+        """Send bytes or a NumPy array to the other peer over the data channel.
+
+        Data sent before the channel is open is queued by the frontend, and all data arrives in
+        the order it is sent. Arrays arrive as arrays of the same dtype and shape.
+
+        :param data: A bytes-like object or a NumPy array.
+        :param dict metadata: JSON serializable data passed along to the receiving callbacks.
+        :return: A future that resolves to the number of bytes sent when the frontend handed all
+            chunks to the data channel. When called with a running event loop (in a notebook
+            cell or a coroutine) this is an asyncio future that can be awaited, otherwise (e.g.
+            in another thread) a ``concurrent.futures.Future``.
+        """
+        header = {"metadata": metadata}
+        if hasattr(data, "__array_interface__"):
+            import numpy as np
+
+            array = np.ascontiguousarray(data)
+            header["dtype"] = array.dtype.str
+            header["shape"] = list(array.shape)
+            # a byte view works for all dtypes, also those memoryview does not support
+            buffer = memoryview(array.reshape(-1).view(np.uint8))
+        else:
+            buffer = memoryview(data).cast("B")
+        self._data_send_id += 1
+        # resolved by the thread handling the comm messages, which can be another one than ours
+        future = concurrent.futures.Future()
+        self._data_sends[self._data_send_id] = (future, buffer.nbytes)
+        self.send({"msg": "data_send", "id": self._data_send_id, "header": header}, [buffer])
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return future
+        return asyncio.wrap_future(future, loop=loop)
+
+    def on_data(self, callback, remove=False):
+        """Register a callback for data received over the data channel.
+
+        The callback is called with the peer, the data (bytes, or a NumPy array when an array
+        was sent) and the metadata.
+
+        :param callback: The callable to register.
+        :param bool remove: Unregister the callback instead.
+        """
+        self._data_callbacks.register_callback(callback, remove=remove)
+
+    def data_stats(self):
+        """Return the totals and throughput (bytes per second, over the last
+        DATA_THROUGHPUT_WINDOW seconds) of the data channel, in both directions, as a dict."""
+        now = time.time()
+        stats = dict(
+            {
+                "bytes_sent": 0,
+                "messages_sent": 0,
+                "bytes_received": 0,
+                "messages_received": 0,
+                "send_errors": 0,
+            },
+            **self._data_totals,
+        )
+        stats["throughput_out"] = self._throughput(self._data_sent, now)
+        stats["throughput_in"] = self._throughput(self._data_received, now)
+        return stats
+
+    def _throughput(self, history, now):
+        while history and history[0][0] < now - self.DATA_THROUGHPUT_WINDOW:
+            history.popleft()
+        return sum(size for _, size in history) / self.DATA_THROUGHPUT_WINDOW
+
+    def _receive_data(self, content, buffer):
+        header = content.get("header", {})
+        if header.get("dtype") is not None:
+            import numpy as np
+
+            data = np.frombuffer(buffer, dtype=header["dtype"]).reshape(header["shape"])
+        else:
+            data = bytes(buffer)
+        size = memoryview(buffer).nbytes
+        self._data_totals["bytes_received"] += size
+        self._data_totals["messages_received"] += 1
+        self._data_received.append((time.time(), size))
+        self._data_callbacks(self, data, header.get("metadata"))
+
+    def _data_send_done(self, content):
+        future, size = self._data_sends.pop(content["id"], (None, 0))
+        if content.get("error"):
+            self._data_totals["send_errors"] += 1
+            logger.error("sending data to %s failed: %s", self.id_remote, content["error"])
+            if future is not None and not future.done():
+                future.set_exception(RuntimeError(content["error"]))
+            return
+        self._data_totals["bytes_sent"] += size
+        self._data_totals["messages_sent"] += 1
+        self._data_sent.append((time.time(), size))
+        if future is not None and not future.done():
+            future.set_result(size)
+
 
 @register
 class WebRTCRoom(DOMWidget):
@@ -620,6 +2273,76 @@ class WebRTCRoom(DOMWidget):
     streams = List(Instance(MediaStream), [], allow_none=False).tag(
         sync=True, **widget_serialization
     )
+    topology = Enum(
+        ["mesh", "hub"],
+        "mesh",
+        help='How participants connect: "mesh" connects every pair, so each participant uploads its stream to all others. With "hub", participants connect to a single hub (see hub), which relays the streams, so the upload per participant does not grow with the room. All participants should use the same topology.',
+    ).tag(sync=True)
+    hub = Bool(
+        False,
+        help="(boolean) With the hub topology, this participant is a hub: it connects to the other hubs and relays the streams of the participants connected to it. Participants connect to the first hub that answers them.",
+    ).tag(sync=True)
+    layers = Dict(
+        help="The video layers peers in this room can send, see VIDEO_LAYERS, copied to the peers when they connect."
+    ).tag(sync=True)
+    default_layer = Unicode(
+        None,
+        allow_none=True,
+        help="(str, default None) The layer sent to peers that connect, None sends the video as captured. Use set_layer to change it for connected peers.",
+    ).tag(sync=True)
+
+    def __init__(self, **kwargs):
+        super(WebRTCRoom, self).__init__(**kwargs)
+        self._data_callbacks = CallbackDispatcher()
+        self._bound_peers = set()
+        self._bind_data_callbacks()
+
+    @traitlets.default("layers")
+    def _default_layers(self):
+        return {name: dict(settings) for name, settings in VIDEO_LAYERS.items()}
+
+    @validate("default_layer")
+    def _valid_default_layer(self, proposal):
+        layer = proposal["value"]
+        if layer is not None and layer not in self.layers:
+            raise TraitError(
+                "default_layer should be one of %r, not %r" % (sorted(self.layers), layer)
+            )
+        return layer
+
+    def set_layer(self, layer, id_remote=None):
+        """Select the video layer sent to a connected peer, or to all connected peers.
+
+        :param str layer: One of layers, or None to send the video as captured.
+        :param str id_remote: The id of the remote participant, None for all peers.
+        """
+        peers = [peer for peer in self.peers if id_remote in (None, peer.id_remote)]
+        if id_remote is not None and not peers:
+            raise ValueError("no peer with id %r in this room" % id_remote)
+        for peer in peers:
+            peer.layer = layer
+
+    def send_data(self, data, metadata=None):
+        """Send bytes or a NumPy array to all connected peers, see :meth:`WebRTCPeer.send_data`.
+
+        :return: A list with a future per peer, see :meth:`WebRTCPeer.send_data`.
+        """
+        return [peer.send_data(data, metadata) for peer in self.peers]
+
+    def on_data(self, callback, remove=False):
+        """Register a callback for data received from any peer in the room, see
+        :meth:`WebRTCPeer.on_data`, peers that join later are included."""
+        self._data_callbacks.register_callback(callback, remove=remove)
+
+    @observe("peers")
+    def _bind_data_callbacks(self, change=None):
+        # during construction, the peers trait can be set before __init__ runs
+        if not hasattr(self, "_bound_peers"):
+            return
+        for peer in self.peers:
+            if peer.model_id not in self._bound_peers:
+                self._bound_peers.add(peer.model_id)
+                peer.on_data(self._data_callbacks)
 
 
 @register
@@ -636,12 +2359,111 @@ class WebRTCRoomMqtt(WebRTCRoom):
     server = Unicode("wss://iot.eclipse.org:443/ws").tag(sync=True)
 
 
-# add all help strings to the __doc__ for the api docstrings
-for name, cls in list(vars().items()):
-    try:
-        if issubclass(cls, traitlets.HasTraits):
-            for trait_name, trait in cls.class_traits().items():
-                if "help" in trait.metadata:
-                    trait.__doc__ = trait.metadata["help"]
-    except TypeError:
-        pass
+@register
+class WebRTCRoomKernel(WebRTCRoom):
+    """Uses the kernel to connect to other peers, without an external server.
+
+    The signaling messages (sdp offers/answers and ICE candidates) are sent over the widget comm,
+    and the kernel delivers them only to the peer they are meant for. All WebRTCRoomKernel
+    widgets in this kernel with the same room name are in the same room.
+    """
+
+    _model_name = Unicode("WebRTCRoomKernelModel").tag(sync=True)
+
+    ice_batch_interval = Int(
+        50,
+        help="(int, default 50) Milliseconds during which trickle ICE candidates are collected, and sent to the kernel in one message.",
+    ).tag(sync=True)
+
+    # room name to a dict of room_id to widget, for all rooms in this kernel. Each frontend that
+    # shows the widget joins with its own room_id, so a widget can have several
+    _rooms = {}
+
+    def __init__(self, **kwargs):
+        super(WebRTCRoomKernel, self).__init__(**kwargs)
+        self._room_ids = set()  # the room_ids of this widget, registered under _joined_room
+        self._joined_room = self.room
+        self.on_msg(self._handle_frontend_msg)
+        if self.comm is not None:
+            # also leave when the frontend closes the comm
+            self.comm.on_close(lambda msg: self._leave_all())
+
+    def _handle_frontend_msg(self, widget, content, buffers):
+        if content.get("msg") != "signal":
+            return
+        # we collect the messages per peer, so each gets a single message
+        outboxes = collections.defaultdict(list)
+        for message in content["messages"]:
+            if message.get("type") == "join":
+                self._join(message["room_id"])
+            elif message.get("type") == "leave":
+                self._leave(message["room_id"])
+            if message.get("type") in ("join", "leave"):
+                members = self._rooms.get(self._joined_room, {})
+                targets = [room_id for room_id in members if room_id != message["room_id"]]
+            else:
+                targets = [message.get("to")]
+            for room_id in targets:
+                outboxes[room_id].append(message)
+        self._deliver(self._joined_room, outboxes)
+
+    def _deliver(self, room, outboxes):
+        members = self._rooms.get(room, {})
+        for room_id, messages in outboxes.items():
+            if room_id in members:
+                members[room_id].send({"msg": "signal", "messages": messages})
+            else:
+                logger.warning("signaling message for unknown peer %s", room_id)
+
+    def _join(self, room_id):
+        self._room_ids.add(room_id)
+        self._rooms.setdefault(self._joined_room, {})[room_id] = self
+
+    def _leave(self, room_id):
+        self._room_ids.discard(room_id)
+        members = self._rooms.get(self._joined_room, {})
+        if members.get(room_id) is self:
+            del members[room_id]
+        if not members:
+            self._rooms.pop(self._joined_room, None)
+
+    def _leave_all(self):
+        for room_id in list(self._room_ids):
+            self._leave(room_id)
+
+    @observe("room")
+    def _room_changed(self, change):
+        # during construction, the room trait can be set before __init__ runs
+        if not hasattr(self, "_room_ids"):
+            return
+        room_ids = list(self._room_ids)
+        self._leave_all()
+        # the members of the old room drop their connections to us, the frontends join the new
+        # room themselves, see WebRTCRoomKernelModel
+        outboxes = collections.defaultdict(list)
+        for room_id in room_ids:
+            for member in self._rooms.get(change.old, {}):
+                outboxes[member].append({"type": "leave", "room_id": room_id})
+        self._deliver(change.old, outboxes)
+        self._joined_room = change.new
+        for room_id in room_ids:
+            self._join(room_id)
+
+    def close(self):
+        # also called by __del__ when __init__ failed, e.g. on an invalid trait
+        if hasattr(self, "_room_ids"):
+            self._leave_all()
+        super(WebRTCRoomKernel, self).close()
+
+
+# add all help strings to the __doc__ for the api docstrings, traitlets 5 does this itself, so
+# we only walk all traits for older versions
+if int(traitlets.__version__.split(".")[0]) < 5:
+    for name, cls in list(vars().items()):
+        try:
+            if issubclass(cls, traitlets.HasTraits):
+                for trait_name, trait in cls.class_traits().items():
+                    if "help" in trait.metadata:
+                        trait.__doc__ = trait.metadata["help"]
+        except TypeError:
+            pass
@@ -0,0 +1,51 @@
+// Measures the capture stages of a model (when its metrics attribute is true),
+// and sends the measurements to the kernel in batches.
+export class Metrics {
+  constructor(model, interval = 1000) {
+    this.model = model;
+    this.interval = interval;
+    this.events = [];
+    this.timer = null;
+  }
+
+  get enabled() {
+    return Boolean(this.model.get("metrics"));
+  }
+
+  record(
+    stage,
+    { duration = null, bytes = null, seq = null, time = null } = {},
+  ) {
+    if (!this.enabled) {
+      return;
+    }
+    this.events.push({
+      stage: stage,
+      duration: duration,
+      bytes: bytes,
+      seq: seq,
+      time: time === null ? Date.now() : time,
+    });
+    if (this.timer === null) {
+      this.timer = setTimeout(() => this.flush(), this.interval);
+    }
+  }
+
+  // awaits the promise, and records the time it took from now on
+  async measure(stage, promise, options = {}) {
+    const time = Date.now();
+    const start = performance.now();
+    const result = await promise;
+    const duration = performance.now() - start;
+    this.record(stage, { time: time, ...options, duration: duration });
+    return result;
+  }
+
+  flush() {
+    this.timer = null;
+    if (this.events.length && !this.model._closed) {
+      this.model.send({ msg: "metrics", events: this.events });
+    }
+    this.events = [];
+  }
+}
@@ -0,0 +1,194 @@
+// Captures raw PCM samples of a MediaStream with an AudioWorklet, resampled to
+// a given rate, and hands them over in chunks.
+
+// the processor runs in the AudioWorkletGlobalScope, so it is loaded from a
+// blob url instead of being bundled
+const processorSource = `
+class PCMCaptureProcessor extends AudioWorkletProcessor {
+  constructor(options) {
+    super();
+    const { rate, channels, chunkSize, dtype } = options.processorOptions;
+    // input samples per output sample
+    this.step = sampleRate / rate;
+    this.channels = channels;
+    this.chunkSize = chunkSize;
+    this.int16 = dtype === "int16";
+    // position of the next output sample, in input samples from the start of
+    // the current block, -1 is the last sample of the previous block
+    this.position = 0;
+    this.previous = new Float32Array(channels);
+    this.chunk = new Float32Array(chunkSize * channels);
+    this.filled = 0;
+    this.chunkTime = 0;
+    this.offset = 0;
+    this.stopped = false;
+    this.port.onmessage = (event) => {
+      if (event.data === "stop") {
+        // send what we have, and tell the main thread we are done
+        if (this.filled > 0) {
+          this.flush();
+        }
+        this.stopped = true;
+        this.port.postMessage("stopped");
+      }
+    };
+  }
+
+  mix(input) {
+    // the input channels we use, mono mixes all of them
+    if (this.channels === 1 && input.length > 1) {
+      const mixed = new Float32Array(input[0].length);
+      for (const samples of input) {
+        for (let i = 0; i < samples.length; i++) {
+          mixed[i] += samples[i] / input.length;
+        }
+      }
+      return [mixed];
+    }
+    const sources = [];
+    for (let c = 0; c < this.channels; c++) {
+      sources.push(input[Math.min(c, input.length - 1)]);
+    }
+    return sources;
+  }
+
+  process(inputs) {
+    if (this.stopped) {
+      return false;
+    }
+    const input = inputs[0];
+    if (input.length === 0) {
+      return true;
+    }
+    const sources = this.mix(input);
+    const length = sources[0].length;
+    // linear interpolation, the low pass filter before us prevents aliasing
+    while (this.position < length - 1) {
+      const index = Math.floor(this.position);
+      const fraction = this.position - index;
+      if (this.filled === 0) {
+        this.chunkTime = currentTime + this.position / sampleRate;
+      }
+      for (let c = 0; c < this.channels; c++) {
+        const a = index < 0 ? this.previous[c] : sources[c][index];
+        const b = sources[c][index + 1];
+        this.chunk[this.filled * this.channels + c] = a + (b - a) * fraction;
+      }
+      this.position += this.step;
+      if (++this.filled === this.chunkSize) {
+        this.flush();
+      }
+    }
+    this.position -= length;
+    for (let c = 0; c < this.channels; c++) {
+      this.previous[c] = sources[c][length - 1];
+    }
+    return true;
+  }
+
+  flush() {
+    // the last chunk can be partial
+    const length = this.filled * this.channels;
+    let samples;
+    if (this.int16) {
+      samples = new Int16Array(length);
+      for (let i = 0; i < length; i++) {
+        const value = Math.max(-1, Math.min(1, this.chunk[i]));
+        samples[i] = value < 0 ? value * 0x8000 : value * 0x7fff;
+      }
+    } else if (length < this.chunk.length) {
+      samples = this.chunk.slice(0, length);
+    } else {
+      // we transfer the buffer, so we need a new one
+      samples = this.chunk;
+      this.chunk = new Float32Array(this.chunk.length);
+    }
+    this.port.postMessage(
+      { samples: samples.buffer, time: this.chunkTime, offset: this.offset },
+      [samples.buffer],
+    );
+    this.offset += this.filled;
+    this.filled = 0;
+  }
+}
+
+registerProcessor("ipywebrtc-pcm-capture", PCMCaptureProcessor);
+`;
+
+let processorUrl = null;
+
+// Starts capturing, onChunk is called with the samples (an ArrayBuffer of
+// interleaved float32 or int16 samples), the capture time of the first sample
+// in milliseconds since the epoch, and the index of the first sample. Resolves
+// to an object with a stop method.
+export async function capturePCM(
+  stream,
+  { rate, channels, chunkSize, dtype },
+  onChunk,
+) {
+  if (processorUrl === null) {
+    const blob = new Blob([processorSource], {
+      type: "application/javascript",
+    });
+    processorUrl = URL.createObjectURL(blob);
+  }
+  const context = new AudioContext();
+  try {
+    await context.audioWorklet.addModule(processorUrl);
+    const source = context.createMediaStreamSource(stream);
+    let node = source;
+    if (rate < context.sampleRate) {
+      // two biquads give 24 dB per octave, below the new Nyquist frequency
+      for (let i = 0; i < 2; i++) {
+        const filter = context.createBiquadFilter();
+        filter.type = "lowpass";
+        filter.frequency.value = rate * 0.45;
+        node = node.connect(filter);
+      }
+    }
+    const worklet = new AudioWorkletNode(context, "ipywebrtc-pcm-capture", {
+      numberOfOutputs: 1,
+      channelCount: Math.max(channels, 2),
+      channelCountMode: "explicit",
+      processorOptions: { rate, channels, chunkSize, dtype },
+    });
+    let stopped = null;
+    worklet.port.onmessage = (event) => {
+      if (event.data === "stopped") {
+        stopped();
+        return;
+      }
+      const { samples, time, offset } = event.data;
+      // map the audio clock to the wall clock
+      const stamp = context.getOutputTimestamp();
+      const epoch =
+        performance.timeOrigin +
+        stamp.performanceTime +
+        (time - stamp.contextTime) * 1000;
+      onChunk(samples, epoch, offset);
+    };
+    // the output is silent, but a node needs to be connected to be processed
+    node.connect(worklet).connect(context.destination);
+    await context.resume();
+    if (context.state !== "running") {
+      console.warn("the audio context for PCM capture is", context.state);
+    }
+    return {
+      sampleRate: context.sampleRate,
+      async stop() {
+        // wait (not too long) for the last partial chunk
+        await new Promise((resolve) => {
+          stopped = resolve;
+          worklet.port.postMessage("stop");
+          setTimeout(resolve, 500);
+        });
+        source.disconnect();
+        worklet.disconnect();
+        return context.close();
+      },
+    };
+  } catch (e) {
+    context.close();
+    throw e;
+  }
+}
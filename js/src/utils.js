@@ -61,9 +61,10 @@ export async function onLoadedMetaData(videoElement) {
   });
 }
 
-export async function canvasToBlob(canvas, mimeType) {
+export async function canvasToBlob(canvas, mimeType, quality) {
+  // quality (between 0 and 1) is only used for lossy formats
   return new Promise((resolve, reject) => {
-    canvas.toBlob((blob) => resolve(blob), mimeType);
+    canvas.toBlob((blob) => resolve(blob), mimeType, quality);
   });
 }
 export async function blobToBytes(blob) {
@@ -76,6 +77,55 @@ export async function blobToBytes(blob) {
     };
   });
 }
+export function rgbaToGray(rgba) {
+  // ITU-R BT.601 luma, using integer weights that sum to 256
+  const gray = new Uint8ClampedArray(rgba.length / 4);
+  for (let i = 0, j = 0; j < gray.length; i += 4, j++) {
+    gray[j] = (77 * rgba[i] + 150 * rgba[i + 1] + 29 * rgba[i + 2]) >> 8;
+  }
+  return gray;
+}
+// a pixel changed when its luminance changed by more than this (of 255), so
+// sensor noise does not count
+const motionPixelThreshold = 24;
+export function motionScore(reference, gray) {
+  // the fraction of the pixels that changed between two gray frames
+  let changed = 0;
+  for (let i = 0; i < gray.length; i++) {
+    if (Math.abs(gray[i] - reference[i]) > motionPixelThreshold) {
+      changed++;
+    }
+  }
+  return changed / gray.length;
+}
+export function hashPixels(pixels) {
+  // FNV-1a over 32 bit words, fast enough to run on every rendered frame
+  const words = new Uint32Array(
+    pixels.buffer,
+    pixels.byteOffset,
+    pixels.byteLength >> 2,
+  );
+  let hash = 0x811c9dc5;
+  for (let i = 0; i < words.length; i++) {
+    hash = Math.imul(hash ^ words[i], 16777619);
+  }
+  return hash >>> 0;
+}
+export function toRGBA(pixels, channels) {
+  // expand grayscale (1 channel) or RGB (3 channels) pixels to RGBA
+  const count = pixels.length / channels;
+  if (channels === 4) {
+    return new Uint8ClampedArray(pixels.buffer, pixels.byteOffset, count * 4);
+  }
+  const rgba = new Uint8ClampedArray(count * 4);
+  for (let i = 0, j = 0; i < count; i++, j += channels) {
+    rgba[i * 4] = pixels[j];
+    rgba[i * 4 + 1] = pixels[channels === 1 ? j : j + 1];
+    rgba[i * 4 + 2] = pixels[channels === 1 ? j : j + 2];
+    rgba[i * 4 + 3] = 255;
+  }
+  return rgba;
+}
 export async function imageWidgetToCanvas(widget, canvas) {
   // this code should move to jupyter-widgets's ImageModel widget, so all this logic is in one place
   // returns when the image is drawn on the canvas
@@ -118,3 +168,84 @@ export async function imageWidgetToCanvas(widget, canvas) {
     };
   });
 }
+
+// Summarizes an RTCStatsReport, rates are computed over the time since the
+// previous summary (pass the returned totals of the previous call).
+export function summarizeRTCStats(report, previous) {
+  const totals = {
+    time: Date.now(),
+    bytesReceived: 0,
+    bytesSent: 0,
+    packetsReceived: 0,
+    packetsLost: 0,
+  };
+  const summary = {
+    time: totals.time,
+    rtt: null,
+    jitter: null,
+    packets_lost: 0,
+    packet_loss: null,
+    bitrate_in: null,
+    bitrate_out: null,
+    frames_decoded: null,
+    frames_dropped: null,
+    frames_per_second: null,
+    codec: null,
+  };
+  let selectedPair = null;
+  report.forEach((stats) => {
+    if (stats.type === "transport" && stats.selectedCandidatePairId) {
+      selectedPair = stats.selectedCandidatePairId;
+    }
+  });
+  report.forEach((stats) => {
+    if (stats.type === "candidate-pair") {
+      const selected = selectedPair
+        ? stats.id === selectedPair
+        : stats.nominated && stats.state === "succeeded";
+      if (selected && stats.currentRoundTripTime !== undefined) {
+        summary.rtt = stats.currentRoundTripTime * 1000;
+      }
+    } else if (stats.type === "inbound-rtp") {
+      totals.bytesReceived += stats.bytesReceived || 0;
+      totals.packetsReceived += stats.packetsReceived || 0;
+      totals.packetsLost += stats.packetsLost || 0;
+      if (stats.jitter !== undefined) {
+        summary.jitter = Math.max(summary.jitter || 0, stats.jitter * 1000);
+      }
+      if (stats.kind === "video") {
+        summary.frames_decoded = stats.framesDecoded;
+        summary.frames_dropped = stats.framesDropped;
+        summary.frames_per_second = stats.framesPerSecond;
+        const codec = stats.codecId && report.get(stats.codecId);
+        if (codec) {
+          summary.codec = codec.mimeType;
+        }
+      }
+    } else if (stats.type === "outbound-rtp") {
+      totals.bytesSent += stats.bytesSent || 0;
+      if (stats.kind === "video" && summary.codec === null) {
+        const codec = stats.codecId && report.get(stats.codecId);
+        if (codec) {
+          summary.codec = codec.mimeType;
+        }
+      }
+    }
+  });
+  summary.packets_lost = totals.packetsLost;
+  if (previous) {
+    const seconds = (totals.time - previous.time) / 1000;
+    const received = totals.packetsReceived - previous.packetsReceived;
+    const lost = totals.packetsLost - previous.packetsLost;
+    if (seconds > 0) {
+      const bytesIn = totals.bytesReceived - previous.bytesReceived;
+      const bytesOut = totals.bytesSent - previous.bytesSent;
+      summary.bitrate_in = (bytesIn * 8) / seconds;
+      summary.bitrate_out = (bytesOut * 8) / seconds;
+    }
+    if (received + lost > 0) {
+      summary.packet_loss = lost / (received + lost);
+    }
+  }
+  return { summary: summary, totals: totals };
+}
@@ -0,0 +1,365 @@
+// Splits the WebM data MediaRecorder produces into the initialization segment
+// and clusters, so a recording can be trimmed at cluster boundaries, see
+// ReplayBuffer.
+
+const SEGMENT = 0x18538067;
+const SEEK_HEAD = 0x114d9b74;
+const INFO = 0x1549a966;
+const TIMECODE_SCALE = 0x2ad7b1;
+const TRACKS = 0x1654ae6b;
+const TRACK_ENTRY = 0xae;
+const TRACK_NUMBER = 0xd7;
+const TRACK_TYPE = 0x83;
+const CLUSTER = 0x1f43b675;
+const TIMECODE = 0xe7;
+const SIMPLE_BLOCK = 0xa3;
+const BLOCK_GROUP = 0xa0;
+const BLOCK = 0xa1;
+const REFERENCE_BLOCK = 0xfb;
+const CUES = 0x1c53bb6b;
+const VOID = 0xec;
+// the children of a segment, a cluster of unknown size ends at one of these
+const LEVEL1 = new Set([
+  SEEK_HEAD,
+  INFO,
+  TRACKS,
+  CLUSTER,
+  CUES,
+  VOID,
+  0x1254c367,
+  0x1043a770,
+  0x1941a469,
+]);
+const TRACK_TYPE_VIDEO = 1;
+const UNKNOWN_SIZE = [0x01, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff];
+const SEGMENT_HEADER = [0x18, 0x53, 0x80, 0x67, ...UNKNOWN_SIZE];
+const CLUSTER_HEADER = [0x1f, 0x43, 0xb6, 0x75, ...UNKNOWN_SIZE];
+
+function vintLength(byte) {
+  for (let length = 1; length <= 8; length++) {
+    if (byte & (0x100 >> length)) {
+      return length;
+    }
+  }
+  throw new Error("invalid EBML variable size integer");
+}
+
+function readUint(bytes, offset, length) {
+  // doubles are exact up to 2**53, which is enough for sizes and timecodes
+  let value = 0;
+  for (let i = 0; i < length; i++) {
+    value = value * 256 + bytes[offset + i];
+  }
+  return value;
+}
+
+// returns the id, size (null when unknown) and header length of the element
+// at offset, or null when the header is not complete
+function readHeader(bytes, offset) {
+  if (offset >= bytes.length) {
+    return null;
+  }
+  const idLength = vintLength(bytes[offset]);
+  if (offset + idLength >= bytes.length) {
+    return null;
+  }
+  const sizeLength = vintLength(bytes[offset + idLength]);
+  if (offset + idLength + sizeLength > bytes.length) {
+    return null;
+  }
+  const id = readUint(bytes, offset, idLength);
+  const sizeOffset = offset + idLength;
+  let size = bytes[sizeOffset] & (0xff >> sizeLength);
+  let unknown = size === 0xff >> sizeLength;
+  for (let i = 1; i < sizeLength; i++) {
+    size = size * 256 + bytes[sizeOffset + i];
+    unknown = unknown && bytes[sizeOffset + i] === 0xff;
+  }
+  return {
+    id: id,
+    size: unknown ? null : size,
+    length: idLength + sizeLength,
+  };
+}
+
+// yields the id, payload offset and size of the elements in a payload
+function* children(bytes, start, end) {
+  let offset = start;
+  while (offset < end) {
+    const header = readHeader(bytes, offset);
+    if (header === null || header.size === null) {
+      return;
+    }
+    yield {
+      id: header.id,
+      offset: offset + header.length,
+      size: header.size,
+    };
+    offset += header.length + header.size;
+  }
+}
+
+function concat(parts) {
+  const bytes = new Uint8Array(
+    parts.reduce((total, part) => total + part.length, 0),
+  );
+  let offset = 0;
+  for (const part of parts) {
+    bytes.set(part, offset);
+    offset += part.length;
+  }
+  return bytes;
+}
+
+// An incremental parser: push the data as it arrives, clusters are passed to
+// onCluster as soon as they start, and filled in as their elements arrive.
+export class WebMParser {
+  constructor(onCluster) {
+    this.onCluster = onCluster;
+    this.buffer = new Uint8Array(0);
+    this.init = [];
+    this.inSegment = false;
+    this.timecodeScale = 1000000;
+    this.videoTracks = new Set();
+    this.cluster = null;
+    // bytes left in a cluster of known size, null when unknown
+    this.clusterRemaining = null;
+  }
+
+  get initSegment() {
+    return concat(this.init);
+  }
+
+  push(data) {
+    this.buffer = this.buffer.length ? concat([this.buffer, data]) : data;
+    let offset = 0;
+    for (;;) {
+      const header = readHeader(this.buffer, offset);
+      if (header === null) {
+        break;
+      }
+      const { id, size, length } = header;
+      if (
+        this.cluster !== null &&
+        this.clusterRemaining === null &&
+        LEVEL1.has(id)
+      ) {
+        this.cluster = null;
+      }
+      if (this.inSegment && id === CLUSTER) {
+        // we always write clusters with an unknown size, so a partial
+        // cluster is valid too
+        this.cluster = {
+          timecode: 0,
+          time: null,
+          end: null,
+          keyframe: null,
+          parts: [new Uint8Array(CLUSTER_HEADER)],
+          timecodePart: null,
+          size: CLUSTER_HEADER.length,
+        };
+        this.clusterRemaining = size;
+        this.onCluster(this.cluster);
+        offset += length;
+        continue;
+      }
+      if (!this.inSegment && id === SEGMENT) {
+        // the size is unknown after trimming
+        this.inSegment = true;
+        this.init.push(new Uint8Array(SEGMENT_HEADER));
+        offset += length;
+        continue;
+      }
+      if (size === null) {
+        throw new Error("WebM element of unknown size: " + id.toString(16));
+      }
+      if (offset + length + size > this.buffer.length) {
+        break;
+      }
+      // a copy, so we do not keep the chunk the element came from
+      const element = this.buffer.slice(offset, offset + length + size);
+      offset += length + size;
+      if (this.cluster !== null) {
+        this.clusterElement(id, element, length);
+        if (this.clusterRemaining !== null) {
+          this.clusterRemaining -= element.length;
+          if (this.clusterRemaining <= 0) {
+            this.cluster = null;
+          }
+        }
+      } else if (id === INFO) {
+        for (const child of children(element, length, element.length)) {
+          if (child.id === TIMECODE_SCALE) {
+            this.timecodeScale = readUint(element, child.offset, child.size);
+          }
+        }
+        this.init.push(element);
+      } else if (id === TRACKS) {
+        this.parseTracks(element, length);
+        this.init.push(element);
+      } else if (id !== SEEK_HEAD && id !== CUES && id !== VOID) {
+        // the EBML header and other elements, but not the index, which is
+        // not valid after trimming
+        this.init.push(element);
+      }
+    }
+    this.buffer = this.buffer.slice(offset);
+  }
+
+  parseTracks(element, start) {
+    for (const entry of children(element, start, element.length)) {
+      if (entry.id !== TRACK_ENTRY) {
+        continue;
+      }
+      let number = null;
+      let type = null;
+      const end = entry.offset + entry.size;
+      for (const child of children(element, entry.offset, end)) {
+        if (child.id === TRACK_NUMBER) {
+          number = readUint(element, child.offset, child.size);
+        } else if (child.id === TRACK_TYPE) {
+          type = readUint(element, child.offset, child.size);
+        }
+      }
+      if (number !== null && type === TRACK_TYPE_VIDEO) {
+        this.videoTracks.add(number);
+      }
+    }
+  }
+
+  clusterElement(id, element, headerLength) {
+    const cluster = this.cluster;
+    if (id === TIMECODE) {
+      cluster.timecode = readUint(
+        element,
+        headerLength,
+        element.length - headerLength,
+      );
+      cluster.timecodePart = cluster.parts.length;
+    } else if (id === SIMPLE_BLOCK) {
+      this.block(element, headerLength, (flags) => Boolean(flags & 0x80));
+    } else if (id === BLOCK_GROUP) {
+      let block = null;
+      let reference = false;
+      for (const child of children(element, headerLength, element.length)) {
+        if (child.id === BLOCK) {
+          block = child.offset;
+        } else if (child.id === REFERENCE_BLOCK) {
+          reference = true;
+        }
+      }
+      if (block !== null) {
+        this.block(element, block, () => !reference);
+      }
+    }
+    cluster.parts.push(element);
+    cluster.size += element.length;
+  }
+
+  block(element, offset, isKeyframe) {
+    const cluster = this.cluster;
+    const trackLength = vintLength(element[offset]);
+    const track = element[offset] & (0xff >> trackLength);
+    const view = new DataView(element.buffer, element.byteOffset);
+    const relative = view.getInt16(offset + trackLength);
+    const flags = element[offset + trackLength + 2];
+    const time =
+      ((cluster.timecode + relative) * this.timecodeScale) / 1000000;
+    if (cluster.time === null) {
+      cluster.time = time;
+    }
+    cluster.time = Math.min(cluster.time, time);
+    cluster.end = Math.max(cluster.end === null ? time : cluster.end, time);
+    // a cluster is a keyframe when it starts with one, for video that is the
+    // first video block, for audio all blocks are keyframes
+    const video = this.videoTracks.size === 0 || this.videoTracks.has(track);
+    if (cluster.keyframe === null && video) {
+      cluster.keyframe = isKeyframe(flags);
+    }
+  }
+}
+
+// Keeps the last duration milliseconds of a WebM recording, starting at a
+// keyframe, and drops older clusters, so memory use stays bounded.
+export class ReplayBuffer {
+  constructor(duration) {
+    this.duration = duration;
+    this.clusters = [];
+    this.parser = new WebMParser((cluster) => {
+      this.clusters.push(cluster);
+      this.trim();
+    });
+  }
+
+  push(bytes) {
+    this.parser.push(bytes);
+    this.trim();
+  }
+
+  get end() {
+    const last = this.clusters[this.clusters.length - 1];
+    return last && last.end !== null ? last.end : null;
+  }
+
+  // milliseconds between the start of the first cluster and the last block
+  get span() {
+    const first = this.clusters.find((cluster) => cluster.time !== null);
+    return first && this.end !== null ? this.end - first.time : 0;
+  }
+
+  get size() {
+    return this.clusters.reduce((total, cluster) => total + cluster.size, 0);
+  }
+
+  // true when we could not trim, because the browser does not make keyframes
+  get stale() {
+    return this.span > 2 * this.duration + 5000;
+  }
+
+  trim() {
+    const end = this.end;
+    if (end === null) {
+      return;
+    }
+    // the last keyframe cluster from which we still have enough data
+    let start = 0;
+    this.clusters.forEach((cluster, index) => {
+      if (
+        cluster.keyframe &&
+        cluster.time !== null &&
+        end - cluster.time >= this.duration
+      ) {
+        start = index;
+      }
+    });
+    if (start > 0) {
+      this.clusters.splice(0, start);
+    }
+  }
+
+  // the parts of a playable file, with timecodes starting at zero
+  parts() {
+    const clusters = this.clusters.filter((cluster) => cluster.time !== null);
+    if (clusters.length === 0) {
+      return [];
+    }
+    const base = clusters[0].timecode;
+    const parts = [this.parser.initSegment];
+    for (const cluster of clusters) {
+      cluster.parts.forEach((part, index) => {
+        if (index === cluster.timecodePart) {
+          // same length, so no sizes change
+          part = part.slice();
+          const headerLength = readHeader(part, 0).length;
+          let value = cluster.timecode - base;
+          for (let i = part.length - 1; i >= headerLength; i--) {
+            part[i] = value % 256;
+            value = Math.floor(value / 256);
+          }
+        }
+        parts.push(part);
+      });
+    }
+    return parts;
+  }
+}
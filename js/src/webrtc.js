@@ -9,6 +9,9 @@ window.ws = global.WebSocket;
 
 import * as mqtt from "mqtt";
 import * as utils from "./utils";
+import { Metrics } from "./metrics";
+import { capturePCM } from "./pcm";
+import { ReplayBuffer } from "./webm";
 const semver_range = "~" + require("../package.json").version;
 
 import { imageWidgetToCanvas } from "./utils";
@@ -23,9 +26,15 @@ export class MediaStreamModel extends widgets.DOMWidgetModel {
       _view_name: "MediaStreamView",
       _model_module_version: semver_range,
       _view_module_version: semver_range,
+      metrics: false,
     };
   }
 
+  initialize() {
+    super.initialize.apply(this, arguments);
+    this.metrics = new Metrics(this);
+  }
+
   get stream() {
     return this.captureStream();
   }
@@ -43,6 +52,18 @@ const captureStream = function (widget) {
   }
 };
 
+// resolves to the time of the next event of a type, in milliseconds since the
+// epoch, on the clock of the page
+const eventTime = function (target, type) {
+  return new Promise((resolve) => {
+    target.addEventListener(
+      type,
+      (event) => resolve(performance.timeOrigin + event.timeStamp),
+      { once: true },
+    );
+  });
+};
+
 export class MediaStreamView extends widgets.DOMWidgetView {
   render() {
     super.render.apply(this, arguments);
@@ -129,20 +150,152 @@ ImageStreamModel.serializers = {
 
 class StreamModel extends MediaStreamModel {
   defaults() {
-    return { ...super.defaults(), playing: true };
+    return { ...super.defaults(), playing: true, _source: null };
   }
 
   initialize() {
     super.initialize.apply(this, arguments);
 
     this.media = undefined;
+    this.pendingReads = {}; // offset to resolve function
 
     this.on("change:playing", this.updatePlay, this);
+    this.on("msg:custom", this.handleCustomMessage, this);
+  }
+
+  handleCustomMessage(content, buffers) {
+    if (content.msg === "source_chunk") {
+      const { resolve } = this.pendingReads[content.offset];
+      delete this.pendingReads[content.offset];
+      const view = buffers[0];
+      resolve(new Uint8Array(view.buffer, view.byteOffset, view.byteLength));
+    } else if (content.msg === "source_error") {
+      const { reject } = this.pendingReads[content.offset];
+      delete this.pendingReads[content.offset];
+      reject(new Error("could not read the source: " + content.error));
+    }
+  }
+
+  readSource(offset, length) {
+    // ask the kernel for a range of the (memory mapped) file
+    return new Promise((resolve, reject) => {
+      this.pendingReads[offset] = { resolve, reject };
+      this.send({ msg: "read", offset: offset, length: length });
+    });
+  }
+
+  createSourceMedia() {
+    const source = this.get("_source");
+    const media = document.createElement(this.type);
+    // only webm and fragmented mp4 can be appended to a SourceBuffer, the
+    // kernel tells us which it is
+    if (
+      source.streamable &&
+      window.MediaSource &&
+      MediaSource.isTypeSupported(source.mime_type)
+    ) {
+      const mediaSource = new MediaSource();
+      media.src = URL.createObjectURL(mediaSource);
+      mediaSource.addEventListener(
+        "sourceopen",
+        () => {
+          URL.revokeObjectURL(media.src);
+          this.pumpSource(media, mediaSource, source).catch((e) => {
+            console.error("could not stream the source, reading it whole", e);
+            this.loadSourceBlob(media, source);
+          });
+        },
+        { once: true },
+      );
+    } else {
+      this.loadSourceBlob(media, source);
+    }
+    return media;
+  }
+
+  async loadSourceBlob(media, source) {
+    // without MediaSource support we need the whole file before we can play it
+    try {
+      const chunks = [];
+      for (let offset = 0; offset < source.size; ) {
+        const bytes = await this.readSource(offset, source.chunk_size);
+        chunks.push(bytes);
+        offset += bytes.byteLength;
+      }
+      const blob = new Blob(chunks, { type: source.mime_type });
+      media.src = URL.createObjectURL(blob);
+    } catch (e) {
+      console.error("could not read the source", e);
+    }
+  }
+
+  pumpSource(media, mediaSource, source) {
+    // resolves when the whole file is appended, and rejects when reading or
+    // appending fails
+    return new Promise((resolve, reject) => {
+      // only read ahead a limited amount, the rest is requested while playing
+      const maxSecondsAhead = 30;
+      const buffer = mediaSource.addSourceBuffer(source.mime_type);
+      let offset = 0;
+      let reading = false;
+      let failed = false;
+      const fail = (error) => {
+        if (failed) {
+          return;
+        }
+        failed = true;
+        buffer.removeEventListener("updateend", pump);
+        media.removeEventListener("timeupdate", pump);
+        reject(error);
+      };
+      const pump = async () => {
+        if (
+          failed ||
+          reading ||
+          buffer.updating ||
+          mediaSource.readyState !== "open"
+        ) {
+          return;
+        }
+        if (offset >= source.size) {
+          mediaSource.endOfStream();
+          resolve();
+          return;
+        }
+        const buffered = media.buffered;
+        if (
+          buffered.length > 0 &&
+          buffered.end(buffered.length - 1) - media.currentTime >
+            maxSecondsAhead
+        ) {
+          return; // the next timeupdate will try again
+        }
+        try {
+          reading = true;
+          const bytes = await this.readSource(offset, source.chunk_size);
+          reading = false;
+          offset += bytes.byteLength;
+          buffer.appendBuffer(bytes);
+        } catch (e) {
+          fail(e);
+        }
+      };
+      buffer.addEventListener("updateend", pump);
+      buffer.addEventListener("error", () =>
+        fail(new Error("could not append to the SourceBuffer")),
+      );
+      media.addEventListener("timeupdate", pump);
+      pump();
+    });
   }
 
   async captureStream() {
     if (!this.createView) {
       this.createView = _.once(() => {
+        if (this.get("_source")) {
+          this.media = this.createSourceMedia();
+          return Promise.resolve();
+        }
         return this.widget_manager
           .create_view(this.get(this.type))
           .then((view) => {
@@ -152,11 +305,13 @@ class StreamModel extends MediaStreamModel {
       });
     }
     let widget = this.get(this.type);
-    if (!widget) throw new Error("no media widget passed");
+    if (!widget && !this.get("_source")) {
+      throw new Error("no media widget passed");
+    }
     await this.createView();
     if (this.media.captureStream || this.media.mozCaptureStream) {
       // following https://github.com/webrtc/samples/blob/gh-pages/src/content/capture/video-pc/js/main.js
-      await utils.onCanPlay(this.media);
+      await this.metrics.measure("can_play", utils.onCanPlay(this.media));
 
       this.updatePlay();
 
@@ -180,8 +335,17 @@ class StreamModel extends MediaStreamModel {
 
   close() {
     const returnValue = super.close.apply(this, arguments);
-    this.media.pause();
-    this.media_wid.close();
+    // the kernel will not answer anymore
+    Object.values(this.pendingReads).forEach(({ reject }) =>
+      reject(new Error("the stream is closed")),
+    );
+    this.pendingReads = {};
+    if (this.media) {
+      this.media.pause();
+    }
+    if (this.media_wid) {
+      this.media_wid.close();
+    }
     return returnValue;
   }
 }
@@ -271,6 +435,8 @@ export class WidgetStreamModel extends MediaStreamModel {
       _view_name: "WidgetStreamView",
       widget: null,
       max_fps: null,
+      capture_fps: null,
+      render_time: null,
       _html2canvas_start_streaming: false,
     };
   }
@@ -375,54 +541,141 @@ export class WidgetStreamModel extends MediaStreamModel {
     ) {
       this.html2CanvasStreaming = true;
 
-      let lastTime;
-      const updateStream = (currentTime) => {
-        if (!this._closed) {
-          if (!lastTime) {
-            lastTime = currentTime;
-          }
-          const timeSinceLastFrame = currentTime - lastTime;
-          lastTime = currentTime;
+      // html2canvas renders on a separate canvas, and only when the pixels
+      // changed we copy it to the canvas that is streamed
+      this.renderCanvas = document.createElement("canvas");
+      this.renderCanvas.getContext("2d", { willReadFrequently: true });
+      this.lastFrameHash = null;
+      this.renderTimer = null;
+      this.rendering = false;
+      this.dirty = true;
+      this.lastRenderStart = -Infinity;
+      this.captureStats = { start: performance.now(), frames: 0, renders: [] };
+      this.captureStatsTimer = setInterval(() => this.syncCaptureStats(), 1000);
+
+      // with max_fps=None, we only render after something changed
+      const markDirty = () => {
+        this.dirty = true;
+        this.scheduleRender();
+      };
+      this.mutationObserver = new MutationObserver(markDirty);
+      this.mutationObserver.observe(this.rendered_view.el, {
+        subtree: true,
+        childList: true,
+        attributes: true,
+        characterData: true,
+      });
+      this.listenTo(this.get("widget"), "change", markDirty);
+      this.on("change:max_fps", markDirty, this);
+      this.scheduleRender();
+    }
+  }
 
-          const fps = this.get("max_fps");
-          if (fps === 0) {
-            /* TODO: maybe implement the same behavior as here:
-                        https://developer.mozilla.org/en-US/docs/Web/API/HTMLCanvasElement/captureStream */
-          } else {
-            let waitingTime = 0;
-            if (fps !== null && fps !== undefined) {
-              waitingTime = 1000 / fps - timeSinceLastFrame;
-              if (waitingTime < 0) {
-                waitingTime = 0;
-              }
-            }
+  scheduleRender() {
+    if (this.renderTimer !== null || this.rendering || this._closed) {
+      return;
+    }
+    const fps = this.get("max_fps");
+    if (fps === 0) {
+      /* TODO: maybe implement the same behavior as here:
+                  https://developer.mozilla.org/en-US/docs/Web/API/HTMLCanvasElement/captureStream */
+      return;
+    }
+    const periodic = fps !== null && fps !== undefined;
+    if (!periodic && !this.dirty) {
+      return;
+    }
+    // wait a bit, so a burst of changes results in a single render
+    const coalesceTime = 20;
+    let waitingTime = coalesceTime;
+    if (periodic) {
+      waitingTime = this.lastRenderStart + 1000 / fps - performance.now();
+    }
+    this.renderTimer = setTimeout(
+      () => {
+        this.renderTimer = null;
+        window.requestAnimationFrame(() => this.renderHTML2Canvas());
+      },
+      Math.max(0, waitingTime),
+    );
+  }
 
-            setTimeout(() => {
-              html2canvas(this.rendered_view.el, {
-                canvas: this.canvas,
-                logging: false,
-                useCORS: true,
-                ignoreElements: (element) => {
-                  return !(
-                    // Do not ignore if the element contains what we want to render
-                    (
-                      element.contains(this.rendered_view.el) ||
-                      // Do not ignore if the element is contained by what we want to render
-                      this.rendered_view.el.contains(element) ||
-                      // Do not ignore if the element is contained by the head (style and scripts)
-                      document.head.contains(element)
-                    )
-                  );
-                },
-              }).then(() => {
-                window.requestAnimationFrame(updateStream);
-              });
-            }, waitingTime);
-          }
+  async renderHTML2Canvas() {
+    this.rendering = true;
+    this.dirty = false;
+    this.lastRenderStart = performance.now();
+    try {
+      await html2canvas(this.rendered_view.el, {
+        canvas: this.renderCanvas,
+        logging: false,
+        useCORS: true,
+        ignoreElements: (element) => {
+          return !(
+            // Do not ignore if the element contains what we want to render
+            (
+              element.contains(this.rendered_view.el) ||
+              // Do not ignore if the element is contained by what we want to render
+              this.rendered_view.el.contains(element) ||
+              // Do not ignore if the element is contained by the head (style and scripts)
+              document.head.contains(element)
+            )
+          );
+        },
+      });
+      const renderTime = performance.now() - this.lastRenderStart;
+      this.metrics.record("render", { duration: renderTime });
+      const { width, height } = this.renderCanvas;
+      const pixels = this.renderCanvas
+        .getContext("2d")
+        .getImageData(0, 0, width, height).data;
+      const hash = `${width}x${height}:${utils.hashPixels(pixels)}`;
+      if (hash !== this.lastFrameHash) {
+        this.lastFrameHash = hash;
+        if (this.canvas.width !== width || this.canvas.height !== height) {
+          this.canvas.width = width;
+          this.canvas.height = height;
         }
-      };
-      window.requestAnimationFrame(updateStream);
+        this.canvas.getContext("2d").drawImage(this.renderCanvas, 0, 0);
+        this.captureStats.frames++;
+      }
+      this.captureStats.renders.push(renderTime);
+    } catch (e) {
+      console.error("could not render the widget using html2canvas", e);
+    } finally {
+      // also after an error, otherwise we would never render again
+      this.rendering = false;
+      this.scheduleRender();
+    }
+  }
+
+  syncCaptureStats() {
+    // sync the effective fps and render time, called once per second, so the
+    // fps drops to 0 when nothing is rendered
+    const stats = this.captureStats;
+    const elapsed = performance.now() - stats.start;
+    const fps = (stats.frames * 1000) / elapsed;
+    if (stats.renders.length || fps !== this.get("capture_fps")) {
+      this.set("capture_fps", fps);
+      if (stats.renders.length) {
+        const total = stats.renders.reduce((a, b) => a + b, 0);
+        this.set("render_time", total / stats.renders.length);
+      }
+      this.save_changes();
+    }
+    this.captureStats = { start: performance.now(), frames: 0, renders: [] };
+  }
+
+  close() {
+    if (this.mutationObserver) {
+      this.mutationObserver.disconnect();
+    }
+    if (this.renderTimer !== null && this.renderTimer !== undefined) {
+      clearTimeout(this.renderTimer);
+    }
+    if (this.captureStatsTimer) {
+      clearInterval(this.captureStatsTimer);
     }
+    return super.close.apply(this, arguments);
   }
 }
 
@@ -433,6 +686,62 @@ WidgetStreamModel.serializers = {
 
 export class WidgetStreamView extends MediaStreamView {}
 
+export class ArrayStreamModel extends MediaStreamModel {
+  defaults() {
+    return {
+      ...super.defaults(),
+      _model_name: "ArrayStreamModel",
+    };
+  }
+
+  initialize() {
+    super.initialize.apply(this, arguments);
+    window.last_array_stream = this;
+    this.canvas = document.createElement("canvas");
+    this.context = this.canvas.getContext("2d");
+    this.on("msg:custom", this.handleCustomMessage, this);
+    // the kernel only sends what changed, so we ask for the current frame
+    this.send({ msg: "request_frame" });
+  }
+
+  handleCustomMessage(content, buffers) {
+    if (content.msg === "frame") {
+      this.paintFrame(content, buffers[0]);
+    }
+  }
+
+  paintFrame(frame, view) {
+    const start = performance.now();
+    if (
+      this.canvas.width !== frame.frame_width ||
+      this.canvas.height !== frame.frame_height
+    ) {
+      this.canvas.width = frame.frame_width;
+      this.canvas.height = frame.frame_height;
+    }
+    const pixels = new Uint8Array(
+      view.buffer,
+      view.byteOffset,
+      view.byteLength,
+    );
+    const rgba = utils.toRGBA(pixels, frame.channels);
+    const imageData = new ImageData(rgba, frame.width, frame.height);
+    this.context.putImageData(imageData, frame.x, frame.y);
+    this.metrics.record("paint", {
+      duration: performance.now() - start,
+      bytes: view.byteLength,
+    });
+  }
+
+  async captureStream() {
+    if (this.canvas.captureStream) {
+      return this.canvas.captureStream();
+    } else {
+      throw new Error("captureStream not supported for this browser");
+    }
+  }
+}
+
 export class CameraStreamModel extends MediaStreamModel {
   defaults() {
     return {
@@ -444,8 +753,9 @@ export class CameraStreamModel extends MediaStreamModel {
 
   captureStream() {
     if (!this.cameraStream) {
-      this.cameraStream = navigator.mediaDevices.getUserMedia(
-        this.get("constraints"),
+      this.cameraStream = this.metrics.measure(
+        "get_user_media",
+        navigator.mediaDevices.getUserMedia(this.get("constraints")),
       );
     }
     return this.cameraStream;
@@ -476,6 +786,13 @@ class RecorderModel extends widgets.DOMWidgetModel {
       format: "webm",
       codecs: "",
       recording: false,
+      timeslice: null,
+      replay_duration: null,
+      adaptive: false,
+      bitrate: null,
+      throughput: null,
+      metrics: false,
+      _encoding: {},
       _data_src: "",
     };
   }
@@ -486,15 +803,277 @@ class RecorderModel extends widgets.DOMWidgetModel {
     this.on("msg:custom", this.handleCustomMessage, this);
     this.on("change:recording", this.updateRecord, this);
 
+    this.metrics = new Metrics(this);
     this.mediaRecorder = null;
     this.chunks = [];
     this.stopping = null;
+    // when streaming, chunks are sent in order by chaining on this promise
+    this.chunkSending = Promise.resolve();
+    this.chunkCount = 0;
+    this.recordingStreamed = false;
+    // in replay mode, the recorder and buffer we use, and the previous ones
+    // while the current buffer is too short, see restartReplay
+    this.recordingReplayed = false;
+    this.replay = null;
+    this.replayPrevious = null;
+    // the (cloned) video tracks we record, see constrainStream
+    this.recordedTracks = [];
+    this.trackSettings = [];
+    this.resetAdaptive();
+    this.congested = false;
+    // when the last recording started and stopped (see eventTime), null when
+    // it did not, for RecorderGroupModel
+    this.started = Promise.resolve(null);
+    this.stopped = Promise.resolve(null);
+    this.resolveStarted = null;
+  }
+
+  resetAdaptive() {
+    // quality scales the frame rate and resolution, and is lowered when the
+    // kernel cannot keep up with the chunks (only in adaptive mode)
+    this.quality = 1;
+    this.bytesSent = 0;
+    this.bytesAcked = 0;
+    this.acks = [];
+    this.lastAdapted = performance.now();
+    this.lastThroughputSync = 0;
+  }
+
+  get streaming() {
+    const timeslice = this.get("timeslice");
+    return timeslice !== null && timeslice !== undefined && !this.replaying;
+  }
+
+  get replaying() {
+    const duration = this.get("replay_duration");
+    return duration !== null && duration !== undefined;
+  }
+
+  startReplay(stream, options) {
+    // each recorder gets its own buffer, so a restart starts a new file
+    const buffer = new ReplayBuffer(this.get("replay_duration") * 1000);
+    const recorder = new MediaRecorder(stream, options);
+    const replay = {
+      buffer: buffer,
+      recorder: recorder,
+      stream: stream,
+      options: options,
+      pushing: Promise.resolve(),
+    };
+    recorder.ondataavailable = (event) => {
+      replay.pushing = replay.pushing
+        .then(() => event.data.arrayBuffer())
+        .then((data) => {
+          buffer.push(new Uint8Array(data));
+          if (replay !== this.replay || !this.get("recording")) {
+            return;
+          }
+          if (this.replayPrevious && buffer.span >= buffer.duration) {
+            this.replayPrevious = null;
+          }
+          if (buffer.stale) {
+            this.restartReplay();
+          }
+        })
+        .catch((error) => {
+          console.error("Could not buffer the recording", error);
+        });
+    };
+    eventTime(recorder, "start").then(this.resolveStarted);
+    // small slices, so the buffer is never far behind
+    recorder.start(500);
+    this.mediaRecorder = recorder;
+    this.replay = replay;
+  }
+
+  restartReplay() {
+    // the browser makes no new keyframes, so we cannot trim the buffer, a new
+    // recorder starts with a keyframe, we keep the previous buffer till the
+    // new one is long enough
+    const previous = this.replay;
+    this.startReplay(previous.stream, previous.options);
+    this.replayPrevious = previous;
+    previous.recorder.stop();
+  }
+
+  async replayParts() {
+    let replay = this.replay;
+    await replay.pushing;
+    if (this.replayPrevious && replay.buffer.span < replay.buffer.duration) {
+      replay = this.replayPrevious;
+      await replay.pushing;
+    }
+    return replay.buffer.parts();
+  }
+
+  async dumpReplay(id) {
+    if (!this.replay || !this.get("recording")) {
+      throw new Error("Not recording with a replay_duration");
+    }
+    const start = performance.now();
+    const parts = await this.replayParts();
+    if (parts.length === 0) {
+      throw new Error("Nothing recorded yet");
+    }
+    const blob = new Blob(parts, { type: this.mimeType });
+    const bytes = new Uint8Array(await blob.arrayBuffer());
+    this.metrics.record("replay_dump", {
+      duration: performance.now() - start,
+      bytes: bytes.length,
+    });
+    this.send({ msg: "replay", id: id }, null, [bytes.buffer]);
+  }
+
+  sendChunk(blob) {
+    // we do not keep the chunk around, so memory usage stays bounded
+    const index = this.chunkCount++;
+    const time = Date.now();
+    this.chunkSending = this.chunkSending
+      .then(() =>
+        this.metrics.measure("blob_to_bytes", utils.blobToBytes(blob), {
+          seq: index,
+          bytes: blob.size,
+        }),
+      )
+      .then((bytes) => {
+        this.bytesSent += bytes.length;
+        const msg = { msg: "chunk", index: index, time: time };
+        this.send(msg, null, [bytes.buffer]);
+      });
+    return this.chunkSending;
   }
 
   handleCustomMessage(content) {
     if (content.msg === "download") {
       this.download();
+    } else if (content.msg === "chunk_ack") {
+      this.chunkAcknowledged(content.size);
+    } else if (content.msg === "replay_dump") {
+      this.dumpReplay(content.id).catch((error) => {
+        this.send({ msg: "replay", id: content.id, error: error.message });
+      });
+    }
+  }
+
+  chunkAcknowledged(size) {
+    const now = performance.now();
+    const span = 5000;
+    this.bytesAcked += size;
+    this.acks.push({ time: now, size: size });
+    while (this.acks[0].time < now - span) {
+      this.acks.shift();
+    }
+    const elapsed = Math.max(now - this.acks[0].time, this.get("timeslice"));
+    const bytes = this.acks.reduce((total, ack) => total + ack.size, 0);
+    this.measuredThroughput = (bytes * 1000) / elapsed;
+    if (now - this.lastThroughputSync > 1000) {
+      this.lastThroughputSync = now;
+      this.set("throughput", this.measuredThroughput);
+      this.save_changes();
+    }
+    this.adapt();
+  }
+
+  adapt() {
+    // how far (in ms) the kernel is behind at the measured throughput
+    const now = performance.now();
+    const timeslice = this.get("timeslice");
+    const backlog = this.bytesSent - this.bytesAcked;
+    const behind = (backlog * 1000) / this.measuredThroughput;
+    const minQuality = 0.25;
+    const step = 0.75;
+    if (!this.get("adaptive") || now - this.lastAdapted < 2 * timeslice) {
+      return;
+    }
+    if (behind > 2 * timeslice && this.quality > minQuality) {
+      this.quality = Math.max(minQuality, this.quality * step);
+      this.congested = true;
+    } else if (behind < timeslice / 2 && this.quality < 1) {
+      this.quality = Math.min(1, this.quality / step);
+    } else {
+      return;
     }
+    this.lastAdapted = now;
+    this.applyQuality();
+  }
+
+  nextBitrate(encoding) {
+    // if the last recording could not keep up, we pick a bitrate that fits
+    // in the measured throughput (leaving some room)
+    const bitrate = encoding.video_bitrate;
+    if (!this.get("adaptive") || !this.congested) {
+      return bitrate;
+    }
+    const minBitrate = 100000;
+    const fits = 0.8 * this.measuredThroughput * 8 - encoding.audio_bitrate;
+    return Math.round(Math.min(bitrate, Math.max(minBitrate, fits)));
+  }
+
+  constrainStream(stream, encoding) {
+    // we record clones of the video tracks, so that the limits of the profile
+    // do not affect other users of the stream, without limits (and adaptive
+    // quality) we record the stream itself
+    const limited =
+      encoding.max_width || encoding.max_height || encoding.max_fps;
+    if (!limited && !this.get("adaptive")) {
+      return Promise.resolve(stream);
+    }
+    this.recordedTracks = stream.getVideoTracks().map((track) => track.clone());
+    this.trackSettings = this.recordedTracks.map((track) =>
+      track.getSettings(),
+    );
+    return this.applyQuality().then(
+      () =>
+        new MediaStream([...stream.getAudioTracks(), ...this.recordedTracks]),
+    );
+  }
+
+  applyQuality() {
+    const encoding = this.get("_encoding");
+    const quality = this.quality;
+    const constrain = (track, settings) => {
+      const constraints = {};
+      if (settings.width && settings.height) {
+        const scale = Math.min(
+          1,
+          (encoding.max_width || Infinity) / settings.width,
+          (encoding.max_height || Infinity) / settings.height,
+        );
+        if (scale * quality < 1) {
+          constraints.width = {
+            max: Math.round(settings.width * scale * quality),
+          };
+          constraints.height = {
+            max: Math.round(settings.height * scale * quality),
+          };
+        }
+      }
+      const fps = Math.min(
+        settings.frameRate || Infinity,
+        encoding.max_fps || Infinity,
+      );
+      if (fps !== Infinity && (fps !== settings.frameRate || quality < 1)) {
+        constraints.frameRate = { max: fps * quality };
+      }
+      if (Object.keys(constraints).length === 0) {
+        return Promise.resolve();
+      }
+      return track.applyConstraints(constraints).catch((error) => {
+        // e.g. canvas tracks do not support all constraints
+        console.warn("Could not limit the recorded video track", error);
+      });
+    };
+    return Promise.all(
+      this.recordedTracks.map((track, i) =>
+        constrain(track, this.trackSettings[i]),
+      ),
+    );
+  }
+
+  stopRecordedTracks() {
+    this.recordedTracks.forEach((track) => track.stop());
+    this.recordedTracks = [];
+    this.trackSettings = [];
   }
 
   get mimeType() {
@@ -521,21 +1100,86 @@ class RecorderModel extends widgets.DOMWidgetModel {
 
     if (this.get("recording")) {
       this.chunks = [];
+      this.chunkCount = 0;
+      const streaming = (this.recordingStreamed = this.streaming);
+      const replaying = (this.recordingReplayed = this.replaying);
+      const encoding = this.get("_encoding");
+      const bitrate = this.nextBitrate(encoding);
+      this.resetAdaptive();
+      this.congested = false;
+      this.started = new Promise((resolve) => {
+        this.resolveStarted = resolve;
+      });
 
-      captureStream(source).then((stream) => {
-        this.mediaRecorder = new MediaRecorder(stream, {
-          audioBitsPerSecond: 128000,
-          videoBitsPerSecond: 2500000,
-          mimeType: mimeType,
+      captureStream(source)
+        .then((stream) => this.constrainStream(stream, encoding))
+        .then((stream) => {
+          const options = {
+            audioBitsPerSecond: encoding.audio_bitrate,
+            videoBitsPerSecond: bitrate,
+            mimeType: mimeType,
+          };
+          if (encoding.keyframe_interval) {
+            // not supported by all browsers, in which case it is ignored
+            options.videoKeyFrameIntervalDuration = encoding.keyframe_interval;
+          } else if (replaying) {
+            // we can only trim the buffer at keyframes
+            options.videoKeyFrameIntervalDuration = Math.min(
+              2000,
+              this.get("replay_duration") * 250,
+            );
+          }
+          this.set("bitrate", bitrate);
+          this.save_changes();
+          if (replaying) {
+            this.startReplay(stream, options);
+            return;
+          }
+          this.mediaRecorder = new MediaRecorder(stream, options);
+          eventTime(this.mediaRecorder, "start").then(this.resolveStarted);
+          this.mediaRecorder.ondataavailable = (event) => {
+            if (streaming) {
+              this.sendChunk(event.data);
+            } else {
+              this.chunks.push(event.data);
+            }
+          };
+          if (streaming) {
+            this.mediaRecorder.start(this.get("timeslice"));
+          } else {
+            this.mediaRecorder.start();
+          }
+        })
+        .catch((error) => {
+          this.stopRecordedTracks();
+          this.resolveStarted(null);
+          throw error;
         });
-        this.mediaRecorder.start();
-        this.mediaRecorder.ondataavailable = (event) => {
-          this.chunks.push(event.data);
+    } else if (this.recordingStreamed) {
+      this.stopping = new Promise((resolve, reject) => {
+        this.mediaRecorder.onstop = (e) => {
+          this.stopRecordedTracks();
+          // the last chunk is available before onstop is called
+          this.chunkSending.then(() => {
+            this.send({ msg: "chunk_end", chunks: this.chunkCount });
+            resolve();
+          });
         };
       });
+      this.stopping.then(() => {
+        this.stopping = null;
+      });
+      this.stopped = eventTime(this.mediaRecorder, "stop");
+      this.mediaRecorder.stop();
     } else {
       this.stopping = new Promise((resolve, reject) => {
-        this.mediaRecorder.onstop = (e) => {
+        this.mediaRecorder.onstop = async (e) => {
+          this.stopRecordedTracks();
+          if (this.recordingReplayed) {
+            // the recording is what is in the replay buffer
+            this.chunks = await this.replayParts();
+            this.replay = this.replayPrevious = null;
+          }
           if (this.get("_data_src") !== "") {
             URL.revokeObjectURL(this.get("_data_src"));
           }
@@ -543,10 +1187,15 @@ class RecorderModel extends widgets.DOMWidgetModel {
           this.set("_data_src", window.URL.createObjectURL(blob));
           this.save_changes();
 
+          const start = performance.now();
           const reader = new FileReader();
           reader.readAsArrayBuffer(blob);
           reader.onloadend = () => {
             const bytes = new Uint8Array(reader.result);
+            this.metrics.record("blob_to_bytes", {
+              duration: performance.now() - start,
+              bytes: bytes.length,
+            });
             this.get(this.type).set("value", new DataView(bytes.buffer));
             this.get(this.type).save_changes();
             resolve();
@@ -556,11 +1205,15 @@ class RecorderModel extends widgets.DOMWidgetModel {
       this.stopping.then(() => {
         this.stopping = null;
       });
+      this.stopped = eventTime(this.mediaRecorder, "stop");
       this.mediaRecorder.stop();
     }
   }
 
   download() {
+    if (this.recordingStreamed) {
+      throw new Error("The recording was streamed to the kernel, use save()");
+    }
     if (this.chunks.length === 0) {
       if (this.stopping === null) {
         throw new Error("Nothing to download");
@@ -583,6 +1236,7 @@ class RecorderModel extends widgets.DOMWidgetModel {
     if (this.get("_data_src") !== "") {
       URL.revokeObjectURL(this.get("_data_src"));
     }
+    this.stopRecordedTracks();
     return super.close.apply(this, arguments);
   }
 }
@@ -644,6 +1298,12 @@ class RecorderView extends widgets.DOMWidgetView {
   }
 }
 
+// in motion mode, frames are compared at this width (the height follows the
+// aspect ratio of the region of interest)
+const motionWidth = 64;
+// without changes, the score is sent at most once per this many milliseconds
+const motionReportInterval = 1000;
+
 export class ImageRecorderModel extends RecorderModel {
   defaults() {
     return {
@@ -653,6 +1313,19 @@ export class ImageRecorderModel extends RecorderModel {
       image: null,
       _height: "",
       _width: "",
+      raw_frames: false,
+      raw_fps: 10,
+      raw_format: "rgba",
+      raw_scale: 1,
+      max_width: null,
+      max_height: null,
+      crop: null,
+      grayscale: false,
+      quality: null,
+      motion: false,
+      motion_fps: 2,
+      motion_threshold: 0.01,
+      motion_roi: null,
     };
   }
 
@@ -661,33 +1334,83 @@ export class ImageRecorderModel extends RecorderModel {
     window.last_image_recorder = this;
 
     this.type = "image";
+    this.snapshotCount = 0;
+    this.videoPromise = null;
+    this.rawCapturing = false;
+    this.motionCapturing = false;
+    this.on("change:stream", this.resetVideo, this);
+    this.on("change:raw_frames", this.updateRawFrames, this);
+    this.on("change:motion", this.updateMotion, this);
+    this.updateRawFrames();
+    this.updateMotion();
+  }
+
+  getVideo() {
+    // creating a video element and waiting for it to play is slow, so we reuse it
+    if (!this.videoPromise) {
+      this.videoPromise = (async () => {
+        const mediaStream = await captureStream(this.get("stream"));
+        // turn the mediastream into a video element
+        const video = document.createElement("video");
+        video.muted = true;
+        video.srcObject = mediaStream;
+        video.play();
+        await utils.onCanPlay(video);
+        await utils.onLoadedMetaData(video);
+        return video;
+      })();
+      this.videoPromise.catch(() => {
+        this.videoPromise = null;
+      });
+    }
+    return this.videoPromise;
+  }
+
+  resetVideo() {
+    if (this.videoPromise) {
+      this.videoPromise.then((video) => {
+        video.pause();
+        video.srcObject = null;
+      });
+      this.videoPromise = null;
+    }
   }
 
   async snapshot() {
     const mimeType = this.type + "/" + this.get("format");
-    const mediaStream = await captureStream(this.get("stream"));
-    // turn the mediastream into a video element
-    let video = document.createElement("video");
-    video.srcObject = mediaStream;
-    video.play();
-    await utils.onCanPlay(video);
-    await utils.onLoadedMetaData(video);
+    const seq = this.snapshotCount++;
+    const video = await this.metrics.measure("video_ready", this.getVideo(), {
+      seq: seq,
+    });
     // and the video element can be drawn onto a canvas
-    let canvas = document.createElement("canvas");
-    let context = canvas.getContext("2d");
-    let height = video.videoHeight;
-    let width = video.videoWidth;
-    canvas.height = height;
-    canvas.width = width;
-    context.drawImage(video, 0, 0, canvas.width, canvas.height);
+    const start = performance.now();
+    const canvas = document.createElement("canvas");
+    const context = canvas.getContext("2d", {
+      willReadFrequently: this.get("grayscale"),
+    });
+    this.drawOutput(video, this.outputRegion(video), canvas, context);
+    const height = canvas.height;
+    const width = canvas.width;
+    this.metrics.record("draw", {
+      duration: performance.now() - start,
+      seq: seq,
+    });
 
     // from the canvas we can get the underlying encoded data
     // TODO: check support for toBlob, or find a polyfill
-    const blob = await utils.canvasToBlob(canvas, mimeType);
+    const blob = await this.metrics.measure(
+      "encode",
+      this.encodeCanvas(canvas, mimeType),
+      { seq: seq },
+    );
     this.set("_data_src", window.URL.createObjectURL(blob));
     this._last_blob = blob;
 
-    const bytes = await utils.blobToBytes(blob);
+    const bytes = await this.metrics.measure(
+      "blob_to_bytes",
+      utils.blobToBytes(blob),
+      { seq: seq, bytes: blob.size },
+    );
 
     this.get(this.type).set("value", new DataView(bytes.buffer));
     this.get(this.type).save_changes();
@@ -697,6 +1420,325 @@ export class ImageRecorderModel extends RecorderModel {
     this.save_changes();
   }
 
+  // the region of the frame we encode (see crop), and the size of the image,
+  // scaled down to fit max_width and max_height
+  outputRegion(video) {
+    const [x, y, width, height] = this.get("crop") || [0, 0, 1, 1];
+    const region = {
+      x: x * video.videoWidth,
+      y: y * video.videoHeight,
+      sourceWidth: Math.max(1, width * video.videoWidth),
+      sourceHeight: Math.max(1, height * video.videoHeight),
+    };
+    let scale = 1;
+    if (this.get("max_width")) {
+      scale = Math.min(scale, this.get("max_width") / region.sourceWidth);
+    }
+    if (this.get("max_height")) {
+      scale = Math.min(scale, this.get("max_height") / region.sourceHeight);
+    }
+    region.width = Math.max(1, Math.round(region.sourceWidth * scale));
+    region.height = Math.max(1, Math.round(region.sourceHeight * scale));
+    return region;
+  }
+
+  // draws the region of a frame (a video, or an ImageBitmap of it), in gray
+  // when grayscale is set
+  drawOutput(frame, region, canvas, context) {
+    if (canvas.width !== region.width || canvas.height !== region.height) {
+      canvas.width = region.width;
+      canvas.height = region.height;
+    }
+    context.drawImage(
+      frame,
+      region.x,
+      region.y,
+      region.sourceWidth,
+      region.sourceHeight,
+      0,
+      0,
+      region.width,
+      region.height,
+    );
+    if (this.get("grayscale")) {
+      const image = context.getImageData(0, 0, region.width, region.height);
+      const data = image.data;
+      const gray = utils.rgbaToGray(data);
+      for (let i = 0; i < gray.length; i++) {
+        data[4 * i] = data[4 * i + 1] = data[4 * i + 2] = gray[i];
+      }
+      context.putImageData(image, 0, 0);
+    }
+  }
+
+  encodeCanvas(canvas, mimeType) {
+    const quality = this.get("quality");
+    return utils.canvasToBlob(
+      canvas,
+      mimeType,
+      quality === null ? undefined : quality,
+    );
+  }
+
+  updateRawFrames() {
+    this.captureRawFrames().catch((error) =>
+      console.error("Raw frame capture failed", error),
+    );
+  }
+
+  async captureRawFrames() {
+    if (!this.get("raw_frames") || this.rawCapturing) {
+      return;
+    }
+    if (!this.get("stream")) {
+      throw new Error("No stream specified");
+    }
+    this.rawCapturing = true;
+    try {
+      const video = await this.getVideo();
+      const canvas = document.createElement("canvas");
+      const context = canvas.getContext("2d", { willReadFrequently: true });
+      let index = 0;
+      while (this.get("raw_frames") && !this._closed) {
+        const start = performance.now();
+        this.sendRawFrame(video, canvas, context, index++);
+        const waitingTime =
+          1000 / this.get("raw_fps") - (performance.now() - start);
+        await new Promise((resolve) =>
+          setTimeout(resolve, Math.max(0, waitingTime)),
+        );
+      }
+    } finally {
+      this.rawCapturing = false;
+    }
+  }
+
+  rawFrameSize(video) {
+    const scale = this.get("raw_scale");
+    return {
+      width: Math.max(1, Math.round(video.videoWidth * scale)),
+      height: Math.max(1, Math.round(video.videoHeight * scale)),
+    };
+  }
+
+  // size defaults to the current size of the video, a burst passes the same
+  // size for all its frames, in case the video changes size
+  grabRawFrame(video, canvas, context, size = this.rawFrameSize(video)) {
+    const { width, height } = size;
+    if (canvas.width !== width || canvas.height !== height) {
+      canvas.width = width;
+      canvas.height = height;
+    }
+    context.drawImage(video, 0, 0, width, height);
+    let data = context.getImageData(0, 0, width, height).data;
+    let channels = 4;
+    if (this.get("raw_format") === "gray") {
+      data = utils.rgbaToGray(data);
+      channels = 1;
+    }
+    return { data: data, width: width, height: height, channels: channels };
+  }
+
+  sendRawFrame(video, canvas, context, index) {
+    const time = Date.now();
+    const start = performance.now();
+    const frame = this.grabRawFrame(video, canvas, context);
+    this.metrics.record("grab", {
+      duration: performance.now() - start,
+      bytes: frame.data.length,
+      seq: index,
+      time: time,
+    });
+    const msg = {
+      msg: "frame",
+      index: index,
+      width: frame.width,
+      height: frame.height,
+      channels: frame.channels,
+      time: time,
+    };
+    this.send(msg, null, [frame.data.buffer]);
+  }
+
+  updateMotion() {
+    this.captureMotion().catch((error) =>
+      console.error("Motion detection failed", error),
+    );
+  }
+
+  async captureMotion() {
+    if (!this.get("motion") || this.motionCapturing) {
+      return;
+    }
+    if (!this.get("stream")) {
+      throw new Error("No stream specified");
+    }
+    this.motionCapturing = true;
+    try {
+      const video = await this.getVideo();
+      const canvas = document.createElement("canvas");
+      const context = canvas.getContext("2d", { willReadFrequently: true });
+      // the gray pixels of the last frame we sent, the first frame is always
+      // sent
+      let reference = null;
+      let lastReport = 0;
+      let index = 0;
+      while (this.get("motion") && !this._closed) {
+        const start = performance.now();
+        const time = Date.now();
+        const gray = this.grabMotionFrame(video, canvas, context);
+        const score =
+          reference === null || reference.length !== gray.length
+            ? 1
+            : utils.motionScore(reference, gray);
+        this.metrics.record("motion_compare", {
+          duration: performance.now() - start,
+          seq: index,
+          time: time,
+        });
+        if (score > this.get("motion_threshold")) {
+          reference = gray;
+          await this.sendMotionFrame(video, score, time, index);
+          lastReport = performance.now();
+        } else if (performance.now() - lastReport >= motionReportInterval) {
+          this.send({
+            msg: "motion",
+            score: score,
+            time: time,
+            changed: false,
+          });
+          lastReport = performance.now();
+        }
+        index++;
+        const waitingTime =
+          1000 / this.get("motion_fps") - (performance.now() - start);
+        await new Promise((resolve) =>
+          setTimeout(resolve, Math.max(0, waitingTime)),
+        );
+      }
+    } finally {
+      this.motionCapturing = false;
+    }
+  }
+
+  grabMotionFrame(video, canvas, context) {
+    // the region of interest, downsampled, in gray
+    const [x, y, width, height] = this.get("motion_roi") || [0, 0, 1, 1];
+    const sourceWidth = Math.max(1, width * video.videoWidth);
+    const sourceHeight = Math.max(1, height * video.videoHeight);
+    const targetWidth = Math.min(motionWidth, Math.round(sourceWidth));
+    const targetHeight = Math.max(
+      1,
+      Math.round((targetWidth * sourceHeight) / sourceWidth),
+    );
+    if (canvas.width !== targetWidth || canvas.height !== targetHeight) {
+      canvas.width = targetWidth;
+      canvas.height = targetHeight;
+    }
+    context.drawImage(
+      video,
+      x * video.videoWidth,
+      y * video.videoHeight,
+      sourceWidth,
+      sourceHeight,
+      0,
+      0,
+      targetWidth,
+      targetHeight,
+    );
+    const data = context.getImageData(0, 0, targetWidth, targetHeight).data;
+    return utils.rgbaToGray(data);
+  }
+
+  async sendMotionFrame(video, score, time, index) {
+    // the whole frame (not the region of interest), encoded like a snapshot
+    const mimeType = this.type + "/" + this.get("format");
+    const canvas = document.createElement("canvas");
+    const context = canvas.getContext("2d", {
+      willReadFrequently: this.get("grayscale"),
+    });
+    this.drawOutput(video, this.outputRegion(video), canvas, context);
+    const bytes = await this.metrics.measure(
+      "encode",
+      this.encodeCanvas(canvas, mimeType).then(utils.blobToBytes),
+      { seq: index, time: time },
+    );
+    // the image arrives in the kernel before the message
+    this.get(this.type).set("value", new DataView(bytes.buffer));
+    this.get(this.type).save_changes();
+    this.set("_height", canvas.height.toString() + "px");
+    this.set("_width", canvas.width.toString() + "px");
+    this.save_changes();
+    this.send({ msg: "motion", score: score, time: time, changed: true });
+  }
+
+  handleCustomMessage(content) {
+    if (content.msg === "burst") {
+      this.burst(content).catch((error) => {
+        this.send({ msg: "burst", id: content.id, error: error.message });
+      });
+    } else {
+      super.handleCustomMessage(content);
+    }
+  }
+
+  async burst({ id, count, interval, raw }) {
+    // capture all frames first, and encode and send them together afterwards
+    const video = await this.getVideo();
+    const canvas = document.createElement("canvas");
+    const context = canvas.getContext("2d", {
+      willReadFrequently: raw || this.get("grayscale"),
+    });
+    const frames = [];
+    const times = [];
+    const frameSize = this.rawFrameSize(video);
+    const start = performance.now();
+    for (let i = 0; i < count; i++) {
+      const waitingTime = start + i * interval - performance.now();
+      if (waitingTime > 0) {
+        await new Promise((resolve) => setTimeout(resolve, waitingTime));
+      }
+      times.push(Date.now());
+      if (raw) {
+        frames.push(this.grabRawFrame(video, canvas, context, frameSize).data);
+      } else {
+        frames.push(await createImageBitmap(video));
+      }
+    }
+    this.metrics.record("burst_capture", {
+      duration: performance.now() - start,
+      time: times[0],
+    });
+    const msg = { msg: "burst", id: id, count: count, times: times, raw: raw };
+    if (raw) {
+      msg.width = frameSize.width;
+      msg.height = frameSize.height;
+      msg.channels = frames[0].length / (frameSize.width * frameSize.height);
+    } else {
+      const mimeType = this.type + "/" + this.get("format");
+      const region = this.outputRegion(video);
+      for (let i = 0; i < count; i++) {
+        this.drawOutput(frames[i], region, canvas, context);
+        frames[i].close();
+        frames[i] = await this.metrics.measure(
+          "encode",
+          this.encodeCanvas(canvas, mimeType).then(utils.blobToBytes),
+          { seq: i, time: times[i] },
+        );
+      }
+      msg.sizes = frames.map((frame) => frame.length);
+    }
+    // pack all frames in a single buffer
+    const size = frames.reduce((total, frame) => total + frame.length, 0);
+    const buffer = new Uint8Array(size);
+    let offset = 0;
+    for (const frame of frames) {
+      buffer.set(frame, offset);
+      offset += frame.length;
+    }
+    this.send(msg, null, [buffer.buffer]);
+  }
+
   updateRecord() {
     const source = this.get("stream");
     if (!source) {
@@ -717,6 +1759,11 @@ export class ImageRecorderModel extends RecorderModel {
     }
     utils.downloadBlob(this._last_blob, filename);
   }
+
+  close() {
+    this.resetVideo();
+    return super.close.apply(this, arguments);
+  }
 }
 
 ImageRecorderModel.serializers = {
@@ -770,6 +1817,11 @@ export class AudioRecorderModel extends RecorderModel {
       _model_name: "AudioRecorderModel",
       _view_name: "AudioRecorderView",
       audio: null,
+      pcm: false,
+      pcm_sample_rate: 16000,
+      pcm_dtype: "float32",
+      pcm_channels: 1,
+      pcm_chunk_duration: 0.1,
     };
   }
 
@@ -778,6 +1830,85 @@ export class AudioRecorderModel extends RecorderModel {
     window.last_audio_recorder = this;
 
     this.type = "audio";
+    this.pcmCapture = null;
+    // restarts are chained, so captures do not overlap
+    this.pcmUpdating = Promise.resolve();
+    this.on(
+      "change:pcm change:stream change:pcm_sample_rate change:pcm_dtype " +
+        "change:pcm_channels change:pcm_chunk_duration",
+      this.updatePCM,
+      this,
+    );
+    this.updatePCM();
+  }
+
+  updatePCM() {
+    this.pcmUpdating = this.pcmUpdating
+      .then(() => this.restartPCM())
+      .catch((error) => console.error("PCM capture failed", error));
+  }
+
+  async restartPCM() {
+    if (this.pcmCapture) {
+      const capture = this.pcmCapture;
+      this.pcmCapture = null;
+      await capture.stop();
+    }
+    if (!this.get("pcm") || this._closed) {
+      return;
+    }
+    const source = this.get("stream");
+    if (!source) {
+      throw new Error("No stream specified");
+    }
+    const stream = await captureStream(source);
+    const settings = {
+      rate: this.get("pcm_sample_rate"),
+      channels: this.get("pcm_channels"),
+      dtype: this.get("pcm_dtype"),
+    };
+    settings.chunkSize = Math.max(
+      1,
+      Math.round(settings.rate * this.get("pcm_chunk_duration")),
+    );
+    let index = 0;
+    this.pcmCapture = await capturePCM(
+      stream,
+      settings,
+      (samples, time, offset) => {
+        if (this._closed) {
+          return;
+        }
+        this.metrics.record("pcm", {
+          bytes: samples.byteLength,
+          seq: index,
+          time: time,
+        });
+        const msg = {
+          msg: "pcm",
+          index: index++,
+          offset: offset,
+          time: time,
+          sample_rate: settings.rate,
+          channels: settings.channels,
+          dtype: settings.dtype,
+        };
+        this.send(msg, null, [samples]);
+      },
+    );
+    if (this._closed) {
+      // closed while starting
+      this.pcmCapture.stop();
+      this.pcmCapture = null;
+    }
+  }
+
+  close() {
+    if (this.pcmCapture) {
+      this.pcmCapture.stop();
+      this.pcmCapture = null;
+    }
+    return super.close.apply(this, arguments);
   }
 }
 
@@ -794,6 +1925,63 @@ export class AudioRecorderView extends RecorderView {
   }
 }
 
+export class RecorderGroupModel extends widgets.DOMWidgetModel {
+  defaults() {
+    return {
+      ...super.defaults(),
+      _model_name: "RecorderGroupModel",
+      _model_module: "jupyter-webrtc",
+      _model_module_version: semver_range,
+      _view_module_version: semver_range,
+      recorders: [],
+      recording: false,
+      start_time: null,
+      offsets: [],
+      stop_offsets: [],
+    };
+  }
+
+  initialize() {
+    super.initialize.apply(this, arguments);
+    this.on("change:recording", this.updateRecording, this);
+  }
+
+  updateRecording() {
+    const recording = this.get("recording");
+    const recorders = this.get("recorders");
+    const now = performance.timeOrigin + performance.now();
+    // all recorders start (or stop) in this task, so they start at (nearly)
+    // the same time, we measure when they actually did
+    const times = recorders.map((recorder) => {
+      try {
+        recorder.set("recording", recording);
+        return recording ? recorder.started : recorder.stopped;
+      } catch (error) {
+        console.error("Could not start or stop a recorder of the group", error);
+        return null;
+      }
+    });
+    recorders.forEach((recorder) => recorder.save_changes());
+    if (recording) {
+      this.set({ start_time: now / 1000, offsets: [], stop_offsets: [] });
+      this.save_changes();
+    }
+    const start = (this.get("start_time") || now / 1000) * 1000;
+    Promise.all(times).then((times) => {
+      const offsets = times.map((time) =>
+        time === null ? null : (time - start) / 1000,
+      );
+      this.set(recording ? "offsets" : "stop_offsets", offsets);
+      this.save_changes();
+    });
+  }
+}
+
+RecorderGroupModel.serializers = {
+  ...widgets.DOMWidgetModel.serializers,
+  recorders: { deserialize: widgets.unpack_models },
+};
+
 export class WebRTCRoomModel extends widgets.DOMWidgetModel {
   defaults() {
     return {
@@ -810,6 +1998,10 @@ export class WebRTCRoomModel extends widgets.DOMWidgetModel {
       nickname: "anonymous",
       peers: [],
       streams: [],
+      topology: "mesh",
+      hub: false,
+      layers: {},
+      default_layer: null,
     };
   }
   log() {
@@ -823,6 +2015,12 @@ export class WebRTCRoomModel extends widgets.DOMWidgetModel {
     this.room_id = this.get("room_id");
     this.room = this.get("room");
     this.peers = {}; // room_id (string) to WebRTCPeerModel
+    // for the hub topology: the room_ids of the hubs we know, the hub we are
+    // connected to (when we are not a hub), and the streams we relay (when we
+    // are a hub) as a list of {source: room_id, stream: MediaStream}
+    this.hubs = new Set();
+    this.hub_id = null;
+    this.relayed = [];
     window["last_webrtc_room_" + this.room_id] = this;
     const stream = this.get("stream");
     if (stream) {
@@ -855,12 +2053,17 @@ export class WebRTCRoomModel extends widgets.DOMWidgetModel {
           stream_local: this.get("stream"),
           id_local: this.get("room_id"),
           id_remote: from_id,
+          layers: this.get("layers"),
+          layer: this.get("default_layer"),
         },
       )
       .then((peer) => {
         peer.peer_msg_send = (msg) => {
           msg.room_id = this.get("room_id");
           msg.to = from_id;
+          if (this.is_hub) {
+            msg.hub = true;
+          }
           this.log("send to peer", msg);
           //console.log('sending to room', msg, from_id);
           peer.save_changes();
@@ -869,18 +2072,87 @@ export class WebRTCRoomModel extends widgets.DOMWidgetModel {
         return peer;
       });
   }
-  listen_to_remote_stream(peer) {
-    peer.on(
-      "change:stream_remote",
-      _.once(() => {
-        this.log("add remote stream");
-        const streams = this.get("streams").slice();
-        const stream = peer.get("stream_remote");
-        streams.push(stream);
-        this.set("streams", streams);
-        this.save_changes();
-      }),
+  join_msg() {
+    return { type: "join", room_id: this.get("room_id"), hub: this.is_hub };
+  }
+  get is_hub() {
+    return this.get("topology") === "hub" && this.get("hub");
+  }
+  connects_to(msg) {
+    // whether we connect with a participant that joined
+    if (this.get("topology") !== "hub") {
+      return true; // full mesh
+    }
+    if (this.is_hub) {
+      // hubs connect with each other, other participants connect with us
+      // after our announcement
+      return Boolean(msg.hub);
+    }
+    return Boolean(msg.hub) && this.hub_id === null;
+  }
+  relays_to(source_id, target_id) {
+    // a hub relays streams to all its peers, but streams from other hubs only
+    // to the participants connected to us (they relay to their own)
+    return (
+      source_id !== target_id &&
+      !(this.hubs.has(source_id) && this.hubs.has(target_id))
     );
+  }
+  relay(source_id, stream) {
+    this.relayed.push({ source: source_id, stream: stream });
+    _.each(this.peers, (peer_promise, target_id) => {
+      if (this.relays_to(source_id, target_id)) {
+        peer_promise.then((peer) => peer.relay(stream));
+      }
+    });
+  }
+  unrelay(source_id) {
+    const relayed = this.relayed.filter((item) => item.source === source_id);
+    this.relayed = _.difference(this.relayed, relayed);
+    _.each(this.peers, (peer_promise) => {
+      peer_promise.then((peer) => {
+        relayed.forEach((item) => peer.unrelay(item.stream));
+      });
+    });
+  }
+  connect_to(from_id) {
+    // we initiate the connection
+    this.peers[from_id] = this.create_peer(from_id).then((peer) => {
+      this.listen_to_remote_stream(peer);
+      peer.join().then(() => {
+        const peers = this.get("peers").slice();
+        peers.push(peer);
+        this.set("peers", peers);
+        this.save_changes();
+      });
+      return peer;
+    });
+    this.log(": added peer", from_id);
+  }
+  listen_to_remote_stream(peer) {
+    const remote_id = peer.get("id_remote");
+    if (this.is_hub) {
+      // the new peer also gets the streams we already relay
+      this.relayed.forEach((item) => {
+        if (this.relays_to(item.source, remote_id)) {
+          peer.relay(item.stream);
+        }
+      });
+    }
+    peer.on("remote_stream_added", (model, stream) => {
+      this.log("add remote stream");
+      const streams = this.get("streams").slice();
+      streams.push(model);
+      this.set("streams", streams);
+      this.save_changes();
+      if (this.is_hub) {
+        this.relay(remote_id, stream);
+      }
+    });
+    peer.on("remote_stream_removed", (model) => {
+      this.set("streams", _.without(this.get("streams"), model));
+      this.save_changes();
+    });
     peer.on("change:connected", () => {
       const connected = peer.get("connected");
       this.log(
@@ -890,10 +2162,17 @@ export class WebRTCRoomModel extends widgets.DOMWidgetModel {
         connected,
       );
       if (!connected) {
-        let streams = this.get("streams").slice();
-        const stream = peer.get("stream_remote");
-        streams = _.without(streams, stream);
+        const streams = _.difference(
+          this.get("streams"),
+          peer.remote_stream_models,
+        );
         this.set("streams", streams);
+        if (this.is_hub) {
+          this.unrelay(peer.get("id_remote"));
+        }
+        if (this.hub_id === peer.get("id_remote")) {
+          this.hub_id = null;
+        }
 
         let peers = this.get("peers").slice();
         peers = _.without(peers, peer);
@@ -909,21 +2188,47 @@ export class WebRTCRoomModel extends widgets.DOMWidgetModel {
     if (msg.room_id === this.room_id) return; // skip my own msg'es
     if (msg.type === "join") {
       this.log("join from", msg.room_id);
-      this.peers[from_id] = this.create_peer(from_id).then((peer) => {
-        this.listen_to_remote_stream(peer);
-        peer.join().then(() => {
-          const peers = this.get("peers").slice();
-          peers.push(peer);
-          this.set("peers", peers);
-          this.save_changes();
-        });
-        return peer;
-      });
-      this.log(": added peer", from_id);
+      if (msg.hub) {
+        this.hubs.add(from_id);
+      }
+      if (!this.connects_to(msg)) {
+        if (this.is_hub && !msg.hub) {
+          // the participant connects to the first hub that announces itself
+          this.room_msg_send({
+            type: "hub",
+            room_id: this.room_id,
+            to: from_id,
+          });
+        }
+        return;
+      }
+      if (this.get("topology") === "hub" && !this.is_hub) {
+        this.hub_id = from_id;
+      }
+      this.connect_to(from_id);
+    } else if (msg.type === "hub") {
+      if (msg.to !== this.room_id) {
+        return;
+      }
+      this.hubs.add(from_id);
+      if (this.hub_id === null && !this.is_hub) {
+        this.hub_id = from_id;
+        this.connect_to(from_id);
+      }
+    } else if (msg.type === "leave") {
+      this.log("leave from", from_id);
+      this.hubs.delete(from_id);
+      if (this.peers[from_id]) {
+        // closing disconnects the peer, which removes it from the room
+        this.peers[from_id].then((peer) => peer.close());
+      }
     } else if (msg.room_id) {
       if (msg.to !== this.room_id) {
         return;
       }
+      if (msg.hub) {
+        this.hubs.add(from_id);
+      }
       if (!this.peers[msg.room_id]) {
         this.peers[from_id] = this.create_peer(from_id).then((peer) => {
           this.listen_to_remote_stream(peer);
@@ -973,7 +2278,7 @@ export class WebRTCRoomLocalModel extends WebRTCRoomModel {
     const callbacks = global_rooms[room] || [];
     callbacks.push((msg) => this.on_room_msg(msg));
     global_rooms[room] = callbacks;
-    this.room_msg_send({ type: "join", room_id: this.get("room_id") });
+    this.room_msg_send(this.join_msg());
   }
   room_msg_send(msg) {
     const room = this.get("room");
@@ -1015,7 +2320,7 @@ export class WebRTCRoomMqttModel extends WebRTCRoomModel {
     this.join();
   }
   join() {
-    this.room_msg_send({ type: "join", room_id: this.get("room_id") });
+    this.room_msg_send(this.join_msg());
   }
   room_msg_send(msg) {
     const text = JSON.stringify(msg);
@@ -1024,6 +2329,108 @@ export class WebRTCRoomMqttModel extends WebRTCRoomModel {
   }
 }
 
+export class WebRTCRoomKernelModel extends WebRTCRoomModel {
+  defaults() {
+    return {
+      ...super.defaults(),
+      _model_name: "WebRTCRoomKernelModel",
+      ice_batch_interval: 50,
+    };
+  }
+  initialize() {
+    super.initialize.apply(this, arguments);
+    // messages waiting to be sent to the kernel, in order
+    this.outbox = [];
+    this.flushTimer = null;
+    this.on("change:room", this.rejoin, this);
+    window.addEventListener("beforeunload", () => this.leave());
+    this.join();
+  }
+  join() {
+    this.room_msg_send(this.join_msg());
+  }
+  leave() {
+    if (this.comm_live) {
+      this.room_msg_send({ type: "leave", room_id: this.get("room_id") });
+    }
+  }
+  rejoin() {
+    // the kernel moved our room_id to the new room, we drop the peers of the
+    // old room and announce ourselves in the new one
+    this.get("peers").forEach((peer) => peer.close());
+    this.join();
+  }
+  close() {
+    this.leave();
+    return super.close.apply(this, arguments);
+  }
+  custom_msg(content) {
+    if (content.msg === "signal") {
+      content.messages.forEach((msg) => {
+        if (msg.candidates) {
+          // a batch of trickle ICE candidates
+          msg.candidates.forEach((candidate) => {
+            this.on_room_msg({
+              room_id: msg.room_id,
+              to: msg.to,
+              candidate: candidate,
+            });
+          });
+        } else {
+          this.on_room_msg(msg);
+        }
+      });
+    } else {
+      super.custom_msg(content);
+    }
+  }
+  room_msg_send(msg) {
+    if (msg.candidate === undefined) {
+      // send right away, together with the candidates before it
+      this.outbox.push(msg);
+      this.flush();
+      return;
+    }
+    if (msg.candidate === null) {
+      return; // end of candidates, the remote peer does not need it
+    }
+    const last = this.outbox[this.outbox.length - 1];
+    if (last && last.candidates && last.to === msg.to) {
+      last.candidates.push(msg.candidate);
+    } else {
+      this.outbox.push({
+        room_id: msg.room_id,
+        to: msg.to,
+        candidates: [msg.candidate],
+      });
+    }
+    if (this.flushTimer === null) {
+      this.flushTimer = setTimeout(
+        () => this.flush(),
+        this.get("ice_batch_interval"),
+      );
+    }
+  }
+  flush() {
+    if (this.flushTimer !== null) {
+      clearTimeout(this.flushTimer);
+      this.flushTimer = null;
+    }
+    if (this.outbox.length) {
+      this.send({ msg: "signal", messages: this.outbox });
+      this.outbox = [];
+    }
+  }
+}
+
+// chunks sent over the data channel fit in a single SCTP message in all
+// browsers, same as WebRTCPeer.DATA_CHUNK_SIZE
+const dataChunkSize = 16 * 1024;
+// flow control: we stop sending when the channel buffers more than the high
+// water mark, and continue when it drained to the low water mark
+const dataChannelHighWater = 1024 * 1024;
+const dataChannelLowWater = 256 * 1024;
+
 export class WebRTCPeerModel extends widgets.DOMWidgetModel {
   defaults() {
     return {
@@ -1034,6 +2441,10 @@ export class WebRTCPeerModel extends widgets.DOMWidgetModel {
       _view_module: "jupyter-webrtc",
       _model_module_version: semver_range,
       _view_module_version: semver_range,
+      stats_interval: null,
+      data_channel_open: false,
+      layers: {},
+      layer: null,
     };
   }
   log() {
@@ -1048,7 +2459,7 @@ export class WebRTCPeerModel extends widgets.DOMWidgetModel {
       this.log(name, "got sdp");
       const sdp_remote = new RTCSessionDescription(info.sdp);
       const remote_description_set = this.pc.setRemoteDescription(sdp_remote);
-      if (!this.initiator) {
+      if (info.sdp.type === "offer") {
         console.log(
           this.get("id_local"),
           "did not initiate, reply with answer",
@@ -1091,6 +2502,27 @@ export class WebRTCPeerModel extends widgets.DOMWidgetModel {
     window["last_webrtc_" + room_id] = this;
     //this.other = null
 
+    // both sides create the data channel with the same id, so it needs no
+    // signaling of its own, and it is part of the first offer
+    this.data_channel = this.pc.createDataChannel("ipywebrtc", {
+      negotiated: true,
+      id: 0,
+    });
+    this.data_channel.binaryType = "arraybuffer";
+    this.data_channel.bufferedAmountLowThreshold = dataChannelLowWater;
+    this.data_channel.onopen = () => {
+      this.set("data_channel_open", true);
+      this.save_changes();
+    };
+    this.data_channel.onclose = () => {
+      this.set("data_channel_open", false);
+      this.save_changes();
+    };
+    this.data_channel.onmessage = (event) => this.receive_data(event.data);
+    // sends are chained, so the chunks of different messages do not interleave
+    this.data_sending = Promise.resolve();
+    this.data_incoming = null;
+
     if (this.get("stream_local")) {
       this.tracks_added = new Promise((resolve, reject) => {
         this.get("stream_local").stream.then((stream) => {
@@ -1107,7 +2539,11 @@ export class WebRTCPeerModel extends widgets.DOMWidgetModel {
       console.log("no stream");
       this.tracks_added = Promise.resolve();
     }
-    this.tracks_added.then(() => console.log("tracks added"));
+    this.tracks_added.then(() => {
+      console.log("tracks added");
+      this.apply_layer();
+    });
+    this.on("change:layer change:layers", this.apply_layer, this);
     this.pc.onicecandidate = (event) => {
       console.log(this.room_id, "onicecandidate", event.candidate);
       this.event_candidate = event;
@@ -1116,6 +2552,23 @@ export class WebRTCPeerModel extends widgets.DOMWidgetModel {
     this.pc.onopen = () => {
       console.log("onopen", name);
     };
+    // the streams we relay (for the hub topology), stream id to RTCRtpSenders
+    this.relayed = {};
+    this.remote_stream_models = [];
+    this.negotiated = false;
+    this.renegotiation_pending = false;
+    this.pc.onsignalingstatechange = () => {
+      if (this.pc.signalingState === "stable") {
+        this.negotiated = true;
+        // some browsers only have encodings after negotiation, and relayed
+        // tracks are added by renegotiation
+        this.apply_layer();
+        if (this.renegotiation_pending) {
+          this.renegotiation_pending = false;
+          this.renegotiate();
+        }
+      }
+    };
     this.pc.onaddstream = (evt) => {
       console.log("onaddstream", name);
       this.widget_manager
@@ -1134,10 +2587,24 @@ export class WebRTCPeerModel extends widgets.DOMWidgetModel {
               resolve(evt.stream);
             });
           }; // TODO: not nice to just set the method...
-          this.set("stream_remote", model);
+          // with a hub, we can receive more streams over one connection
+          if (!this.get("stream_remote")) {
+            this.set("stream_remote", model);
+          }
           //mo
           this.save_changes();
           console.log(this.room_id, ": added stream_remote");
+          this.remote_stream_models.push(model);
+          this.trigger("remote_stream_added", model, evt.stream);
+          evt.stream.addEventListener("removetrack", () => {
+            if (evt.stream.getTracks().length === 0) {
+              this.remote_stream_models = _.without(
+                this.remote_stream_models,
+                model,
+              );
+              this.trigger("remote_stream_removed", model);
+            }
+          });
           return model;
         });
     };
@@ -1179,25 +2646,177 @@ export class WebRTCPeerModel extends widgets.DOMWidgetModel {
         }, this)
         */
     this.on("msg:custom", this.custom_msg, this);
+    this.statsTimer = null;
+    this.on("change:stats_interval", this.update_stats_polling, this);
+    this.update_stats_polling();
     //this.disconnect = _.once(this.disconnect, this));
     window.addEventListener("beforeunload", () => {
       this.close();
     });
   }
-  custom_msg(content) {
+  custom_msg(content, buffers) {
     console.log("custom msg", content);
     if (content.msg === "connect") {
       this.connect();
     } else if (content.msg === "close") {
       this.close();
+    } else if (content.msg === "data_send") {
+      this.send_data(content, buffers);
     } else {
       this.disconnect();
     }
   }
+  apply_layer() {
+    // each connection encodes the video separately, so the layer only affects
+    // what this peer receives
+    const name = this.get("layer");
+    const layer = (name !== null && this.get("layers")[name]) || {};
+    const senders = this.pc
+      .getSenders()
+      .filter((sender) => sender.track && sender.track.kind === "video");
+    return Promise.all(
+      senders.map((sender) => {
+        const parameters = sender.getParameters();
+        if (!parameters.encodings || parameters.encodings.length === 0) {
+          // not negotiated yet, we apply it again when it is
+          return null;
+        }
+        parameters.encodings.forEach((encoding) => {
+          encoding.active = layer.active !== false;
+          encoding.scaleResolutionDownBy = layer.scale_resolution_down_by || 1;
+          if (layer.max_bitrate) {
+            encoding.maxBitrate = layer.max_bitrate;
+          } else {
+            delete encoding.maxBitrate;
+          }
+          if (layer.max_framerate) {
+            encoding.maxFramerate = layer.max_framerate;
+          } else {
+            delete encoding.maxFramerate;
+          }
+        });
+        return sender.setParameters(parameters).catch((e) => {
+          console.error(this.room_id, "could not set layer", name, e);
+        });
+      }),
+    );
+  }
+  send_data(content, buffers) {
+    const view = buffers[0];
+    const bytes = new Uint8Array(view.buffer, view.byteOffset, view.byteLength);
+    this.data_sending = this.data_sending.then(async () => {
+      const channel = this.data_channel;
+      try {
+        if (channel.readyState === "connecting") {
+          await this.wait_for_data_channel("open");
+        }
+        if (channel.readyState !== "open") {
+          throw new Error("the data channel is " + channel.readyState);
+        }
+        const start = performance.now();
+        // a message is a JSON header, followed by the chunks, the channel is
+        // ordered, so the receiver knows which chunks belong to it
+        channel.send(
+          JSON.stringify({ size: bytes.length, header: content.header }),
+        );
+        for (let offset = 0; offset < bytes.length; offset += dataChunkSize) {
+          if (channel.bufferedAmount > dataChannelHighWater) {
+            await this.wait_for_data_channel("bufferedamountlow");
+          }
+          channel.send(bytes.subarray(offset, offset + dataChunkSize));
+        }
+        this.send({
+          msg: "data_sent",
+          id: content.id,
+          duration: performance.now() - start,
+        });
+      } catch (e) {
+        console.error(this.room_id, "could not send data", e);
+        this.send({ msg: "data_sent", id: content.id, error: String(e) });
+      }
+    });
+  }
+  wait_for_data_channel(event) {
+    // resolves on the event, or rejects when the channel closes before it
+    const channel = this.data_channel;
+    return new Promise((resolve, reject) => {
+      const done = () => {
+        channel.removeEventListener(event, done);
+        channel.removeEventListener("close", done);
+        if (channel.readyState === "open") {
+          resolve();
+        } else {
+          reject(new Error("the data channel is " + channel.readyState));
+        }
+      };
+      channel.addEventListener(event, done);
+      channel.addEventListener("close", done);
+    });
+  }
+  receive_data(data) {
+    if (typeof data === "string") {
+      const { size, header } = JSON.parse(data);
+      this.data_incoming = {
+        header: header,
+        bytes: new Uint8Array(size),
+        offset: 0,
+      };
+    } else if (this.data_incoming) {
+      const chunk = new Uint8Array(data);
+      this.data_incoming.bytes.set(chunk, this.data_incoming.offset);
+      this.data_incoming.offset += chunk.length;
+    }
+    const incoming = this.data_incoming;
+    if (incoming && incoming.offset >= incoming.bytes.length) {
+      this.data_incoming = null;
+      this.send({ msg: "data", header: incoming.header }, null, [
+        incoming.bytes.buffer,
+      ]);
+    }
+  }
+  update_stats_polling() {
+    this.stop_stats_polling();
+    const interval = this.get("stats_interval");
+    if (interval === null || interval === undefined) {
+      return;
+    }
+    // getStats is not free, so we limit the rate
+    const minInterval = 500;
+    const delay = Math.max(minInterval, interval * 1000);
+    let previous = null;
+    // a new token stops a poll loop that is waiting for getStats
+    const token = (this.statsToken = {});
+    const poll = async () => {
+      if (token !== this.statsToken || this.pc.signalingState === "closed") {
+        return;
+      }
+      try {
+        const report = await this.pc.getStats();
+        const { summary, totals } = utils.summarizeRTCStats(report, previous);
+        previous = totals;
+        this.send({ msg: "stats", stats: summary });
+      } catch (e) {
+        console.error(this.room_id, "could not get stats", e);
+      }
+      if (token === this.statsToken) {
+        this.statsTimer = setTimeout(poll, delay);
+      }
+    };
+    this.statsTimer = setTimeout(poll, delay);
+  }
+  stop_stats_polling() {
+    this.statsToken = null;
+    if (this.statsTimer !== null) {
+      clearTimeout(this.statsTimer);
+      this.statsTimer = null;
+    }
+  }
   close() {
     //console.log('disconnect')
+    this.stop_stats_polling();
     this.pc.close(); // does not trigger ice conncection status changes
     this.set("connected", false);
+    this.set("data_channel_open", false);
     this.save_changes();
   }
   join() {
@@ -1227,6 +2846,41 @@ export class WebRTCPeerModel extends widgets.DOMWidgetModel {
       });
     });
   }
+  relay(stream) {
+    // forward the tracks of a stream we receive from another peer
+    if (this.relayed[stream.id]) {
+      return;
+    }
+    this.relayed[stream.id] = stream
+      .getTracks()
+      .map((track) => this.pc.addTrack(track, stream));
+    this.renegotiate();
+  }
+  unrelay(stream) {
+    const senders = this.relayed[stream.id];
+    if (!senders) {
+      return;
+    }
+    delete this.relayed[stream.id];
+    if (this.pc.signalingState !== "closed") {
+      senders.forEach((sender) => this.pc.removeTrack(sender));
+      this.renegotiate();
+    }
+  }
+  renegotiate() {
+    // we can only make a new offer when the previous one is answered
+    if (!this.negotiated || this.pc.signalingState !== "stable") {
+      this.renegotiation_pending = true;
+      return;
+    }
+    this.pc
+      .createOffer()
+      .then((sdp) => {
+        this.pc.setLocalDescription(sdp);
+        this.send_sdp(sdp);
+      })
+      .catch((e) => console.error(this.room_id, "renegotiation failed", e));
+  }
   send_sdp(sdp) {
     this.broadcast({ sdp: sdp });
   }
@@ -41,4 +41,35 @@ describe("image recorder >", () => {
     // why does this not compile?
     // expect(mediaImageRecorder.get('data')).to.have.lengthOf(0);
   });
+
+  it("crops and scales down", async function () {
+    const imageRecorder = await create_model_webrtc(
+      this.manager,
+      "ImageRecorder",
+      "mir2",
+      { crop: [0.25, 0.25, 0.5, 0.5], max_width: 160 },
+    );
+    const video = { videoWidth: 640, videoHeight: 480 };
+    expect(imageRecorder.outputRegion(video)).to.deep.equal({
+      x: 160,
+      y: 120,
+      sourceWidth: 320,
+      sourceHeight: 240,
+      width: 160,
+      height: 120,
+    });
+    // the aspect ratio is kept, and images are never scaled up
+    imageRecorder.set({ crop: null, max_width: null, max_height: 100 });
+    expect(imageRecorder.outputRegion(video)).to.deep.include({
+      x: 0,
+      y: 0,
+      width: 133,
+      height: 100,
+    });
+    imageRecorder.set({ max_width: 1000, max_height: null });
+    expect(imageRecorder.outputRegion(video)).to.deep.include({
+      width: 640,
+      height: 480,
+    });
+  });
 });
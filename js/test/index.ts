@@ -1,3 +1,5 @@
 // import all tests here, otherwise if we include them in karma.conf.js it will all be separate bundles
 import "./image-recorder";
 import "./mediastream";
+import "./utils";
+import "./webm";
@@ -1,6 +1,6 @@
 import * as jupyter_webrtc from "../src";
 import { DummyManager } from "./dummy-manager";
-import { create_model_webrtc } from "./widget-utils";
+import { create_model, create_model_webrtc } from "./widget-utils";
 
 describe("VideoStream >", () => {
   beforeEach(async function () {
@@ -31,3 +31,38 @@ describe("VideoStream >", () => {
   //     expect(widget1).to.equal(widget2);
   // });
 });
+
+describe("WidgetStream >", () => {
+  beforeEach(async function () {
+    this.manager = new DummyManager({ "jupyter-webrtc": jupyter_webrtc });
+  });
+
+  it("syncs the capture stats", async function () {
+    await create_model(
+      this.manager,
+      "@jupyter-widgets/controls",
+      "ImageModel",
+      "imageView",
+      "ws_image",
+    );
+    const widgetStream = await create_model_webrtc(
+      this.manager,
+      "WidgetStream",
+      "ws1",
+      { widget: "IPY_MODEL_ws_image" },
+    );
+    // 3 distinct frames out of 4 renders, in the last second
+    widgetStream.captureStats = {
+      start: performance.now() - 1000,
+      frames: 3,
+      renders: [10, 20, 30, 40],
+    };
+    widgetStream.syncCaptureStats();
+    expect(widgetStream.get("capture_fps")).to.be.within(2.5, 3);
+    expect(widgetStream.get("render_time")).to.equal(25);
+    // without renders, the fps drops to 0, the render time is kept
+    widgetStream.syncCaptureStats();
+    expect(widgetStream.get("capture_fps")).to.equal(0);
+    expect(widgetStream.get("render_time")).to.equal(25);
+  });
+});
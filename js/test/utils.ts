@@ -0,0 +1,29 @@
+import { hashPixels, motionScore, rgbaToGray } from "../src/utils";
+
+describe("utils >", () => {
+  it("scores the changed pixels", async function () {
+    const reference = new Uint8ClampedArray([0, 100, 200, 255]);
+    expect(motionScore(reference, reference)).to.equal(0);
+    // sensor noise does not count as a change
+    const noisy = new Uint8ClampedArray([10, 90, 220, 235]);
+    expect(motionScore(reference, noisy)).to.equal(0);
+    const moved = new Uint8ClampedArray([0, 150, 200, 0]);
+    expect(motionScore(reference, moved)).to.equal(0.5);
+  });
+
+  it("converts to gray", async function () {
+    const rgba = new Uint8ClampedArray([
+      255, 255, 255, 255, 0, 0, 0, 255, 255, 0, 0, 255, 0, 255, 0, 0,
+    ]);
+    expect(Array.from(rgbaToGray(rgba))).to.deep.equal([255, 0, 76, 149]);
+  });
+
+  it("hashes the pixels", async function () {
+    const pixels = new Uint8ClampedArray(64 * 48 * 4);
+    const hash = hashPixels(pixels);
+    expect(hashPixels(pixels.slice())).to.equal(hash);
+    // a single changed pixel is a different frame
+    pixels[1000] = 1;
+    expect(hashPixels(pixels)).to.not.equal(hash);
+  });
+});
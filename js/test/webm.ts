@@ -0,0 +1,153 @@
+import { ReplayBuffer, WebMParser } from "../src/webm";
+
+const EBML = [0x1a, 0x45, 0xdf, 0xa3];
+const SEGMENT = [0x18, 0x53, 0x80, 0x67];
+const SEEK_HEAD = [0x11, 0x4d, 0x9b, 0x74];
+const INFO = [0x15, 0x49, 0xa9, 0x66];
+const TRACKS = [0x16, 0x54, 0xae, 0x6b];
+const CLUSTER = [0x1f, 0x43, 0xb6, 0x75];
+const CUES = [0x1c, 0x53, 0xbb, 0x6b];
+const UNKNOWN_SIZE = [0x01, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff];
+const AUDIO = 1;
+const VIDEO = 2;
+
+function uint(value: number, length: number) {
+  const bytes = [];
+  for (let i = 0; i < length; i++) {
+    bytes.unshift(value % 256);
+    value = Math.floor(value / 256);
+  }
+  return bytes;
+}
+
+// sizes are written with four bytes, like MediaRecorder does for most elements
+function element(id: number[], payload: number[]) {
+  return [...id, 0x10, ...uint(payload.length, 3), ...payload];
+}
+
+function block(track: number, timecode: number, keyframe: boolean) {
+  const header = [0x80 | track, ...uint(timecode, 2), keyframe ? 0x80 : 0];
+  return element([0xa3], [...header, 1, 2, 3, 4]);
+}
+
+// a recording like MediaRecorder writes it: a cluster per second with three
+// audio and video frames, the clusters in keyframes start with a keyframe
+function recording(clusters: number, keyframes: number[]) {
+  const trackEntry = (number: number, type: number) =>
+    element(
+      [0xae],
+      [...element([0xd7], [number]), ...element([0x83], [type])],
+    );
+  const bytes = [
+    ...element(EBML, []),
+    ...SEGMENT,
+    ...UNKNOWN_SIZE,
+    ...element(SEEK_HEAD, []),
+    ...element(INFO, element([0x2a, 0xd7, 0xb1], uint(1000000, 3))),
+    ...element(TRACKS, [...trackEntry(AUDIO, 2), ...trackEntry(VIDEO, 1)]),
+  ];
+  for (let cluster = 0; cluster < clusters; cluster++) {
+    bytes.push(...CLUSTER, ...UNKNOWN_SIZE);
+    bytes.push(...element([0xe7], uint(cluster * 1000, 4)));
+    for (let i = 0; i < 3; i++) {
+      bytes.push(...block(AUDIO, i * 300, true));
+      const keyframe = i === 0 && keyframes.includes(cluster);
+      bytes.push(...block(VIDEO, i * 300 + 10, keyframe));
+    }
+  }
+  bytes.push(...element(CUES, []));
+  return new Uint8Array(bytes);
+}
+
+function parse(data: Uint8Array, chunkSize: number) {
+  const clusters = [];
+  const parser = new WebMParser((cluster) => clusters.push(cluster));
+  for (let offset = 0; offset < data.length; offset += chunkSize) {
+    parser.push(data.slice(offset, offset + chunkSize));
+  }
+  return { parser, clusters };
+}
+
+function concat(parts: Uint8Array[]) {
+  const bytes = [];
+  for (const part of parts) {
+    bytes.push(...part);
+  }
+  return new Uint8Array(bytes);
+}
+
+describe("WebMParser >", () => {
+  it("splits the init segment and clusters", async function () {
+    const { parser, clusters } = parse(recording(3, [0, 2]), 1 << 20);
+    expect(
+      clusters.map((cluster) => [
+        cluster.timecode,
+        cluster.time,
+        cluster.end,
+        cluster.keyframe,
+      ]),
+    ).to.deep.equal([
+      [0, 0, 610, true],
+      [1000, 1000, 1610, false],
+      [2000, 2000, 2610, true],
+    ]);
+    expect(Array.from(parser.videoTracks)).to.deep.equal([VIDEO]);
+    // the seek head and cues are not valid after trimming
+    const init = Array.from(parser.initSegment);
+    expect(init.slice(0, 4)).to.deep.equal(EBML);
+    expect(init.slice(8, 20)).to.deep.equal([...SEGMENT, ...UNKNOWN_SIZE]);
+    expect(init.slice(20, 24)).to.deep.equal(INFO);
+    expect(init.length).to.equal(
+      recording(0, []).length - 8 - 8, // the empty seek head and cues
+    );
+  });
+
+  it("parses data in any chunk size", async function () {
+    const data = recording(3, [0, 2]);
+    const whole = parse(data, 1 << 20);
+    for (const chunkSize of [1, 7, 100]) {
+      const { parser, clusters } = parse(data, chunkSize);
+      expect(parser.initSegment).to.deep.equal(whole.parser.initSegment);
+      expect(clusters.map((cluster) => concat(cluster.parts))).to.deep.equal(
+        whole.clusters.map((cluster) => concat(cluster.parts)),
+      );
+    }
+  });
+});
+
+describe("ReplayBuffer >", () => {
+  it("trims at keyframes", async function () {
+    const buffer = new ReplayBuffer(2000);
+    buffer.push(recording(6, [0, 2, 4]));
+    // the last block is at 5610, the keyframe at 4000 is too late for 2000 ms
+    expect(buffer.clusters.map((cluster) => cluster.timecode)).to.deep.equal([
+      2000, 3000, 4000, 5000,
+    ]);
+    expect(buffer.span).to.equal(3610);
+    expect(buffer.stale).to.equal(false);
+  });
+
+  it("cannot trim without keyframes", async function () {
+    const buffer = new ReplayBuffer(1000);
+    buffer.push(recording(8, [0]));
+    expect(buffer.clusters.length).to.equal(8);
+    expect(buffer.stale).to.equal(true);
+  });
+
+  it("rebases the timecodes", async function () {
+    const buffer = new ReplayBuffer(2000);
+    buffer.push(recording(6, [0, 2, 4]));
+    const data = concat(buffer.parts());
+    expect(data.length).to.equal(
+      buffer.parser.initSegment.length + buffer.size,
+    );
+    // the result parses again, and starts at zero
+    const { clusters } = parse(data, 1 << 20);
+    expect(clusters.map((cluster) => cluster.timecode)).to.deep.equal([
+      0, 1000, 2000, 3000,
+    ]);
+    expect(clusters[0].keyframe).to.equal(true);
+    // the timecodes in the buffer itself are unchanged
+    expect(buffer.clusters[0].timecode).to.equal(2000);
+  });
+});